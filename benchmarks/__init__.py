@@ -0,0 +1 @@
+"""Benchmarks of paperplumber on synthetic corpora"""
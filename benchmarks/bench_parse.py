@@ -0,0 +1,382 @@
+"""
+The benchmarks of paperplumber parse on synthetic corpora, with the local embedding and language models.
+
+Every scenario runs in a fresh process, so that its peak memory is its own, and reports the papers and
+pages parsed per second, the prompts sent to the language model per paper and the peak RSS. The results
+can be saved as a baseline, and later runs compared with it to catch regressions, e.g.
+
+    python -m benchmarks.bench_parse --save benchmarks/baselines/default.json
+    python -m benchmarks.bench_parse --compare benchmarks/baselines/default.json
+"""
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from multiprocessing import get_context
+from typing import Dict, List, Optional, Tuple
+from unittest import mock
+
+import typer
+from rich.console import Console
+from rich.table import Table
+
+from benchmarks.synthetic import TARGETS, make_corpus
+
+# The metrics compared with a baseline, and whether higher values are better
+METRICS = {
+    "papers_per_second": True,
+    "pages_per_second": True,
+    "llm_calls_per_paper": False,
+    "peak_rss_mb": False,
+}
+
+
+@dataclass(frozen=True)
+class Scenario:
+    """
+    A benchmark on a synthetic corpus.
+
+    Attributes:
+    name (str): The name of the scenario in the reports and baselines.
+    papers (int): The number of papers of the corpus.
+    pages (int): The number of pages of every paper.
+    args (Tuple[str, ...]): The options of paperplumber parse, on top of the local models.
+    component (Optional[str]): The component benchmarked alone (pdf_parser, embedding_search or
+        file_scanner), or None to run paperplumber parse end to end.
+    """
+
+    name: str
+    papers: int
+    pages: int
+    args: Tuple[str, ...] = ()
+    component: Optional[str] = None
+
+
+SCENARIOS = [
+    Scenario("parse-dense", papers=20, pages=10),
+    Scenario("parse-lexical", papers=20, pages=10, args=("--retrieval", "lexical")),
+    Scenario("parse-pipeline", papers=20, pages=10, args=("--pipeline",)),
+    Scenario(
+        "parse-large-lazy",
+        papers=2,
+        pages=100,
+        args=("-f", "--lazy-pages", "--llm-concurrency", "8"),
+    ),
+    Scenario("pdf-parser", papers=20, pages=10, component="pdf_parser"),
+    Scenario("embedding-search", papers=20, pages=10, component="embedding_search"),
+    Scenario("file-scanner", papers=5, pages=10, component="file_scanner"),
+]
+
+
+def _peak_rss_mb() -> float:
+    """Returns the peak RSS of this process and its children in megabytes."""
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _with_latency(method, latency: float):
+    def slow_method(self, *args, **kwargs):
+        time.sleep(latency)
+        return method(self, *args, **kwargs)
+
+    return slow_method
+
+
+def _parse(scenario: Scenario, corpus: str, llm_latency: float) -> None:
+    """Runs paperplumber parse on the corpus, without caches."""
+    # pylint: disable=import-outside-toplevel
+    from paperplumber.main import app
+
+    app(
+        [
+            "parse",
+            corpus,
+            *TARGETS,
+            "--embedding",
+            "hashing",
+            "--llm-backend",
+            "fake",
+            "--fake-latency",
+            str(llm_latency),
+            "--no-cache",
+            *scenario.args,
+        ],
+        prog_name="paperplumber",
+        standalone_mode=False,
+    )
+
+
+def _run_component(scenario: Scenario, corpus: str, llm_latency: float) -> float:
+    """Runs a component alone on the pdfs of the corpus, and returns the seconds it took."""
+    # pylint: disable=import-outside-toplevel
+    from paperplumber.parsing.embedding_search import EmbeddingSearcher
+    from paperplumber.parsing.file_scan import FileScanner
+    from paperplumber.parsing.llm_backend import LLMBackend, LLMSettings
+    from paperplumber.parsing.local_embedding import HashingEmbeddings
+    from paperplumber.parsing.pdf_parser import PDFParser
+
+    paths = sorted(
+        os.path.join(corpus, "pdfs", name)
+        for name in os.listdir(os.path.join(corpus, "pdfs"))
+    )
+    start = time.perf_counter()
+    if scenario.component == "pdf_parser":
+        for path in paths:
+            _ = PDFParser(path).pages
+        return time.perf_counter() - start
+
+    pages = {path: PDFParser(path).pages for path in paths}
+    start = time.perf_counter()
+    if scenario.component == "embedding_search":
+        for path in paths:
+            searcher = EmbeddingSearcher(
+                path, embedder=HashingEmbeddings(), pages=pages[path]
+            )
+            for target in TARGETS:
+                searcher.similarity_search(target)
+    elif scenario.component == "file_scanner":
+        llm = LLMSettings(backend=LLMBackend.FAKE, fake_latency=llm_latency)
+        for path in paths:
+            FileScanner.from_pages(pages[path]).scan_targets(TARGETS, llm=llm)
+    else:
+        raise ValueError(f"Unknown component {scenario.component}")
+    return time.perf_counter() - start
+
+
+def run_scenario(
+    scenario: Scenario,
+    corpus: str,
+    llm_latency: float = 0.01,
+    embedding_latency: float = 0.001,
+) -> Dict[str, float]:
+    """
+    Runs a scenario on a copy of a synthetic corpus in this process, and returns its metrics.
+
+    The latencies are slept by every prompt of the fake language model and every request to the
+    hashing embedding model, to stand for the round trips to an API.
+
+    Args:
+        scenario (Scenario): The scenario to run.
+        corpus (str): The directory of the synthetic corpus, which is left untouched.
+        llm_latency (float): The seconds taken by every prompt.
+        embedding_latency (float): The seconds taken by every embedding request.
+
+    Returns:
+        Dict[str, float]: The metrics of the scenario.
+    """
+    # pylint: disable=import-outside-toplevel
+    from paperplumber.parsing.llm_backend import FakeLLM
+    from paperplumber.parsing.local_embedding import HashingEmbeddings
+
+    calls = []
+    respond = FakeLLM.respond
+
+    def counted_respond(self, prompt):
+        calls.append(1)
+        return respond(self, prompt)
+
+    # The warnings of every paper about its multiple values would drown the report
+    logging.disable(logging.WARNING)
+    try:
+        with tempfile.TemporaryDirectory() as directory, mock.patch.object(
+            FakeLLM, "respond", counted_respond
+        ), mock.patch.object(
+            HashingEmbeddings,
+            "embed_documents",
+            _with_latency(HashingEmbeddings.embed_documents, embedding_latency),
+        ), mock.patch.object(
+            HashingEmbeddings,
+            "embed_query",
+            _with_latency(HashingEmbeddings.embed_query, embedding_latency),
+        ):
+            copy = shutil.copytree(corpus, os.path.join(directory, "corpus"))
+            start = time.perf_counter()
+            if scenario.component is None:
+                _parse(scenario, copy, llm_latency)
+                seconds = time.perf_counter() - start
+            else:
+                seconds = _run_component(scenario, copy, llm_latency)
+    finally:
+        logging.disable(logging.NOTSET)
+
+    return {
+        "seconds": seconds,
+        "papers_per_second": scenario.papers / seconds,
+        "pages_per_second": scenario.papers * scenario.pages / seconds,
+        "llm_calls_per_paper": len(calls) / scenario.papers,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def run_benchmarks(
+    scenarios: List[Scenario],
+    llm_latency: float = 0.01,
+    embedding_latency: float = 0.001,
+    seed: int = 0,
+) -> Dict[str, Dict[str, float]]:
+    """
+    Runs every scenario in a fresh process, on the synthetic corpus of its size.
+
+    Returns:
+        Dict[str, Dict[str, float]]: The metrics of every scenario, by name.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        corpora = {}
+        for scenario in scenarios:
+            size = (scenario.papers, scenario.pages)
+            if size not in corpora:
+                corpora[size] = make_corpus(
+                    os.path.join(directory, f"{size[0]}x{size[1]}"), *size, seed=seed
+                )
+            with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+                results[scenario.name] = executor.submit(
+                    run_scenario,
+                    scenario,
+                    corpora[size],
+                    llm_latency,
+                    embedding_latency,
+                ).result()
+    return results
+
+
+def compare(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    tolerance: float = 0.25,
+) -> List[str]:
+    """
+    Compares the metrics of a run with a baseline.
+
+    Args:
+        results (Dict[str, Dict[str, float]]): The metrics of the run, by scenario.
+        baseline (Dict[str, Dict[str, float]]): The metrics of the baseline, by scenario.
+        tolerance (float): The max fraction by which a metric may be worse than in the baseline.
+
+    Returns:
+        List[str]: A description of every metric worse than in the baseline beyond the tolerance.
+    """
+    regressions = []
+    for name, metrics in results.items():
+        for metric, higher_is_better in METRICS.items():
+            if name not in baseline or metric not in baseline[name]:
+                continue
+            value, reference = metrics[metric], baseline[name][metric]
+            if higher_is_better:
+                worse = value < reference * (1 - tolerance)
+            else:
+                worse = value > reference * (1 + tolerance) + 1e-9
+            if worse:
+                regressions.append(
+                    f"{name}: {metric} is {value:.4g}, against {reference:.4g} in the baseline"
+                )
+    return regressions
+
+
+def _print_results(
+    results: Dict[str, Dict[str, float]], baseline: Optional[Dict] = None
+) -> None:
+    table = Table(title="paperplumber parse benchmarks")
+    table.add_column("Scenario")
+    for metric in ["seconds", *METRICS]:
+        table.add_column(metric, justify="right")
+    for name, metrics in results.items():
+        cells = []
+        for metric in ["seconds", *METRICS]:
+            cell = f"{metrics[metric]:.4g}"
+            if baseline and metric in baseline.get(name, {}):
+                cell += f" ({baseline[name][metric]:.4g})"
+            cells.append(cell)
+        table.add_row(name, *cells)
+    Console(width=120).print(table)
+
+
+def main(
+    scenarios: List[str] = typer.Argument(
+        None, help="The names of the scenarios to run, by default all of them"
+    ),
+    llm_latency: float = typer.Option(
+        0.01,
+        "--llm-latency",
+        show_default=True,
+        help="The seconds taken by every prompt of the fake language model",
+    ),
+    embedding_latency: float = typer.Option(
+        0.001,
+        "--embedding-latency",
+        show_default=True,
+        help="The seconds taken by every request to the hashing embedding model",
+    ),
+    seed: int = typer.Option(
+        0, "--seed", show_default=True, help="The seed of the synthetic corpora"
+    ),
+    save: str = typer.Option(
+        None, "--save", show_default=True, help="A file path to save the results to"
+    ),
+    compare_with: str = typer.Option(
+        None,
+        "--compare",
+        show_default=True,
+        help="A file path of saved results to compare with, exiting with 1 on a regression",
+    ),
+    tolerance: float = typer.Option(
+        0.25,
+        "--tolerance",
+        show_default=True,
+        help="The max fraction by which a metric may be worse than in the saved results",
+    ),
+):
+    """Runs the benchmarks of paperplumber parse on synthetic corpora."""
+    selected = [
+        scenario
+        for scenario in SCENARIOS
+        if not scenarios or scenario.name in scenarios
+    ]
+    if not selected:
+        typer.echo(f"Unknown scenarios {scenarios}")
+        raise typer.Exit(code=2)
+
+    results = run_benchmarks(selected, llm_latency, embedding_latency, seed)
+    baseline = None
+    if compare_with:
+        with open(compare_with, "r", encoding="utf-8") as file:
+            baseline = json.load(file)["results"]
+    _print_results(results, baseline)
+
+    if save:
+        with open(save, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "machine": platform.platform(),
+                    "python": platform.python_version(),
+                    "llm_latency": llm_latency,
+                    "embedding_latency": embedding_latency,
+                    "seed": seed,
+                    "scenarios": {scenario.name: asdict(scenario) for scenario in selected},
+                    "results": results,
+                },
+                file,
+                indent=2,
+            )
+
+    if baseline is not None:
+        regressions = compare(results, baseline, tolerance)
+        for regression in regressions:
+            typer.echo(f"Regression in {regression}")
+        if regressions:
+            raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
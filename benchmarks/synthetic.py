@@ -0,0 +1,126 @@
+"""This module generates synthetic corpora of pdfs for the benchmarks"""
+import json
+import os
+import random
+import textwrap
+from typing import List
+
+# The words the text of the synthetic papers is drawn from
+WORDS = """
+    protein folding kinetics transition state barrier native contact order topology
+    residue mutant wild type denaturant urea guanidinium equilibrium unfolding helix
+    sheet loop domain hydrophobic core stability free energy measured observed rate
+    constant relaxation stopped flow fluorescence spectroscopy temperature dependence
+    analysis model simulation molecular dynamics ensemble structure sequence length
+    chain collapse intermediate pathway landscape funnel cooperative two state fit
+    experiment data figure table supplementary method sample buffer concentration
+    qubit coherence gate error fidelity transmon resonator flux magnetic cavity noise
+""".split()
+
+# The sentences holding the values a benchmark extracts, with the target first
+VALUE_SENTENCES = [
+    ("folding rate", "The folding rate of the mutant was {value:.1f} s^-1 at 25 C."),
+    ("melting temperature", "The melting temperature was {value:.1f} K in buffer."),
+    ("coherence time", "We measured a coherence time of {value:.1f} us for the qubit."),
+]
+
+TARGETS = [target for target, _ in VALUE_SENTENCES]
+
+PAGE_WIDTH, PAGE_HEIGHT = 612, 792
+LINE_HEIGHT = 12
+LINES_PER_PAGE = 55
+CHARACTERS_PER_LINE = 95
+
+
+def _escape(line: str) -> str:
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, pages: List[str]) -> None:
+    """
+    Writes a minimal pdf file with a page of Helvetica text for every string, one line per line of the string.
+
+    Args:
+        path (str): The path of the pdf file.
+        pages (List[str]): The text of every page, ASCII only.
+    """
+    kids = " ".join(f"{4 + 2 * i} 0 R" for i in range(len(pages)))
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, page in enumerate(pages):
+        lines = "\n".join(f"({_escape(line)}) '" for line in page.splitlines())
+        stream = f"BT /F1 10 Tf {LINE_HEIGHT} TL 50 {PAGE_HEIGHT - 30} Td\n{lines}\nET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>"
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+
+    content = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(content))
+        content += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(content)
+    content += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    content += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode(
+        "latin-1"
+    )
+    content += (
+        f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n"
+        f"startxref\n{xref}\n%%EOF\n"
+    ).encode("latin-1")
+    with open(path, "wb") as file:
+        file.write(content)
+
+
+def make_page(rng: random.Random, value_probability: float = 0.2) -> str:
+    """Returns the text of a page of random words, holding the value of some targets."""
+    words = [rng.choice(WORDS) for _ in range(LINES_PER_PAGE * 12)]
+    sentences = [
+        sentence.format(value=rng.uniform(1, 1000))
+        for _, sentence in VALUE_SENTENCES
+        if rng.random() < value_probability
+    ]
+    # The sentences are kept on a single line, so that the extracted text quotes them whole
+    for sentence in sentences:
+        words.insert(rng.randrange(len(words)), sentence.replace(" ", "\0"))
+    lines = textwrap.wrap(" ".join(words), CHARACTERS_PER_LINE)
+    return "\n".join(line.replace("\0", " ") for line in lines[:LINES_PER_PAGE])
+
+
+def make_corpus(directory: str, papers: int, pages: int, seed: int = 0) -> str:
+    """
+    Creates a paperplumber database of synthetic papers, as after ``paperplumber download``.
+
+    The papers are deterministic for a given seed, and every page has a chance to quote the value
+    of each of the TARGETS.
+
+    Args:
+        directory (str): The directory of the database.
+        papers (int): The number of papers.
+        pages (int): The number of pages of every paper.
+        seed (int): The seed of the random text.
+
+    Returns:
+        str: The directory of the database.
+    """
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(directory, "pdfs"), exist_ok=True)
+    entries = []
+    for number in range(papers):
+        title = f"synthetic-{number:04d}"
+        write_pdf(
+            os.path.join(directory, "pdfs", f"{title}.pdf"),
+            [make_page(rng) for _ in range(pages)],
+        )
+        entries.append({"title": title, "pages": pages})
+
+    with open(os.path.join(directory, "papers.json"), "w", encoding="utf-8") as file:
+        json.dump(
+            {"query": "synthetic", "number_of_papers": papers, "papers": entries}, file
+        )
+    return directory
@@ -1,6 +1,14 @@
 """A python package for managing academic papers and plumbing information."""
 
-from .database import FindPapersDatabase
+import importlib
+
 from .logger import get_logger
 
 __version__ = "0.1.0"
+
+
+def __getattr__(name: str):
+    # The database imports findpapers, which is slow to import, only when it is used
+    if name == "FindPapersDatabase":
+        return importlib.import_module(".database", __name__).FindPapersDatabase
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
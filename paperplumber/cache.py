@@ -0,0 +1,176 @@
+""" Utils for content-addressed on-disk caches """
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Any, Callable, Optional
+
+from paperplumber.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Returns the SHA-256 hex digest of the contents of a file.
+
+    Args:
+        path (str): The path to the file.
+        chunk_size (int): The number of bytes read at a time.
+
+    Returns:
+        str: The hex digest of the file contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_key(*parts: Any) -> str:
+    """
+    Builds a cache key from any number of JSON-serialisable parts.
+
+    Returns:
+        str: The hex digest identifying the given parts.
+    """
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """
+    A directory of cache entries with a size cap and least-recently-used eviction.
+
+    Each entry is a directory named after its key, so a cached value can be made of
+    several files. Entries are written to a temporary directory first and renamed into
+    place, so concurrent readers never see a half-written entry. Every hit refreshes the
+    entry's modification time, which is what the eviction order is based on.
+
+    Attributes:
+    directory (str): The directory holding the cache entries.
+    max_size (Optional[int]): The maximum total size of the entries in bytes, or None for no limit.
+    hits (int): The number of lookups that found an entry.
+    misses (int): The number of lookups that did not find an entry.
+    """
+
+    _TMP_PREFIX = ".tmp-"
+
+    def __init__(self, directory: str, max_size: Optional[int] = None) -> None:
+        """
+        Initialize a new instance of the DiskCache class.
+
+        Parameters:
+        directory (str): The directory holding the cache entries. It is created if needed.
+        max_size (Optional[int]): The maximum total size of the entries in bytes.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Looks up an entry and marks it as recently used.
+
+        Parameters:
+        key (str): The key of the entry.
+
+        Returns:
+        The path to the entry directory, or None if the entry is not cached.
+        """
+        path = self._entry_path(key)
+        if not os.path.isdir(path):
+            self.misses += 1
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            # The entry was evicted by another process in the meantime
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return path
+
+    def put(self, key: str, writer: Callable[[str], None]) -> str:
+        """
+        Stores an entry, then evicts the least recently used entries if the cache is over its size cap.
+
+        Parameters:
+        key (str): The key of the entry.
+        writer (Callable[[str], None]): A function writing the entry files into the directory it is given.
+
+        Returns:
+        The path to the entry directory.
+        """
+        path = self._entry_path(key)
+        tmp_path = tempfile.mkdtemp(prefix=self._TMP_PREFIX, dir=self.directory)
+        try:
+            writer(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError:
+            # Another process stored the same entry first
+            if not os.path.isdir(path):
+                raise
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        self.evict()
+        return path
+
+    def _entries(self):
+        for name in os.listdir(self.directory):
+            if name.startswith(self._TMP_PREFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path):
+                yield path
+
+    @staticmethod
+    def _entry_size(path: str) -> int:
+        size = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    size += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return size
+
+    def size(self) -> int:
+        """Returns the total size of the cached entries in bytes."""
+        return sum(self._entry_size(path) for path in self._entries())
+
+    def evict(self) -> None:
+        """Removes the least recently used entries until the cache fits in its size cap."""
+        if self.max_size is None:
+            return
+
+        entries = []
+        for path in self._entries():
+            try:
+                entries.append((os.path.getmtime(path), self._entry_size(path), path))
+            except OSError:
+                continue
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            logger.debug("Evicting cache entry %s", path)
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self) -> None:
+        """Removes every entry from the cache."""
+        for path in list(self._entries()):
+            shutil.rmtree(path, ignore_errors=True)
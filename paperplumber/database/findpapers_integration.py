@@ -1,10 +1,9 @@
 """ A wrapper module for the findpapers (https://github.com/jonatasgrosman/findpapers) package"""
 
 import os
-import json
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, Iterator, List, Optional
 import functools
-import findpapers
+from paperplumber.database.local import PaperQuery, PapersIndex
 from paperplumber.logger import get_logger
 
 logger = get_logger(__name__)
@@ -13,6 +12,10 @@ logger = get_logger(__name__)
 class FindPapersDatabase:
     """
     A wrapper class for the findpapers
+
+    The findpapers package is slow to import, so it is only imported once the search, refine or
+    download wrapper is first used. The papers are listed from a SQLite index of the JSON file, which
+    is rebuilt only when the file changes, instead of loading the whole file every time.
     """
 
     def __init__(self, path: str) -> None:
@@ -24,7 +27,17 @@ class FindPapersDatabase:
 
         """
 
-        # Create wrapper functions for the findpapers package
+        # Check if the path is valid
+        self.path = path
+
+        # Make dir to that directory
+        self._create_directory()
+
+    @functools.cached_property
+    def search(self) -> Callable[..., List[Dict[str, Any]]]:
+        """The findpapers search, writing its results to the JSON file of the database."""
+        import findpapers  # pylint: disable=import-outside-toplevel
+
         @functools.wraps(findpapers.search)
         def search(**kwargs) -> List[Dict[str, Any]]:
             json_path = self._get_json_path()
@@ -38,6 +51,13 @@ class FindPapersDatabase:
             kwargs["outputpath"] = json_path
             return findpapers.search(**kwargs)
 
+        return search
+
+    @functools.cached_property
+    def refine(self) -> Callable[..., List[Dict[str, Any]]]:
+        """The findpapers refine, on the JSON file of the database."""
+        import findpapers  # pylint: disable=import-outside-toplevel
+
         @functools.wraps(findpapers.refine)
         def refine(**kwargs) -> List[Dict[str, Any]]:
             json_path = self._get_json_path()
@@ -51,6 +71,13 @@ class FindPapersDatabase:
             kwargs["search_path"] = json_path
             return findpapers.refine(**kwargs)
 
+        return refine
+
+    @functools.cached_property
+    def download(self) -> Callable[..., List[Dict[str, Any]]]:
+        """The findpapers download, of the papers of the JSON file of the database to its pdfs directory."""
+        import findpapers  # pylint: disable=import-outside-toplevel
+
         @functools.wraps(findpapers.download)
         def download(**kwargs) -> List[Dict[str, Any]]:
             json_path = self._get_json_path()
@@ -73,17 +100,16 @@ class FindPapersDatabase:
             kwargs["output_directory"] = output_directory
             return findpapers.download(**kwargs)
 
-        self.search = search
-        self.refine = refine
-        self.download = download
-
-        self._loaded_info = None
+        return download
 
-        # Check if the path is valid
-        self.path = path
-
-        # Make dir to that directory
-        self._create_directory()
+    @functools.cached_property
+    def index(self) -> PapersIndex:
+        """The SQLite index of the papers of the JSON file of the database."""
+        return PapersIndex(
+            self._get_json_path(),
+            self.get_cache_path("papers.sqlite"),
+            pdf_directory=os.path.join(self.path, "pdfs"),
+        )
 
     def _get_json_path(self) -> str:
         """
@@ -94,45 +120,58 @@ class FindPapersDatabase:
         """
         return os.path.join(self.path, "papers.json")
 
-    def _create_directory(self) -> None:
+    def get_cache_path(self, name: Optional[str] = None) -> str:
         """
-        Creates a new directory at the specified path if it does not already exist.
+        Returns the path to a cache of the database.
+
+        Args:
+            name (Optional[str]): The name of the cache. If not given, the directory holding all the caches is returned.
+
+        Returns:
+            str: The path to the cache.
         """
-        os.makedirs(self.path, exist_ok=True)
+        if name is None:
+            return os.path.join(self.path, ".cache")
+        return os.path.join(self.path, ".cache", name)
 
-    def _load_json(self) -> None:
+    def _create_directory(self) -> None:
         """
-        Loads a JSON file from the specified path and saves it to the _loaded_info attribute.
+        Creates a new directory at the specified path if it does not already exist.
         """
-        if self._loaded_info is not None:
-            return
-
-        with open(
-            os.path.join(self.path, "papers.json"), "r", encoding="utf-8"
-        ) as file:
-            self._loaded_info = json.load(file)
+        os.makedirs(self.path, exist_ok=True)
 
     def list_available_papers(self) -> List[Dict[str, Any]]:
         """
-        Returns a list of available papers in the database.
+        Returns a list of available papers in the database, from the index of the JSON file.
 
         Returns:
             List[Dict[str, Any]]: The list of papers.
         """
-        self._load_json()
+        return list(self.iter_available_papers())
 
-        papers = self._loaded_info["papers"]
-        return papers
-
-    def list_downloaded_papers(self) -> List[Dict[str, Any]]:
+    def iter_available_papers(
+        self, query: Optional[PaperQuery] = None
+    ) -> Iterator[Dict[str, Any]]:
         """
-        Returns a list of downloaded papers in the database.
+        Yields the available papers in the database matching a query, one at a time.
+
+        Args:
+            query (Optional[PaperQuery]): The filters, order and page of the papers. By default, every
+                paper is yielded in the order of the search results.
 
         Returns:
-            List[Dict[str, Any]]: The list of papers.
+            Iterator[Dict[str, Any]]: The papers.
         """
-        self._load_json()
+        return self.index.iter_papers(query)
 
+    def list_downloaded_papers(self) -> List[str]:
+        """
+        Returns a list of downloaded papers in the database, from the index of the JSON file and
+        of the pdfs directory, which also lists the pdfs added by hand.
+
+        Returns:
+            List[str]: The file names of the pdfs of the papers.
+        """
         pdf_path = os.path.join(self.path, "pdfs")
 
         if not os.path.exists(pdf_path):
@@ -140,6 +179,4 @@ class FindPapersDatabase:
                 "No downloaded papers find. Please run `paperplumber download [path]` to download them first."
             )
 
-        pdfs = [x for x in os.listdir(pdf_path) if x.endswith(".pdf")]
-
-        return pdfs
+        return self.index.downloaded_pdfs()
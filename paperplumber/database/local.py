@@ -0,0 +1,382 @@
+"""This module implements a local SQLite index of the papers of a database, built from its papers.json"""
+import json
+import os
+import re
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from paperplumber.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def pdf_filename(paper: Dict[str, Any]) -> Optional[str]:
+    """
+    Returns the name of the file findpapers downloads the pdf of a paper to, or None if the paper
+    has no title or publication date.
+    """
+    title, date = paper.get("title"), paper.get("publication_date")
+    if not title or not date:
+        return None
+    return re.sub(r"[^\w\d-]", "_", f"{str(date)[:4]}-{title}") + ".pdf"
+
+
+class PaperOrder(str, Enum):
+    """
+    The order the papers are listed in: the order of the search results (search), by publication date
+    (date), or by title (title).
+    """
+
+    SEARCH = "search"
+    DATE = "date"
+    TITLE = "title"
+
+
+def _like(text: str) -> str:
+    """Returns a case-insensitive LIKE pattern matching the texts containing the given one."""
+    return "%" + re.sub(r"([\\%_])", r"\\\1", text) + "%"
+
+
+@dataclass
+class PaperPage:
+    """
+    The order of the papers of a PaperQuery, and the page of them listed.
+
+    Attributes
+    ----------
+    order : PaperOrder
+        The order of the papers.
+    descending : bool
+        Whether the order is reversed.
+    limit : Optional[int]
+        The max number of papers, or None for all of them.
+    offset : int
+        The number of papers skipped first.
+    """
+
+    order: PaperOrder = PaperOrder.SEARCH
+    descending: bool = False
+    limit: Optional[int] = None
+    offset: int = 0
+
+    def order_by(self) -> str:
+        """Returns the ORDER BY clause of the order, ending with the order of the search results."""
+        direction = " DESC" if self.descending else ""
+        columns = {
+            PaperOrder.SEARCH: [],
+            PaperOrder.DATE: ["publication_date"],
+            PaperOrder.TITLE: ["title COLLATE NOCASE"],
+        }[PaperOrder(self.order)]
+        return " ORDER BY " + ", ".join(
+            [column + direction for column in columns] + ["position" + direction]
+        )
+
+    def is_partial(self) -> bool:
+        """Returns whether some of the papers are left out of the page."""
+        return self.limit is not None or self.offset > 0
+
+
+@dataclass
+class PaperQuery:
+    """
+    A query of the papers of a PapersIndex. Every filter left to None matches every paper.
+
+    Attributes
+    ----------
+    title : Optional[str]
+        A text the title must contain, ignoring the case.
+    author : Optional[str]
+        A text the name of one of the authors must contain, ignoring the case.
+    database : Optional[str]
+        The name of a database the paper must be found in, ignoring the case.
+    since : Optional[str]
+        The earliest publication date, e.g. 2018 or 2018-11-27.
+    until : Optional[str]
+        The latest publication date, e.g. 2020 for the end of 2020.
+    downloaded : Optional[bool]
+        Whether the pdf of the paper must be downloaded (True) or not (False).
+    page : PaperPage
+        The order of the papers and the page of them listed.
+    """
+
+    title: Optional[str] = None
+    author: Optional[str] = None
+    database: Optional[str] = None
+    since: Optional[str] = None
+    until: Optional[str] = None
+    downloaded: Optional[bool] = None
+    page: PaperPage = field(default_factory=PaperPage)
+
+    def where(self) -> Tuple[str, List[Any]]:
+        """Returns the WHERE clause of the filters, if any, and its parameters."""
+        conditions, parameters = [], []
+        if self.title is not None:
+            conditions.append("title LIKE ? ESCAPE '\\'")
+            parameters.append(_like(self.title))
+        if self.author is not None:
+            # The authors are stored as a JSON list, so the names are matched within it
+            conditions.append("authors LIKE ? ESCAPE '\\'")
+            parameters.append(_like(self.author))
+        if self.database is not None:
+            conditions.append("databases LIKE ? ESCAPE '\\'")
+            parameters.append(_like(json.dumps(self.database, ensure_ascii=False)))
+        if self.since is not None:
+            conditions.append("publication_date >= ?")
+            parameters.append(self.since)
+        if self.until is not None:
+            # Only the part of the dates as precise as the given one is compared, so 2020 includes all of 2020
+            conditions.append("substr(publication_date, 1, ?) <= ?")
+            parameters.extend([len(self.until), self.until])
+        if self.downloaded is not None:
+            conditions.append("downloaded = ?")
+            parameters.append(int(self.downloaded))
+        if not conditions:
+            return "", parameters
+        return " WHERE " + " AND ".join(conditions), parameters
+
+
+class PapersIndex:
+    """
+    A SQLite index of the papers of the papers.json file of a database.
+
+    The index is rebuilt from the JSON file only when the size or the modification time of the file
+    change, and whether the pdf of every paper is downloaded is updated only when the pdfs directory
+    changes, so that listing the papers does not load the whole JSON file every time. Every paper has
+    a row with its title, DOI, publication date, authors, databases and pdf file name, along with its
+    whole record. The database runs in WAL mode with a busy timeout, so it can be shared by concurrent
+    processes, and an instance can be shared by threads.
+
+    Attributes
+    ----------
+    json_path : str
+        The path to the papers.json file.
+    path : str
+        The path to the SQLite database.
+    pdf_directory : Optional[str]
+        The directory of the downloaded pdfs, if any.
+
+    Methods
+    -------
+    refresh():
+        Rebuilds the index if the JSON file or the pdfs directory changed.
+    iter_papers(query: Optional[PaperQuery] = None):
+        Yields the records of the papers matching a query, one at a time.
+    downloaded_pdfs():
+        Returns the file names of the downloaded pdfs.
+    """
+
+    # Bumped whenever the tables or their contents change, to rebuild the indexes of older versions
+    SCHEMA_VERSION = 3
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS papers (
+        position INTEGER PRIMARY KEY,
+        title TEXT,
+        doi TEXT,
+        publication_date TEXT,
+        authors TEXT,
+        databases TEXT,
+        pdf_filename TEXT,
+        downloaded INTEGER NOT NULL DEFAULT 0,
+        record TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS papers_title ON papers (title);
+    CREATE INDEX IF NOT EXISTS papers_doi ON papers (doi);
+    CREATE INDEX IF NOT EXISTS papers_publication_date ON papers (publication_date);
+    CREATE INDEX IF NOT EXISTS papers_pdf_filename ON papers (pdf_filename);
+    CREATE INDEX IF NOT EXISTS papers_downloaded ON papers (downloaded);
+    CREATE TABLE IF NOT EXISTS pdfs (
+        name TEXT PRIMARY KEY
+    );
+    CREATE TABLE IF NOT EXISTS sources (
+        name TEXT PRIMARY KEY,
+        stamp TEXT NOT NULL
+    );
+    """
+
+    def __init__(self, json_path: str, path: str, pdf_directory: Optional[str] = None):
+        self.json_path = json_path
+        self.path = path
+        self.pdf_directory = pdf_directory
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        if self._connection.execute("PRAGMA user_version").fetchone()[0] != (
+            self.SCHEMA_VERSION
+        ):
+            self._connection.executescript(
+                "DROP TABLE IF EXISTS papers; DROP TABLE IF EXISTS pdfs;"
+                "DROP TABLE IF EXISTS sources;"
+                f"PRAGMA user_version = {self.SCHEMA_VERSION};"
+            )
+        self._connection.executescript(self._SCHEMA)
+
+    @staticmethod
+    def _stamp(path: str) -> str:
+        """Returns a stamp that changes whenever a file or directory changes, or 'missing'."""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return "missing"
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def _source_stamp(self, name: str) -> Optional[str]:
+        row = self._connection.execute(
+            "SELECT stamp FROM sources WHERE name = ?", (name,)
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def _set_source_stamp(self, name: str, stamp: str) -> None:
+        self._connection.execute(
+            "INSERT OR REPLACE INTO sources (name, stamp) VALUES (?, ?)", (name, stamp)
+        )
+
+    def refresh(self, json_required: bool = True) -> None:
+        """
+        Rebuilds the index from the JSON file if the file changed since it was built, and updates
+        which papers are downloaded if the pdfs directory changed.
+
+        Parameters
+        ----------
+        json_required : bool, optional
+            Whether the JSON file must exist (default is True). Otherwise, a missing file indexes no paper.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the JSON file is required and does not exist.
+        """
+        json_stamp = self._stamp(self.json_path)
+        if json_stamp == "missing" and json_required:
+            raise FileNotFoundError(f"No such file: '{self.json_path}'")
+        pdfs_stamp = (
+            self._stamp(self.pdf_directory) if self.pdf_directory is not None else None
+        )
+
+        with self._lock:
+            if (
+                self._source_stamp("json") == json_stamp
+                and self._source_stamp("pdfs") == pdfs_stamp
+            ):
+                return
+            # Another process may be refreshing the index too, check again once holding the write lock
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                if self._source_stamp("json") != json_stamp:
+                    self._load(json_stamp)
+                if pdfs_stamp is not None and self._source_stamp("pdfs") != pdfs_stamp:
+                    self._sync_downloads(pdfs_stamp)
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def _load(self, stamp: str) -> None:
+        """Replaces the papers of the index with the ones of the JSON file, if any."""
+        papers = []
+        if stamp != "missing":
+            with open(self.json_path, "r", encoding="utf-8") as file:
+                papers = json.load(file).get("papers") or []
+        logger.debug("Indexing the %d papers of %s", len(papers), self.json_path)
+
+        self._connection.execute("DELETE FROM papers")
+        self._connection.executemany(
+            "INSERT INTO papers (position, title, doi, publication_date, authors, databases, "
+            "pdf_filename, record) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    position,
+                    paper.get("title"),
+                    paper.get("doi"),
+                    paper.get("publication_date"),
+                    # Not escaped, so that the names are matched as written
+                    json.dumps(paper.get("authors") or [], ensure_ascii=False),
+                    json.dumps(paper.get("databases") or [], ensure_ascii=False),
+                    pdf_filename(paper),
+                    json.dumps(paper),
+                )
+                for position, paper in enumerate(papers)
+            ),
+        )
+        self._set_source_stamp("json", stamp)
+        # The new papers have to be matched with the downloaded pdfs again
+        self._connection.execute("DELETE FROM sources WHERE name = 'pdfs'")
+
+    def _sync_downloads(self, stamp: str) -> None:
+        """Marks the papers whose pdf is in the pdfs directory as downloaded."""
+        filenames = []
+        if stamp != "missing":
+            filenames = [
+                name for name in os.listdir(self.pdf_directory) if name.endswith(".pdf")
+            ]
+        self._connection.execute("DELETE FROM pdfs")
+        self._connection.executemany(
+            "INSERT OR IGNORE INTO pdfs (name) VALUES (?)",
+            ((name,) for name in filenames),
+        )
+        self._connection.execute(
+            "UPDATE papers SET downloaded = "
+            "COALESCE(pdf_filename IN (SELECT name FROM pdfs), 0)"
+        )
+        self._set_source_stamp("pdfs", stamp)
+
+    def iter_papers(self, query: Optional[PaperQuery] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Yields the records of the papers matching a query, refreshing the index first. The papers are
+        read from the database as they are yielded, so they are never all held in memory.
+
+        Parameters
+        ----------
+            query : Optional[PaperQuery]
+                The filters, order and page of the papers. By default, every paper is yielded in the
+                order of the JSON file.
+
+        Returns
+        -------
+        Iterator[Dict[str, Any]]
+            The records of the papers, as in the JSON file.
+        """
+        query = query or PaperQuery()
+        where, parameters = query.where()
+        page = query.page
+        # The clauses are made of constant fragments, the values of the query are all parameters
+        sql = f"SELECT record FROM papers{where}{page.order_by()}"  # nosec B608
+        if page.is_partial():
+            sql += " LIMIT ? OFFSET ?"
+            parameters += [page.limit if page.limit is not None else -1, page.offset]
+
+        self.refresh()
+        for (record,) in self._connection.execute(sql, parameters):
+            yield json.loads(record)
+
+    def downloaded_pdfs(self) -> List[str]:
+        """
+        Returns the file names of the downloaded pdfs, refreshing the index first: the pdfs of the
+        papers in the order of the search results, then the pdfs added by hand, by name. The JSON
+        file is not required, so that the pdfs added by hand are found without any search.
+
+        Returns
+        -------
+        List[str]
+            The file names of the pdfs in the pdfs directory.
+        """
+        self.refresh(json_required=False)
+        papers = self._connection.execute(
+            "SELECT pdf_filename FROM papers WHERE downloaded = 1 ORDER BY position"
+        )
+        others = self._connection.execute(
+            "SELECT name FROM pdfs WHERE name NOT IN "
+            "(SELECT pdf_filename FROM papers WHERE downloaded = 1) ORDER BY name"
+        )
+        return [name for (name,) in papers] + [name for (name,) in others]
+
+    def close(self) -> None:
+        """Closes the database."""
+        self._connection.close()
@@ -0,0 +1,248 @@
+""" Utils for timing the stages of a run and counting its events """
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, ContextManager, Dict, Iterator, Optional
+
+# The loggers of langchain logging every retry of a request, e.g. "Retrying ... in 4.0 seconds as it raised ..."
+RETRY_LOGGERS = ["langchain", "langchain_core", "langchain_community"]
+
+# The stage being timed in the current thread or task, and the paper being parsed
+_FRAME: ContextVar[Optional["_Frame"]] = ContextVar(
+    "instrumentation_frame", default=None
+)
+_PAPER: ContextVar[Optional[str]] = ContextVar("instrumentation_paper", default=None)
+
+_NULL_CONTEXT = nullcontext()
+
+
+class _Frame:  # pylint: disable=too-few-public-methods
+    """A timed stage, and the time spent in the stages timed within it."""
+
+    __slots__ = ("stage", "start", "nested_seconds")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.start = time.perf_counter()
+        self.nested_seconds = 0.0
+
+
+class Instruments:
+    """
+    A thread-safe collector of the time spent in every stage of a run, and of counters of its events,
+    in total and by paper.
+
+    The time of a stage excludes the time of the stages timed within it, so that the stages of a single
+    thread add up to at most its wall time. The stages running in several threads or tasks at once add
+    up their times, e.g. the seconds of 8 concurrent language model calls of 1 second are 8.
+
+    Attributes:
+    stages (Dict[str, Dict[str, float]]): The number of calls and the seconds of every stage.
+    counters (Dict[str, int]): The count of every event.
+    papers (Dict[str, Dict[str, Dict[str, float]]]): The seconds of every stage and the count of every
+        event, by paper.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, int] = {}
+        self.papers: Dict[str, Dict[str, Dict[str, float]]] = {}
+        self._lock = threading.Lock()
+
+    def _paper(self, name: str) -> Dict[str, Dict[str, float]]:
+        return self.papers.setdefault(name, {"seconds": {}, "counters": {}})
+
+    def add_time(
+        self, stage: str, seconds: float, paper_name: Optional[str] = None
+    ) -> None:
+        """Adds a call of a stage taking some seconds, to the totals and to the paper if any."""
+        with self._lock:
+            totals = self.stages.setdefault(stage, {"calls": 0, "seconds": 0.0})
+            totals["calls"] += 1
+            totals["seconds"] += seconds
+            if paper_name is not None:
+                paper_seconds = self._paper(paper_name)["seconds"]
+                paper_seconds[stage] = paper_seconds.get(stage, 0.0) + seconds
+
+    def count(
+        self, name: str, value: int = 1, paper_name: Optional[str] = None
+    ) -> None:
+        """Adds to the count of an event, in total and for the paper if any."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            if paper_name is not None:
+                paper_counters = self._paper(paper_name)["counters"]
+                paper_counters[name] = paper_counters.get(name, 0) + value
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        """Times the block as a call of a stage, for the paper being parsed if any."""
+        frame = _Frame(stage)
+        token = _FRAME.set(frame)
+        try:
+            yield
+        finally:
+            _FRAME.reset(token)
+            elapsed = time.perf_counter() - frame.start
+            parent = _FRAME.get()
+            if parent is not None:
+                parent.nested_seconds += elapsed
+            self.add_time(stage, max(elapsed - frame.nested_seconds, 0.0), _PAPER.get())
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns a copy of the timings and counters, as plain dictionaries."""
+        with self._lock:
+            return json.loads(
+                json.dumps(
+                    {
+                        "stages": self.stages,
+                        "counters": self.counters,
+                        "papers": self.papers,
+                    }
+                )
+            )
+
+    def merge(self, snapshot: Dict[str, Any]) -> None:
+        """Adds the timings and counters of a snapshot, e.g. of a worker process."""
+        for stage, totals in snapshot.get("stages", {}).items():
+            with self._lock:
+                mine = self.stages.setdefault(stage, {"calls": 0, "seconds": 0.0})
+                mine["calls"] += totals["calls"]
+                mine["seconds"] += totals["seconds"]
+        for name, value in snapshot.get("counters", {}).items():
+            self.count(name, value)
+        for paper_name, entry in snapshot.get("papers", {}).items():
+            with self._lock:
+                mine = self._paper(paper_name)
+                for kind in ("seconds", "counters"):
+                    for name, value in entry.get(kind, {}).items():
+                        mine[kind][name] = mine[kind].get(name, 0) + value
+
+
+class _RetryCounter(logging.Handler):
+    """Counts the retries of the requests to the language and embedding models logged by langchain."""
+
+    def __init__(self, instruments: Instruments):
+        super().__init__(logging.WARNING)
+        self.instruments = instruments
+
+    def emit(self, record: logging.LogRecord) -> None:
+        message = record.getMessage()
+        if not message.startswith("Retrying"):
+            return
+        kind = "embedding" if "embed" in f"{record.name} {message}" else "llm"
+        self.instruments.count(f"{kind}_retries", paper_name=_PAPER.get())
+
+
+# The collector of the current process, or None if the instrumentation is disabled
+_ACTIVE: Optional[Instruments] = None
+_RETRY_COUNTER: Optional[_RetryCounter] = None
+
+
+def enable() -> Instruments:
+    """Starts collecting the timings and counters of this process in new Instruments, and returns them."""
+    global _ACTIVE, _RETRY_COUNTER  # pylint: disable=global-statement
+    disable()
+    _ACTIVE = Instruments()
+    _RETRY_COUNTER = _RetryCounter(_ACTIVE)
+    for name in RETRY_LOGGERS:
+        logging.getLogger(name).addHandler(_RETRY_COUNTER)
+    return _ACTIVE
+
+
+def disable() -> None:
+    """Stops collecting the timings and counters of this process."""
+    global _ACTIVE, _RETRY_COUNTER  # pylint: disable=global-statement
+    if _RETRY_COUNTER is not None:
+        for name in RETRY_LOGGERS:
+            logging.getLogger(name).removeHandler(_RETRY_COUNTER)
+    _ACTIVE = _RETRY_COUNTER = None
+
+
+def active() -> Optional[Instruments]:
+    """Returns the collector of this process, or None if the instrumentation is disabled."""
+    return _ACTIVE
+
+
+def timed(stage: str) -> ContextManager:
+    """
+    Times the block as a call of a stage, if the instrumentation is enabled.
+
+    Args:
+        stage (str): The name of the stage, e.g. extract, embed, search or llm.
+
+    Returns:
+        ContextManager: The timer of the block, or a shared no-op context manager if disabled.
+    """
+    if _ACTIVE is None:
+        return _NULL_CONTEXT
+    return _ACTIVE.timer(stage)
+
+
+def count(name: str, value: int = 1) -> None:
+    """Adds to the count of an event, for the paper being parsed if any, if the instrumentation is enabled."""
+    if _ACTIVE is not None:
+        _ACTIVE.count(name, value, _PAPER.get())
+
+
+@contextmanager
+def paper(name: str) -> Iterator[None]:
+    """
+    Attributes the stages timed and the events counted in the block to a paper, including in the
+    asyncio tasks it starts, if the instrumentation is enabled.
+    """
+    token = _PAPER.set(name)
+    try:
+        yield
+    finally:
+        _PAPER.reset(token)
+
+
+def _write_atomically(path: str, content: str) -> None:
+    """Writes a file through a temporary file, so that its readers never see it half written."""
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as file:
+        file.write(content)
+    os.replace(temporary_path, path)
+
+
+def write_report(path: str, report: Dict[str, Any]) -> None:
+    """Writes a run report as JSON."""
+    _write_atomically(path, json.dumps(report, indent=2))
+
+
+def _metric_name(name: str) -> str:
+    return "paperplumber_" + "".join(
+        character if character.isalnum() else "_" for character in name
+    )
+
+
+def write_prometheus(path: str, report: Dict[str, Any]) -> None:
+    """
+    Writes the totals of a run report in the Prometheus text format, e.g. for the textfile collector
+    of the node exporter. The timings of every paper are left out, to keep the number of series bounded.
+    """
+    lines = [
+        "# TYPE paperplumber_stage_seconds_total counter",
+        *(
+            f'paperplumber_stage_seconds_total{{stage="{stage}"}} {totals["seconds"]:.6f}'
+            for stage, totals in report["stages"].items()
+        ),
+        "# TYPE paperplumber_stage_calls_total counter",
+        *(
+            f'paperplumber_stage_calls_total{{stage="{stage}"}} {totals["calls"]}'
+            for stage, totals in report["stages"].items()
+        ),
+    ]
+    for name, value in report["counters"].items():
+        lines.append(f"# TYPE {_metric_name(name)}_total counter")
+        lines.append(f"{_metric_name(name)}_total {value}")
+    for name in ("wall_seconds", "papers_parsed", "papers_failed"):
+        lines.append(f"# TYPE {_metric_name(name)} gauge")
+        lines.append(f"{_metric_name(name)} {report[name]}")
+    _write_atomically(path, "\n".join(lines) + "\n")
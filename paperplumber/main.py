@@ -1,25 +1,410 @@
 """ The entrance file of the CLI application is paperplumber/main.py.
 It wrapps the findpapers package and adds some # additional functionality.
 """
+# pylint: disable=too-many-lines,import-outside-toplevel
 
-import os
+import csv
 import json
-from typing import List
+import os
+import sys
+import time
+from dataclasses import replace
+from functools import partial
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Tuple
 from datetime import datetime
 import typer
 from rich.console import Console
 from rich.table import Table
 
 import paperplumber
-from paperplumber.database.findpapers_integration import FindPapersDatabase
-from paperplumber.parsing.embedding_search import EmbeddingSearcher
-from paperplumber.parsing.file_scan import FileScanner
+from paperplumber import instrumentation
+from paperplumber.database.local import PaperOrder, PaperPage, PaperQuery
+from paperplumber.parsing.options import (
+    DEFAULT_CONTEXT_TOKENS,
+    DEFAULT_MODEL_NAME,
+    BudgetAction,
+    EmbeddingBackend,
+    ListFormat,
+    LLMBackend,
+    Retrieval,
+)
+
+# The parsers import langchain, FAISS and openai, and the database findpapers, which take seconds:
+# they are only imported by the commands using them, so that e.g. version and list start fast
+if TYPE_CHECKING:
+    from langchain.embeddings.base import Embeddings
+
+    from paperplumber.cache import DiskCache
+    from paperplumber.database.findpapers_integration import FindPapersDatabase
+    from paperplumber.parsing.batch_embedding import BatchEmbedder
+    from paperplumber.parsing.budget import CostEstimate, TokenBudget
+    from paperplumber.parsing.extraction import ExtractionResult
+    from paperplumber.parsing.settings import ParseSettings
 
 app = typer.Typer()
 
+# The number of papers of every table printed by list, so that the first ones show without waiting for all
+LIST_TABLE_ROWS = 100
+
+# The columns of the papers listed as CSV
+LIST_CSV_COLUMNS = ["publication_date", "title", "authors", "doi", "databases"]
+
 logger = paperplumber.get_logger(__name__)
 
 
+def _open_corpus_index(
+    database: "FindPapersDatabase",
+    settings: "ParseSettings",
+    page_cache: "DiskCache" = None,
+    embedder: "Embeddings" = None,
+):
+    """Opens the corpus index of a database for the retrieval, embedding and chunking of the settings."""
+    from paperplumber.parsing.corpus_index import (
+        CorpusIndex,
+        HybridCorpusIndex,
+        LexicalCorpusIndex,
+    )
+
+    retrieval = settings.search.retrieval
+    embedding = EmbeddingBackend(settings.search.embedding)
+    chunker = settings.chunker()
+    page_range = settings.chunking.page_range
+    # The vectors of different embedding models cannot be searched together
+    dense_directory = "corpus"
+    if embedding != EmbeddingBackend.OPENAI:
+        dense_directory = f"corpus_{embedding.value}"
+    if retrieval == Retrieval.LEXICAL:
+        return LexicalCorpusIndex(
+            database.get_cache_path("corpus_lexical"), page_cache, chunker, page_range
+        )
+    corpus_index = CorpusIndex(
+        database.get_cache_path(dense_directory),
+        embedder,
+        page_cache,
+        chunker,
+        page_range,
+    )
+    if retrieval == Retrieval.HYBRID:
+        corpus_index = HybridCorpusIndex(
+            corpus_index,
+            LexicalCorpusIndex(
+                database.get_cache_path("corpus_lexical"),
+                page_cache,
+                chunker,
+                page_range,
+            ),
+        )
+    return corpus_index
+
+
+def _downloaded_pdf_paths(database: "FindPapersDatabase") -> Dict[str, str]:
+    """Returns the path to the pdf of every downloaded paper of a database, by paper name."""
+    return {
+        paper_path: os.path.join(database.path, "pdfs", paper_path)
+        for paper_path in database.list_downloaded_papers()
+    }
+
+
+def _update_corpus_index(
+    database: "FindPapersDatabase",
+    settings: "ParseSettings",
+    page_cache: "DiskCache" = None,
+    batch_embedder: "BatchEmbedder" = None,
+):
+    """Adds the new and changed downloaded pdfs of a database to its corpus index for the settings."""
+    corpus_index = _open_corpus_index(
+        database,
+        settings,
+        page_cache,
+        batch_embedder.embedder if batch_embedder is not None else None,
+    )
+    corpus_index.update(
+        _downloaded_pdf_paths(database).values(), batch_embedder=batch_embedder
+    )
+    return corpus_index
+
+
+def _estimate_corpus_index(
+    database: "FindPapersDatabase", settings: "ParseSettings", page_cache: "DiskCache"
+) -> "CostEstimate":
+    """Estimates the embedding tokens of the corpus index search: the pdfs not indexed yet, and the targets."""
+    from paperplumber.parsing.budget import CostEstimate
+    from paperplumber.parsing.extraction import estimate_embedding
+    from paperplumber.parsing.local_embedding import HashingEmbeddings
+
+    # The lexical index does not need any embedding model
+    if settings.search.retrieval == Retrieval.LEXICAL:
+        return CostEstimate()
+    # Only the stored hashes and chunking settings of the papers are compared, so the index is
+    # opened with the local model, and a dry run needs no API key
+    corpus_index = _open_corpus_index(database, settings, page_cache, HashingEmbeddings())
+    pdf_paths = _downloaded_pdf_paths(database)
+    return estimate_embedding(
+        {name: pdf_paths[name] for name in corpus_index.pending(pdf_paths.values())},
+        settings,
+    )
+
+
+def _read_targets(targets: List[str], targets_filepath: str = None) -> List[str]:
+    """Returns the targets given as arguments and in the targets file, without duplicates."""
+    targets = list(targets or [])
+    if targets_filepath is not None:
+        with open(targets_filepath, "r", encoding="utf-8") as file:
+            targets += [line.strip() for line in file if line.strip()]
+    if not targets:
+        raise ValueError("Please provide at least one target to extract")
+    return list(dict.fromkeys(targets))
+
+
+def _search_corpus_index(
+    database: "FindPapersDatabase",
+    settings: "ParseSettings",
+    page_cache: "DiskCache",
+    papers: List[str],
+    budget: "TokenBudget" = None,
+) -> Tuple[Dict[str, Dict[str, list]], Dict[str, str]]:
+    """
+    Updates the corpus index, and finds the most similar pages of every paper for every target at once in it,
+    charging the embedded pages and targets to the budget if given. Also returns the error message of every
+    paper that could not be indexed.
+    """
+    from paperplumber.parsing.batch_embedding import BatchEmbedder
+    from paperplumber.parsing.budget import BudgetedEmbeddings
+    from paperplumber.parsing.embedding_search import default_embedder
+
+    # The lexical index does not need any embedding model
+    batch_embedder = None
+    if settings.search.retrieval != Retrieval.LEXICAL:
+        embedder = default_embedder(settings.search.embedding)
+        if budget is not None:
+            embedder = BudgetedEmbeddings(embedder, budget)
+        batch_embedder = BatchEmbedder(
+            embedder,
+            max_batch_tokens=settings.search.batch_tokens,
+            max_concurrency=settings.search.concurrency,
+        )
+    corpus_index = _update_corpus_index(database, settings, page_cache, batch_embedder)
+
+    indexed = set(corpus_index.papers)
+    pages_by_paper = {paper_path: {} for paper_path in papers if paper_path in indexed}
+    for target in settings.targets:
+        with instrumentation.timed("search"):
+            pages_by_target = corpus_index.search_per_paper(
+                target, settings.search.selection.max_k, papers=list(pages_by_paper)
+            )
+        for paper_path, pages in pages_by_target.items():
+            pages_by_paper[paper_path][target] = pages
+    return pages_by_paper, corpus_index.errors
+
+
+def _group_by_targets(
+    papers: Dict[str, Tuple[str, List[str]]]
+) -> Dict[Tuple[str, ...], Dict[str, str]]:
+    """Groups the pdf paths of the papers missing the same targets."""
+    pdf_paths_by_targets: Dict[Tuple[str, ...], Dict[str, str]] = {}
+    for paper_path, (pdf_path, paper_targets) in papers.items():
+        pdf_paths_by_targets.setdefault(tuple(paper_targets), {})[paper_path] = pdf_path
+    return pdf_paths_by_targets
+
+
+def _extract_by_targets(
+    papers: Dict[str, Tuple[str, List[str]]],
+    settings: "ParseSettings",
+    extract: Callable[..., "ExtractionResult"],
+) -> "ExtractionResult":
+    """Extracts the values of the papers, running the papers missing the same targets together."""
+    from paperplumber.parsing.extraction import ExtractionResult
+
+    result = ExtractionResult()
+    for targets, pdf_paths in _group_by_targets(papers).items():
+        if result.stopped:
+            result.skipped += list(pdf_paths)
+            continue
+        result.merge(extract(pdf_paths, replace(settings, targets=list(targets))))
+    return result
+
+
+def _print_papers(papers: Iterable[Dict[str, Any]], output_format: ListFormat) -> None:
+    """Prints the papers as they are read, as tables of LIST_TABLE_ROWS papers, JSON lines or CSV rows."""
+    output_format = ListFormat(output_format)
+    if output_format == ListFormat.JSONL:
+        for paper in papers:
+            typer.echo(json.dumps(paper, ensure_ascii=False))
+        return
+
+    if output_format == ListFormat.CSV:
+        writer = csv.writer(sys.stdout)
+        writer.writerow(LIST_CSV_COLUMNS)
+        for paper in papers:
+            writer.writerow(
+                [
+                    "; ".join(value) if isinstance(value, list) else value
+                    for value in map(paper.get, LIST_CSV_COLUMNS)
+                ]
+            )
+        return
+
+    console, table = Console(), None
+    for row, paper in enumerate(papers):
+        if row % LIST_TABLE_ROWS == 0:
+            if table is not None:
+                console.print(table)
+            # The header is only printed once, the next tables carry on the first one
+            table = Table(show_header=row == 0, header_style="bold magenta")
+            table.add_column("Publication date", style="dim", width=10)
+            table.add_column("Title", style="dim", width=50)
+            table.add_column("Authors", style="dim", width=50)
+        table.add_row(
+            paper.get("publication_date"),
+            paper.get("title"),
+            ",".join(paper.get("authors") or []),
+        )
+    if table is not None:
+        console.print(table)
+
+
+def _print_estimate(estimate: "CostEstimate", settings: "ParseSettings") -> None:
+    """Prints the estimated tokens and cost of a parse run."""
+    llm_cost = estimate.llm_cost(settings.reading.llm)
+    embedding_cost = estimate.embedding_cost(settings.search.embedding)
+
+    def usd(cost) -> str:
+        return "unknown" if cost is None else f"${cost:.4f}"
+
+    table = Table(
+        title=f"Estimated cost of parsing {estimate.papers} papers",
+        show_header=True,
+        header_style="bold magenta",
+    )
+    table.add_column("Model")
+    table.add_column("Requests", justify="right")
+    table.add_column("Tokens", justify="right")
+    table.add_column("Cost (USD)", justify="right")
+    table.add_row(
+        settings.reading.llm.cache_name(),
+        str(estimate.prompts),
+        f"{estimate.prompt_tokens} + {estimate.completion_tokens}",
+        usd(llm_cost),
+    )
+    if estimate.embedding_tokens:
+        table.add_row(
+            EmbeddingBackend(settings.search.embedding).value,
+            "",
+            str(estimate.embedding_tokens),
+            usd(embedding_cost),
+        )
+    table.add_row(
+        "Total",
+        "",
+        str(estimate.tokens),
+        usd(
+            None
+            if llm_cost is None or embedding_cost is None
+            else llm_cost + embedding_cost
+        ),
+    )
+    Console().print(table)
+
+
+def _log_parse_result(result: "ExtractionResult", papers: int, cached: bool) -> None:
+    """Logs the statistics and the errors of a parse run."""
+    for stage, stats in result.stage_stats.items():
+        logger.info(
+            "Stage %s: %d papers (%d failed) at %.2f papers/s, %d workers %.0f%% busy, max queue depth %d",
+            stage,
+            stats["processed"],
+            stats["failed"],
+            stats["throughput"],
+            stats["workers"],
+            100 * stats["utilization"],
+            stats["max_queue_depth"],
+        )
+
+    if cached:
+        logger.info(
+            "Language model response cache: %d hits, %d misses",
+            result.stats.get("llm_cache_hits", 0),
+            result.stats.get("llm_cache_misses", 0),
+        )
+    skipped_calls = result.stats.get("early_stop_skipped_calls", 0) + result.stats.get(
+        "call_cap_skipped_calls", 0
+    )
+    if skipped_calls:
+        logger.info(
+            "Early stopping: sent %d prompts (%.1f per paper), skipped %d (%.0f%%): %d once the values "
+            "were consistent, %d over the cap of prompts per paper",
+            result.stats["llm_calls"],
+            result.stats["llm_calls"] / max(papers, 1),
+            skipped_calls,
+            100 * skipped_calls / (skipped_calls + result.stats["llm_calls"]),
+            result.stats["early_stop_skipped_calls"],
+            result.stats["call_cap_skipped_calls"],
+        )
+    if "llm_tokens" in result.stats:
+        logger.info(
+            "Tokens: %d sent to and received from the language model, %d embedded",
+            result.stats["llm_tokens"],
+            result.stats["embedding_tokens"],
+        )
+    if result.stats.get("prefilter_saved_calls"):
+        logger.info(
+            "Pre-filter: skipped %d pages, saving as many language model calls",
+            result.stats["prefilter_saved_calls"],
+        )
+    if result.errors:
+        logger.warning(
+            "Failed to parse %d of %d papers: %s",
+            len(result.errors),
+            papers,
+            ", ".join(result.errors),
+        )
+    if result.stopped:
+        logger.warning(
+            "Stopped before parsing %d of %d papers (%s), run the parse again to resume it",
+            len(result.skipped),
+            papers,
+            result.stopped,
+        )
+
+
+def _write_run_report(
+    base_path: str,
+    result: "ExtractionResult",
+    papers: int,
+    started: datetime,
+    wall_seconds: float,
+    *,
+    result_settings: Dict,
+    prometheus_file: str = None,
+) -> None:
+    """
+    Writes the timings and counters of a parse run to run_report.json in the database path,
+    and to a Prometheus textfile if given.
+    """
+    report = {
+        "started": started.isoformat(timespec="seconds"),
+        "wall_seconds": round(wall_seconds, 3),
+        "papers_parsed": papers - len(result.errors) - len(result.skipped),
+        "papers_failed": len(result.errors),
+        "papers_skipped": len(result.skipped),
+        "stopped": result.stopped,
+        "settings": result_settings,
+        **instrumentation.active().snapshot(),
+        "pipeline": result.stage_stats,
+    }
+    # The counters of the extractors, e.g. the response cache hits and the prompts skipped
+    report["counters"].update(result.stats)
+
+    instrumentation.write_report(os.path.join(base_path, "run_report.json"), report)
+    if prometheus_file is not None:
+        instrumentation.write_prometheus(prometheus_file, report)
+
+    stages = ", ".join(
+        f"{stage} {totals['seconds']:.2f}s" for stage, totals in report["stages"].items()
+    )
+    logger.info("Run report written to %s: %s", base_path, stages or "no stages timed")
+
+
 @app.command("search")
 def search(
     path: str = typer.Argument(
@@ -332,6 +717,7 @@ def download(
     path: str = typer.Argument(
         ..., help="A valid path for the search result and full-text papers files"
     ),
+    *,
     only_selected_papers: bool = typer.Option(
         False,
         "-s",
@@ -353,6 +739,26 @@ def download(
         show_default=True,
         help="proxy URL that can be used during requests",
     ),
+    index: bool = typer.Option(
+        False,
+        "-i",
+        "--index",
+        show_default=True,
+        help="A flag to indicate if the downloaded papers should be added to the corpus index used by parse --corpus-index",
+    ),
+    embedding: EmbeddingBackend = typer.Option(
+        EmbeddingBackend.OPENAI.value,
+        "--embedding",
+        show_default=True,
+        case_sensitive=False,
+        help="The embedding model of the pages added to the corpus index with --index: the OpenAI API (openai) or a local hashing vectorizer (hashing)",
+    ),
+    token_budget: int = typer.Option(
+        None,
+        "--token-budget",
+        show_default=True,
+        help="The max number of tokens of the pages embedded with --index, the indexing stops before a request that would go over it",
+    ),
     verbose: bool = typer.Option(
         False,
         "-v",
@@ -386,6 +792,10 @@ def download(
     placed on the output directory, you can check out the log to find what papers cannot be downloaded
     and try to get them manually later.
 
+    You can add the downloaded papers to the corpus index of the output directory by the -i (or --index) flag.
+    Only the papers that are not indexed yet are embedded, with the embedding model of the --embedding option,
+    and with --token-budget, the indexing stops before an embedding request that would go over the budget.
+
     Note: Some papers are behind a paywall and won't be able to be downloaded by this command.
     However, if you have a proxy provided for the institution where you study or work that permit you
     to "break" this paywall. You can use this proxy configuration here
@@ -395,7 +805,6 @@ def download(
     """
 
     logger.info("Calling findpapers to download your papers...")
-
     try:
         categories_by_facet = {} if len(categories) > 0 else None
         for categories_string in categories:
@@ -409,6 +818,20 @@ def download(
             proxy=proxy,
             verbose=verbose,
         )
+        if index:
+            from paperplumber.parsing.batch_embedding import BatchEmbedder
+            from paperplumber.parsing.budget import BudgetedEmbeddings, TokenBudget
+            from paperplumber.parsing.embedding_search import default_embedder
+            from paperplumber.parsing.settings import ParseSettings, SearchSettings
+
+            embedder = default_embedder(embedding)
+            if token_budget is not None:
+                embedder = BudgetedEmbeddings(embedder, TokenBudget(token_budget))
+            _update_corpus_index(
+                database,
+                ParseSettings(targets=[], search=SearchSettings(embedding=embedding)),
+                batch_embedder=BatchEmbedder(embedder),
+            )
 
     except Exception as error:
         if verbose:
@@ -423,6 +846,69 @@ def list_available(
     path: str = typer.Argument(
         ..., help="A valid path for the search result and full-text papers files"
     ),
+    *,
+    title: str = typer.Option(
+        None,
+        "--title",
+        show_default=True,
+        help="Only list the papers whose title contains this text, ignoring the case",
+    ),
+    author: str = typer.Option(
+        None,
+        "--author",
+        show_default=True,
+        help="Only list the papers with an author whose name contains this text, ignoring the case",
+    ),
+    database_name: str = typer.Option(
+        None,
+        "--database",
+        show_default=True,
+        help="Only list the papers found in this database, e.g. arXiv, ignoring the case",
+    ),
+    since: str = typer.Option(
+        None,
+        "--since",
+        show_default=True,
+        help="Only list the papers published on or after this date, e.g. 2018 or 2018-11-27",
+    ),
+    until: str = typer.Option(
+        None,
+        "--until",
+        show_default=True,
+        help="Only list the papers published on or before this date, e.g. 2020 for the end of 2020",
+    ),
+    sort: PaperOrder = typer.Option(
+        PaperOrder.SEARCH,
+        "--sort",
+        show_default=True,
+        help="The order of the papers: the order of the search results, by publication date or by title",
+    ),
+    descending: bool = typer.Option(
+        False,
+        "--descending",
+        show_default=True,
+        help="If you wanna list the papers in the reverse order",
+    ),
+    limit: int = typer.Option(
+        None,
+        "-l",
+        "--limit",
+        show_default=True,
+        help="The max number of papers to list",
+    ),
+    offset: int = typer.Option(
+        0,
+        "--offset",
+        show_default=True,
+        help="The number of papers to skip before listing, e.g. to list the next page of --limit papers",
+    ),
+    output_format: ListFormat = typer.Option(
+        ListFormat.TABLE,
+        "-f",
+        "--format",
+        show_default=True,
+        help="How the papers are printed: as a table, as a JSON record per line, or as CSV rows",
+    ),
     verbose: bool = typer.Option(
         False,
         "-v",
@@ -435,22 +921,28 @@ def list_available(
     """
     List the available papers in the local directory, after searching.
     You can control the command logging verbosity by the -v (or --verbose) argument.
+
+    The papers are read from an index of the search results, and printed as they are read. They can be
+    filtered by title, author, database and publication date, sorted, and paged with --limit and --offset.
+    With --format jsonl or csv, they are printed as plain JSON lines or CSV rows, e.g. to be piped to
+    another program.
     """
 
     try:
+        if limit is not None and limit < 0 or offset < 0:
+            raise typer.BadParameter("--limit and --offset must not be negative")
         database = paperplumber.FindPapersDatabase(path=path)
-        papers = database.list_available_papers()
-        table = Table(show_header=True, header_style="bold magenta")
-        table.add_column("Publication date", style="dim", width=10)
-        table.add_column("Title", style="dim", width=50)
-        table.add_column("Authors", style="dim", width=50)
-
-        for paper in papers:
-            table.add_row(
-                paper["publication_date"], paper["title"], ",".join(paper["authors"])
-            )
-        console = Console()
-        console.print(table)
+        query = PaperQuery(
+            title=title,
+            author=author,
+            database=database_name,
+            since=since,
+            until=until,
+            page=PaperPage(
+                order=sort, descending=descending, limit=limit, offset=offset
+            ),
+        )
+        _print_papers(database.iter_available_papers(query), output_format)
 
     except Exception as error:
         if verbose:
@@ -461,11 +953,21 @@ def list_available(
 
 
 @app.command("parse")
-def parse(
+def parse(  # pylint: disable=too-many-branches,too-many-statements
     path: str = typer.Argument(
         ..., help="A valid path for the search result and full-text papers files"
     ),
-    target: str = typer.Argument(..., help="The value to extract from the papers"),
+    targets: List[str] = typer.Argument(
+        None, help="The values to extract from the papers"
+    ),
+    *,
+    targets_filepath: str = typer.Option(
+        None,
+        "-t",
+        "--targets-file",
+        show_default=True,
+        help="A file path that contains the values to extract from the papers, one per line",
+    ),
     verbose: bool = typer.Option(
         False,
         "-v",
@@ -480,39 +982,666 @@ def parse(
         show_default=True,
         help="If you wanna filter pages based on similarity to target",
     ),
+    no_cache: bool = typer.Option(
+        False,
+        "--no-cache",
+        show_default=True,
+        help="If you wanna extract, embed and read every pdf again instead of reading the results from the caches",
+    ),
+    cache_size: int = typer.Option(
+        1024,
+        "--cache-size",
+        show_default=True,
+        help="The max size of each cache in megabytes, the least recently used entries are evicted first",
+    ),
+    corpus_index: bool = typer.Option(
+        False,
+        "--corpus-index",
+        show_default=True,
+        help="If you wanna filter pages with a single search in the corpus index instead of one index per pdf",
+    ),
+    retrieval: Retrieval = typer.Option(
+        Retrieval.DENSE.value,
+        "--retrieval",
+        show_default=True,
+        case_sensitive=False,
+        help="How the pages most similar to the target are found: by their embeddings (dense), by their words with a local BM25 index, without any embedding model (lexical), or by both (hybrid)",
+    ),
+    embedding: EmbeddingBackend = typer.Option(
+        EmbeddingBackend.OPENAI.value,
+        "--embedding",
+        show_default=True,
+        case_sensitive=False,
+        help="The embedding model of the pages: the OpenAI API (openai), or a local hashing vectorizer of their words, needing neither network access nor an API key (hashing)",
+    ),
+    llm_backend: LLMBackend = typer.Option(
+        LLMBackend.OPENAI.value,
+        "--llm-backend",
+        show_default=True,
+        case_sensitive=False,
+        help="The language model reading the pages: the OpenAI API (openai), a server with the same API at --base-url (openai-compatible), or a deterministic local stand-in for tests and benchmarks (fake)",
+    ),
+    model: str = typer.Option(
+        DEFAULT_MODEL_NAME,
+        "--model",
+        show_default=True,
+        help="The name of the language model",
+    ),
+    base_url: str = typer.Option(
+        None,
+        "--base-url",
+        show_default=True,
+        help="The base URL of the API of the server of --llm-backend openai-compatible, e.g. http://localhost:8000/v1",
+    ),
+    temperature: float = typer.Option(
+        None,
+        "--temperature",
+        show_default=True,
+        help="The sampling temperature of the language model, if not provided the default of the model is used",
+    ),
+    max_tokens: int = typer.Option(
+        None,
+        "--max-tokens",
+        show_default=True,
+        help="The max number of tokens of an answer of the language model, if not provided the default of the model is used",
+    ),
+    fake_latency: float = typer.Option(
+        0.0,
+        "--fake-latency",
+        show_default=True,
+        help="The seconds the language model of --llm-backend fake takes to answer a prompt",
+    ),
+    fake_answer: str = typer.Option(
+        None,
+        "--fake-answer",
+        show_default=True,
+        help="The answer of the language model of --llm-backend fake for every target, if not provided it answers with the first number with a unit of the text",
+    ),
+    consistent_values: int = typer.Option(
+        None,
+        "--stop-after",
+        show_default=True,
+        help="The number of times the same value must be found for a target before the remaining pages of a paper are skipped for it, the pages are read best first",
+    ),
+    max_llm_calls: int = typer.Option(
+        None,
+        "--max-llm-calls",
+        show_default=True,
+        help="The max number of prompts sent to the language model for a paper, the best pages are read first",
+    ),
+    max_pages: int = typer.Option(
+        2,
+        "--max-pages",
+        show_default=True,
+        help="The max number of pages found by the search that are read for a target",
+    ),
+    min_pages: int = typer.Option(
+        None,
+        "--min-pages",
+        show_default=True,
+        help="The min number of pages found by the search that are read for a target, the next ones up to --max-pages are read if their score is high enough, if not provided --max-pages pages are always read",
+    ),
+    score_threshold: float = typer.Option(
+        None,
+        "--score-threshold",
+        show_default=True,
+        help="The min search score of the pages read after the first --min-pages ones",
+    ),
+    relative_drop: float = typer.Option(
+        None,
+        "--relative-drop",
+        show_default=True,
+        help="The max drop of the search score of the pages read after the first --min-pages ones below the best one, as a fraction of it",
+    ),
+    mmr: bool = typer.Option(
+        False,
+        "--mmr",
+        show_default=True,
+        help="If you wanna skip the pages nearly identical to a better one, e.g. overlapping chunks, in favour of pages bringing new text",
+    ),
+    mmr_lambda: float = typer.Option(
+        0.5,
+        "--mmr-lambda",
+        show_default=True,
+        help="The trade-off between the score and the novelty of the pages read with --mmr, from 0 for the novelty only to 1 for the score only",
+    ),
+    pages: str = typer.Option(
+        None,
+        "--pages",
+        show_default=True,
+        help="The pages of the pdfs to parse, numbered from 1, e.g. 1-50, 3- or 7, if not provided every page is parsed",
+    ),
+    lazy_pages: bool = typer.Option(
+        False,
+        "--lazy-pages",
+        show_default=True,
+        help="If you wanna stream the pages of the pdfs to the language model as they are extracted, instead of extracting whole pdfs first, to bound the memory used by very large pdfs",
+    ),
+    chunk_tokens: int = typer.Option(
+        None,
+        "--chunk-tokens",
+        show_default=True,
+        help="The max number of tokens of a chunk of the pdfs, if not provided they are split into chunks of at most 4000 characters",
+    ),
+    chunk_overlap: int = typer.Option(
+        50,
+        "--chunk-overlap",
+        show_default=True,
+        help="The number of tokens shared by two consecutive chunks, with --chunk-tokens",
+    ),
+    merge_pages: bool = typer.Option(
+        False,
+        "--merge-pages",
+        show_default=True,
+        help="If you wanna let the chunks of --chunk-tokens span several pages instead of splitting every page on its own",
+    ),
+    pack: bool = typer.Option(
+        False,
+        "--pack",
+        show_default=True,
+        help="If you wanna read as many chunks of a paper as fit in a single prompt, instead of one prompt per chunk",
+    ),
+    pack_tokens: int = typer.Option(
+        DEFAULT_CONTEXT_TOKENS,
+        "--pack-tokens",
+        show_default=True,
+        help="The max number of tokens of a prompt packing several chunks and of its answer, with --pack",
+    ),
+    embedding_batch_tokens: int = typer.Option(
+        100000,
+        "--embedding-batch-tokens",
+        show_default=True,
+        help="The max number of tokens sent in a single embedding request, pages of several pdfs are packed together",
+    ),
+    embedding_batch_papers: int = typer.Option(
+        32,
+        "--embedding-batch-papers",
+        show_default=True,
+        help="The number of pdfs whose pages are embedded together",
+    ),
+    embedding_concurrency: int = typer.Option(
+        4,
+        "--embedding-concurrency",
+        show_default=True,
+        help="The max number of embedding requests sent at the same time",
+    ),
+    workers: int = typer.Option(
+        1,
+        "-w",
+        "--workers",
+        show_default=True,
+        help="The number of worker processes the papers are spread across",
+    ),
+    pipeline: bool = typer.Option(
+        False,
+        "--pipeline",
+        show_default=True,
+        help="If you wanna overlap the extraction, embedding and reading of the papers in a pipeline of stages instead of worker processes",
+    ),
+    load_workers: int = typer.Option(
+        1,
+        "--load-workers",
+        show_default=True,
+        help="The number of pdfs extracted at the same time by the pipeline, by a pool of processes if larger than 1",
+    ),
+    embed_workers: int = typer.Option(
+        1,
+        "--embed-workers",
+        show_default=True,
+        help="The number of batches of pdfs embedded at the same time by the pipeline",
+    ),
+    scan_workers: int = typer.Option(
+        4,
+        "--scan-workers",
+        show_default=True,
+        help="The number of pdfs read by the language model at the same time by the pipeline",
+    ),
+    queue_size: int = typer.Option(
+        8,
+        "--queue-size",
+        show_default=True,
+        help="The max number of pdfs waiting between two stages of the pipeline",
+    ),
+    llm_concurrency: int = typer.Option(
+        1,
+        "--llm-concurrency",
+        show_default=True,
+        help="The max number of pages of a paper read by the language model at the same time",
+    ),
+    llm_cache_entries: int = typer.Option(
+        100000,
+        "--llm-cache-entries",
+        show_default=True,
+        help="The max number of cached language model responses, the least recently used ones are evicted first",
+    ),
+    llm_cache_ttl: float = typer.Option(
+        None,
+        "--llm-cache-ttl",
+        show_default=True,
+        help="The number of days after which a cached language model response expires, if not provided they never expire",
+    ),
+    clear_llm_cache: bool = typer.Option(
+        False,
+        "--clear-llm-cache",
+        show_default=True,
+        help="If you wanna remove every cached language model response before parsing",
+    ),
+    prefilter: bool = typer.Option(
+        False,
+        "--prefilter",
+        show_default=True,
+        help="If you wanna skip the pages that do not mention the target nor hold a measured value, before the language model reads them",
+    ),
+    prefilter_threshold: float = typer.Option(
+        1.0,
+        "--prefilter-threshold",
+        show_default=True,
+        help="The min score of the pages read with --prefilter: the fraction of the words of the target in the page, plus 1 if it holds the whole target and 0.25 if it holds a number with a unit",
+    ),
+    restart: bool = typer.Option(
+        False,
+        "--restart",
+        show_default=True,
+        help="If you wanna parse every paper again instead of resuming from the results in output.jsonl",
+    ),
+    fsync: bool = typer.Option(
+        False,
+        "--fsync",
+        show_default=True,
+        help="If you wanna sync every result written to output.jsonl to the disk, so that it survives a power loss",
+    ),
+    incremental: bool = typer.Option(
+        False,
+        "-i",
+        "--incremental",
+        show_default=True,
+        help="If you wanna only parse the new and changed pdfs, and the targets not parsed yet, and merge them into the existing output",
+    ),
+    report: bool = typer.Option(
+        False,
+        "--report",
+        show_default=True,
+        help="If you wanna time every stage of the parse and of every paper, count the requests, retries, tokens and cache hits, and write them to run_report.json",
+    ),
+    prometheus_file: str = typer.Option(
+        None,
+        "--prometheus-file",
+        show_default=True,
+        help="A file path to also write the totals of --report to in the Prometheus text format, e.g. for the textfile collector of the node exporter",
+    ),
+    token_budget: int = typer.Option(
+        None,
+        "--token-budget",
+        show_default=True,
+        help="The max number of tokens sent to the language and embedding models, the parse stops cleanly before a request that would go over it",
+    ),
+    soft_token_budget: int = typer.Option(
+        None,
+        "--soft-token-budget",
+        show_default=True,
+        help="The number of tokens after which --soft-budget-action is taken",
+    ),
+    soft_budget_action: BudgetAction = typer.Option(
+        BudgetAction.WARN.value,
+        "--soft-budget-action",
+        show_default=True,
+        case_sensitive=False,
+        help="What happens once --soft-token-budget is used up: a warning (warn), or also reading only the pages passing the pre-filter from then on (prefilter)",
+    ),
+    dry_run: bool = typer.Option(
+        False,
+        "--dry-run",
+        show_default=True,
+        help="If you wanna estimate the tokens and cost of the parse without sending any request to the models",
+    ),
 ):
     # pylint disable=line-too-long
     """
     Parse the available papers in the local directory, after searching.
+
+    Several values can be extracted at once, by giving several targets or a file with one target per
+    line with the -t (or --targets-file) option. The pdfs are loaded and embedded once for all the targets,
+    and a page relevant to several targets is read with a single prompt. The results are saved to
+    output.json in the database path, by paper and then by target.
+
+    The result of every paper is also appended to output.jsonl in the database path as soon as the paper is
+    parsed, so that an interrupted parse can be resumed: the papers already parsed for all the targets from the
+    same pdf are skipped, and output.json is written from output.jsonl at the end. The papers parsed with other
+    settings are parsed again, and only the results of the current settings are written to output.json. You can
+    parse every paper again by the --restart flag, and sync every result to the disk by the --fsync flag.
+
+    The size, modification time and content hash of every parsed pdf, and the targets and settings it was parsed
+    with, are recorded in manifest.json in the database path. With the -i (or --incremental) flag, only the new and
+    changed pdfs are parsed, and the other pdfs only for the targets they were not parsed for yet, or with other
+    settings. The results are merged into output.json, which then holds every target parsed so far.
+
+    The text extracted from the pdfs and the page embeddings are cached in the .cache directory
+    of the database path, so that unchanged pdfs are not extracted nor embedded again. You can
+    disable the caches by the --no-cache flag.
+
+    With -w (or --workers) larger than 1, groups of papers are parsed in parallel by a pool of worker processes.
+    The results are saved in the order of the paper names, and a paper that fails to be parsed is skipped with
+    an error message instead of aborting the whole run.
+
+    With the --pipeline flag, the papers go through a pipeline of stages instead: the pdfs are extracted by
+    --load-workers workers, embedded in batches by --embed-workers workers and read by the language model by
+    --scan-workers workers, all at the same time. At most --queue-size papers wait between two stages, so a slow
+    stage holds back the others instead of piling up pages in memory. The throughput and queue depth of every
+    stage are logged at the end.
+
+    With the --prefilter flag, every page is scored for every target with cheap local heuristics before the language
+    model reads it: the words of the target found in the page, whether the page holds a number with a unit, and
+    whether it is a list of references. The pages scoring below --prefilter-threshold are skipped, with or without
+    the embedding search filter, and the number of language model calls saved is logged at the end.
+
+    With --llm-concurrency larger than 1, the pages of each paper are read concurrently, and a page whose
+    reading fails is skipped with a warning instead of aborting the paper.
+
+    The responses of the language model are cached in a SQLite database in the same directory, so
+    that re-running a parse does not pay again for identical prompts. The responses of outdated prompt
+    templates are removed, and you can remove every response by the --clear-llm-cache flag.
+
+    With the --corpus-index flag, the pages are filtered with a single search in the corpus index of the
+    database path, to which the new and changed pdfs are added first.
+
+    By default, the pages most similar to the target are found by their embeddings. With --retrieval lexical, they
+    are found by their words with a local BM25 index instead, which finds exact symbols and abbreviations such as
+    T2 and needs no embedding model nor network access. With --retrieval hybrid, the rankings of both are fused.
+    The BM25 corpus index is stored next to the embedding one in the .cache directory of the database path.
+
+    By default, the pages are read by the --model model of the OpenAI API. With --llm-backend openai-compatible, they
+    are read by a model of any server with the same API at --base-url, e.g. a self-hosted one. With --llm-backend
+    fake, they are read by a deterministic local stand-in taking --fake-latency seconds per prompt, which answers
+    --fake-answer, or the first number with a unit of the text, to load-test the parse without spending API credit.
+    The responses of every model and set of generation parameters are cached apart.
+
+    By default, the pages are embedded with the OpenAI API. With --embedding hashing, they are embedded locally by
+    hashing their words and word pairs instead, which is free, fast and deterministic, but only matches exact words.
+
+    With --stop-after or --max-llm-calls, the pages of a paper are read best first: in the order of the embedding
+    search, or of their BM25 score for the target without it. A target is not read any more once the same value was
+    found for it --stop-after times, nor any target once --max-llm-calls prompts were sent for the paper. The
+    prompts sent and skipped are logged at the end, to trade recall for throughput explicitly.
+
+    By default, the 2 pages most similar to the target are read, or --max-pages pages. With --min-pages, only the
+    first --min-pages pages are always read, and the next ones if their search score reaches --score-threshold and
+    does not drop more than --relative-drop below the best one, so that the number of language model calls adapts
+    to every paper. With the --mmr flag, the pages nearly identical to a better one are read last. The corpus index
+    search always returns --max-pages pages of every paper.
+
+    With --pages, only the given pages of every pdf are parsed, e.g. 1-50 to skip the appendices of long theses.
+    With the --lazy-pages flag and without the embedding search filter, the pages are streamed to the language
+    model as they are extracted, --llm-concurrency pages at a time, so that the memory used does not grow with
+    the size of the pdfs. The embedding search, --pack and the early stopping need every page of a pdf first.
+
+    By default, the pdfs are split into chunks of at most 4000 characters within every page. With --chunk-tokens,
+    they are split into chunks of at most that many tokens instead, sharing --chunk-overlap tokens, and spanning
+    several pages with the --merge-pages flag. With the --pack flag, the chunks of a paper to read for the same
+    targets are packed into as few prompts of at most --pack-tokens tokens as possible, each answered with the
+    values of every chunk, instead of one prompt per chunk repeating the instructions and examples.
+
+    The pages that are not embedded yet are packed into requests of at most --embedding-batch-tokens tokens,
+    across groups of --embedding-batch-papers pdfs, and up to --embedding-concurrency requests are sent at once.
+
+    With the --report flag, the time spent extracting the pdfs, embedding their pages, searching them and waiting for
+    the language model is measured, in total and for every paper, along with the number of requests, retries, tokens
+    and cache hits. They are written to run_report.json in the database path at the end, and to --prometheus-file in
+    the Prometheus text format if given. Without it, the measurements cost nothing but a check per call.
+
+    With --token-budget, the tokens of every prompt and embedding request are counted before it is sent, and the
+    parse stops cleanly before a request that would go over the budget: the papers parsed so far are saved, and
+    the next parse resumes from them. The pages and targets embedded in the corpus index are charged first, and
+    the local hashing embeddings are free. With --workers larger than 1, every worker process gets an equal share
+    of the budget. Once --soft-token-budget is used up, a warning is logged, and with --soft-budget-action prefilter
+    only the pages passing the pre-filter are read from then on. The tokens used are logged at the end. With the
+    --dry-run flag, the pdfs are only extracted, and the tokens of the prompts and embeddings of the parse and
+    their cost with the OpenAI prices are estimated without any response cached, and printed, without sending
+    any request, counting the pages of the pdfs not in the corpus index yet as embedded with --corpus-index.
+
     You can control the command logging verbosity by the -v (or --verbose) argument.
     """
+    from paperplumber.parsing.budget import BudgetExceeded, BudgetSettings, CostEstimate
+    from paperplumber.parsing.extraction import (
+        estimate_papers,
+        extract_papers,
+        extract_papers_pipelined,
+    )
+    from paperplumber.parsing.llm_backend import LLMSettings
+    from paperplumber.parsing.llmreader import OpenAIReader
+    from paperplumber.parsing.manifest import ParseManifest
+    from paperplumber.parsing.page_selection import PageSelection
+    from paperplumber.parsing.pdf_parser import PageRange
+    from paperplumber.parsing.results_file import ResultsFile
+    from paperplumber.parsing.settings import (
+        CacheSettings,
+        ChunkingSettings,
+        ParseSettings,
+        ReadingSettings,
+        SearchSettings,
+    )
+
+    started, start = datetime.now(), time.perf_counter()
     try:
+        if min_pages is not None and min_pages > max_pages:
+            raise typer.BadParameter("--min-pages must not be larger than --max-pages")
+        targets = _read_targets(targets, targets_filepath)
+
         # Instantiate a database to list all available pdfs in the specified path
-        database = FindPapersDatabase(path=path)
+        database = paperplumber.FindPapersDatabase(path=path)
         downloaded_papers = database.list_downloaded_papers()
 
-        values_dict = {}
-
-        # Iterate over all papers
-        for paper_path in downloaded_papers:
-            pdf_path = os.path.join(path, "pdfs", paper_path)
-
-            # If filter_with_embedding_search is True, filter pages based on similarity to target
-            if filter_with_embedding_search:
-                doc = EmbeddingSearcher(pdf_path)
-                pages = doc.similarity_search(target)
-                scanner = FileScanner.from_pages(pages)
-                values = scanner.scan(target)
-                values_dict[paper_path] = values
-            else:
-                scanner = FileScanner(pdf_path)
-                values = scanner.scan(target)
-                values_dict[paper_path] = values
-
-        # Save on the database path as output.json
+        settings = ParseSettings(
+            targets=targets,
+            search=SearchSettings(
+                enabled=filter_with_embedding_search,
+                retrieval=retrieval,
+                embedding=embedding,
+                batch_tokens=embedding_batch_tokens,
+                concurrency=embedding_concurrency,
+                selection=PageSelection(
+                    min_k=max_pages if min_pages is None else min_pages,
+                    max_k=max_pages,
+                    score_threshold=score_threshold,
+                    relative_drop=relative_drop,
+                    mmr_lambda=mmr_lambda if mmr else None,
+                ),
+            ),
+            chunking=ChunkingSettings(
+                tokens=chunk_tokens,
+                overlap=chunk_overlap,
+                respect_pages=not merge_pages,
+                page_range=PageRange.parse(pages) if pages is not None else None,
+                lazy_pages=lazy_pages,
+            ),
+            reading=ReadingSettings(
+                llm=LLMSettings(
+                    backend=llm_backend,
+                    model_name=model,
+                    base_url=base_url,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    fake_latency=fake_latency,
+                    fake_answer=fake_answer,
+                ),
+                concurrency=llm_concurrency if llm_concurrency > 1 else None,
+                prefilter_threshold=prefilter_threshold if prefilter else None,
+                pack_tokens=pack_tokens if pack else None,
+                consistent_values=consistent_values,
+                max_calls=max_llm_calls,
+            ),
+            cache=CacheSettings(
+                path=None if no_cache else database.get_cache_path(),
+                size=cache_size,
+                llm_entries=llm_cache_entries,
+                llm_ttl=(
+                    llm_cache_ttl * 24 * 3600 if llm_cache_ttl is not None else None
+                ),
+            ),
+            budget=BudgetSettings(token_budget, soft_token_budget, soft_budget_action),
+            instrument=report or prometheus_file is not None,
+        )
+        if settings.instrument:
+            instrumentation.enable()
+
+        page_cache = settings.cache.disk_cache("pages")
+        response_cache = settings.cache.response_cache()
+        if response_cache is not None:
+            response_cache.invalidate(
+                None if clear_llm_cache else OpenAIReader.template_versions()
+            )
+            response_cache.close()
+
+        # Find the most similar pages of every paper at once in the corpus index, within the token budget
+        pages_by_paper = None
+        index_errors = {}
+        corpus_budget = None
+        corpus_index = settings.search.enabled and corpus_index
+        if corpus_index and not dry_run:
+            corpus_budget = settings.budget.account()
+            try:
+                pages_by_paper, index_errors = _search_corpus_index(
+                    database, settings, page_cache, downloaded_papers, corpus_budget
+                )
+            except BudgetExceeded as error:
+                logger.warning("Stopping the corpus index search: %s", error)
+            # The papers are parsed with the budget left
+            settings = settings.spend(corpus_budget)
+
         base_path = os.path.abspath(path)
-        with open(f"{base_path}/output.json", "w", encoding="utf-8") as output_file:
-            json.dump(values_dict, output_file)
+        results_file = ResultsFile(os.path.join(base_path, "output.jsonl"), fsync=fsync)
+        manifest = ParseManifest(os.path.join(base_path, "manifest.json"))
+        result_settings = {
+            **settings.result_settings(),
+            "corpus_index": corpus_index,
+        }
+        if restart and not dry_run:
+            results_file.clear()
+            manifest.clear()
+
+        all_pdf_paths = {
+            paper_path: os.path.join(path, "pdfs", paper_path)
+            for paper_path in downloaded_papers
+        }
+        settings_key = manifest.settings_key(result_settings)
+
+        def content_hash(paper_path: str) -> Optional[str]:
+            if paper_path not in all_pdf_paths:
+                return None
+            return manifest.content_hash(paper_path, all_pdf_paths[paper_path])
+
+        if incremental:
+            # Only parse the new and changed pdfs, and the new targets of the others
+            targets_by_paper = manifest.pending(all_pdf_paths, targets, result_settings)
+        else:
+            # Resume from the papers already parsed for every target, with these settings and pdfs
+            completed = (
+                set()
+                if restart
+                else results_file.completed(targets, settings_key, content_hash)
+            )
+            targets_by_paper = {
+                paper_path: targets
+                for paper_path in downloaded_papers
+                if paper_path not in completed
+            }
+        if len(targets_by_paper) < len(downloaded_papers):
+            logger.info(
+                "Skipping %d papers already parsed in %s",
+                len(downloaded_papers) - len(targets_by_paper),
+                results_file.path,
+            )
+
+        # The papers that could not be indexed are left out, as the other engines leave out the ones they
+        # cannot read or embed
+        papers_to_parse = {
+            paper_path: (all_pdf_paths[paper_path], paper_targets)
+            for paper_path, paper_targets in targets_by_paper.items()
+            if paper_path not in index_errors
+        }
+        if dry_run:
+            estimate = CostEstimate()
+            if corpus_index:
+                # The corpus index embeds the pages instead of the papers
+                estimate.merge(_estimate_corpus_index(database, settings, page_cache))
+                pages_by_paper = {}
+            for paper_targets, pdf_paths in _group_by_targets(papers_to_parse).items():
+                estimate.merge(
+                    estimate_papers(
+                        pdf_paths,
+                        replace(settings, targets=list(paper_targets)),
+                        pages_by_paper,
+                    )
+                )
+            _print_estimate(estimate, settings)
+            return
+
+        def on_result(paper_path: str, values: Dict[str, List[str]]) -> None:
+            results_file.append(
+                paper_path, values, settings_key, content_hash(paper_path)
+            )
+            manifest.record(
+                paper_path, all_pdf_paths[paper_path], values, result_settings
+            )
+
+        if pipeline:
+            extract = partial(
+                extract_papers_pipelined,
+                load_workers=load_workers,
+                embed_workers=embed_workers,
+                scan_workers=scan_workers,
+                queue_size=queue_size,
+            )
+        else:
+            extract = partial(extract_papers, workers=workers)
+
+        try:
+            with results_file:
+                result = _extract_by_targets(
+                    papers_to_parse,
+                    settings,
+                    partial(
+                        extract,
+                        group_size=embedding_batch_papers,
+                        pages_by_paper=pages_by_paper,
+                        on_result=on_result,
+                    ),
+                )
+        finally:
+            manifest.prune(downloaded_papers)
+            manifest.save()
+        result.errors.update(
+            (paper_path, error)
+            for paper_path, error in index_errors.items()
+            if paper_path in targets_by_paper
+        )
+
+        if corpus_budget is not None:
+            for kind, tokens in corpus_budget.totals.items():
+                result.stats[kind] = result.stats.get(kind, 0) + tokens
+        _log_parse_result(result, len(targets_by_paper), cached=settings.cache.path is not None)
+
+        # Save on the database path as output.json, with every target parsed so far if incremental
+        results_file.consolidate(
+            f"{base_path}/output.json",
+            papers=downloaded_papers,
+            targets=(
+                {paper_path: manifest.targets(paper_path) for paper_path in downloaded_papers}
+                if incremental
+                else targets
+            ),
+            settings_key=settings_key,
+        )
+
+        if settings.instrument:
+            _write_run_report(
+                base_path,
+                result,
+                len(targets_by_paper),
+                started,
+                time.perf_counter() - start,
+                result_settings=result_settings,
+                prometheus_file=prometheus_file,
+            )
 
     except Exception as error:
         if verbose:
@@ -520,6 +1649,8 @@ def parse(
         else:
             typer.echo(error)
         raise typer.Exit(code=1)
+    finally:
+        instrumentation.disable()
 
 
 @app.command("version")
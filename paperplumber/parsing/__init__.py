@@ -1,4 +1,15 @@
 """
 This module contains the parsers for the pdf files with large language models.
+
+The reader of the llmreader module is imported on first use, so that the light modules of the
+package, e.g. the options of the command line, can be imported without the language models.
 """
-from .llmreader import *
+import importlib
+
+_LLMREADER_NAMES = ("OpenAIReader", "OPENAI_API_KEY")
+
+
+def __getattr__(name: str):
+    if name in _LLMREADER_NAMES:
+        return getattr(importlib.import_module(".llmreader", __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
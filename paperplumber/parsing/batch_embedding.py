@@ -0,0 +1,153 @@
+"""This module implements batched embedding of the pages of many documents"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from langchain.embeddings.base import Embeddings
+
+from paperplumber import instrumentation
+from paperplumber.logger import get_logger
+from paperplumber.tokens import count_tokens
+
+logger = get_logger(__name__)
+
+
+class BatchEmbedder:
+    """
+    A class used to embed the pages of many documents with as few requests as possible.
+
+    The pages of all the documents are packed into batches holding at most a given number
+    of tokens and of texts, the batches are sent to the embedding model with a bounded
+    number of concurrent requests, and the vectors are scattered back to their documents.
+    Any langchain ``Embeddings`` can be used as the embedding model.
+
+    Attributes
+    ----------
+    embedder : Embeddings
+        The embedding model.
+    max_batch_tokens : int
+        The maximum number of tokens in a batch.
+    max_batch_size : int
+        The maximum number of texts in a batch.
+    max_concurrency : int
+        The maximum number of batches embedded at the same time.
+    token_counter : Callable[[str], int]
+        The function counting the tokens of a text, by default the ``count_tokens`` method of the
+        embedding model if it has one, or the tokenizer of the model.
+    requests : int
+        The number of batches sent to the embedding model.
+
+    Methods
+    -------
+    pack(texts: List[str]):
+        Packs texts into batches of text indices.
+    embed_documents(documents: Dict[str, List[str]]):
+        Embeds the pages of many documents.
+    """
+
+    def __init__(
+        self,
+        embedder: Embeddings,
+        max_batch_tokens: int = 100000,
+        max_batch_size: int = 2048,
+        max_concurrency: int = 4,
+        token_counter: Optional[Callable[[str], int]] = None,
+    ):
+        self.embedder = embedder
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        # A local embedding model may count its own tokens, without any tokenizer to download
+        self.token_counter = (
+            token_counter
+            or getattr(embedder, "count_tokens", None)
+            or (lambda text: count_tokens(text, getattr(embedder, "model", None)))
+        )
+        self.requests = 0
+
+    def pack(self, texts: List[str]) -> List[List[int]]:
+        """
+        Packs texts, in order, into batches within the token and size limits.
+
+        A text longer than the token limit is put in a batch of its own.
+
+        Parameters
+        ----------
+            texts : List[str]
+                The texts to pack.
+
+        Returns
+        -------
+        List[List[int]]
+            The indices of the texts of every batch.
+        """
+        batches: List[List[int]] = []
+        batch: List[int] = []
+        batch_tokens = 0
+        for i, text in enumerate(texts):
+            tokens = self.token_counter(text)
+            if tokens > self.max_batch_tokens:
+                logger.warning(
+                    "A text of %d tokens exceeds the batch limit of %d tokens.",
+                    tokens,
+                    self.max_batch_tokens,
+                )
+            if batch and (
+                batch_tokens + tokens > self.max_batch_tokens
+                or len(batch) >= self.max_batch_size
+            ):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(i)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def embed_documents(
+        self, documents: Dict[str, List[str]]
+    ) -> Dict[str, List[List[float]]]:
+        """
+        Embeds the pages of many documents with batched requests.
+
+        Parameters
+        ----------
+            documents : Dict[str, List[str]]
+                The texts of the pages, by document.
+
+        Returns
+        -------
+        Dict[str, List[List[float]]]
+            The vectors of the pages, by document, in the same order as the texts.
+        """
+        owners: List[Tuple[str, int]] = []
+        texts: List[str] = []
+        for name, pages in documents.items():
+            for i, text in enumerate(pages):
+                owners.append((name, i))
+                texts.append(text)
+
+        batches = self.pack(texts)
+        logger.debug(
+            "Embedding %d pages of %d documents in %d requests",
+            len(texts),
+            len(documents),
+            len(batches),
+        )
+
+        def embed(batch: List[int]) -> List[List[float]]:
+            with instrumentation.timed("embed"):
+                return self.embedder.embed_documents([texts[i] for i in batch])
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            batch_vectors = list(executor.map(embed, batches))
+        self.requests += len(batches)
+        instrumentation.count("embedding_requests", len(batches))
+
+        vectors: Dict[str, List[List[float]]] = {
+            name: [None] * len(pages) for name, pages in documents.items()
+        }
+        for batch, results in zip(batches, batch_vectors):
+            for i, vector in zip(batch, results):
+                name, page = owners[i]
+                vectors[name][page] = vector
+        return vectors
@@ -0,0 +1,258 @@
+"""This module implements a BM25 inverted index of pages, and the fusion of rankings"""
+import json
+import math
+import os
+from collections import Counter
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from langchain.docstore.document import Document
+
+from paperplumber import instrumentation
+from paperplumber.logger import get_logger
+from paperplumber.parsing.prefilter import tokenize
+
+logger = get_logger(__name__)
+
+
+def _page_key(doc: Document) -> Hashable:
+    return doc.metadata.get("paper"), doc.page_content
+
+
+def reciprocal_rank_scores(
+    rankings: Iterable[List[Document]],
+    k: int = 60,
+    key: Callable[[Document], Hashable] = _page_key,
+) -> List[Tuple[Document, float]]:
+    """
+    Fuses several rankings of pages into one, with reciprocal rank fusion, and returns the
+    fused scores.
+
+    Each page scores the sum of 1 / (k + rank) over the rankings it appears in, so a page
+    ranked well by any ranking comes first, without having to calibrate their scores.
+
+    Args:
+        rankings (Iterable[List[Document]]): The rankings, best page first.
+        k (int): The constant damping the weight of the first ranks. Default is 60.
+        key (Callable[[Document], Hashable]): The identity of a page across the rankings.
+            Default is the paper of the page and its text.
+
+    Returns:
+        List[Tuple[Document, float]]: Every page of the rankings and its score, best first.
+    """
+    scores: Dict[Hashable, float] = {}
+    pages: Dict[Hashable, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            doc_key = key(doc)
+            pages.setdefault(doc_key, doc)
+            scores[doc_key] = scores.get(doc_key, 0.0) + 1.0 / (k + rank)
+    return [
+        (pages[doc_key], scores[doc_key])
+        for doc_key in sorted(scores, key=lambda x: -scores[x])
+    ]
+
+
+def reciprocal_rank_fusion(
+    rankings: Iterable[List[Document]],
+    k: int = 60,
+    key: Callable[[Document], Hashable] = _page_key,
+) -> List[Document]:
+    """
+    Fuses several rankings of pages into one, with reciprocal rank fusion.
+
+    Args:
+        rankings (Iterable[List[Document]]): The rankings, best page first.
+        k (int): The constant damping the weight of the first ranks. Default is 60.
+        key (Callable[[Document], Hashable]): The identity of a page across the rankings.
+            Default is the paper of the page and its text.
+
+    Returns:
+        List[Document]: Every page of the rankings, best first.
+    """
+    return [doc for doc, _ in reciprocal_rank_scores(rankings, k, key)]
+
+
+class BM25Index:
+    """
+    An inverted index of pages ranked with Okapi BM25, which runs without any network access.
+
+    Pages are matched on their exact words, so symbols and abbreviations such as ``T2`` or
+    ``k_f`` are found even when an embedding model does not know them. The index can be saved
+    to and loaded from a JSON file, and pages can be added and deleted incrementally.
+
+    Attributes:
+    k1 (float): The saturation of the term frequencies.
+    b (float): The normalization of the term frequencies by the page lengths.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self._documents: Dict[int, Document] = {}
+        self._lengths: Dict[int, int] = {}
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def add(self, documents: Iterable[Document]) -> List[int]:
+        """
+        Adds pages to the index.
+
+        Args:
+            documents (Iterable[Document]): The pages to add.
+
+        Returns:
+            List[int]: The ids of the added pages, to delete them later.
+        """
+        ids = []
+        for doc in documents:
+            doc_id = self._next_id
+            self._next_id += 1
+            tokens = tokenize(doc.page_content)
+            for term, count in Counter(tokens).items():
+                self._postings.setdefault(term, {})[doc_id] = count
+            self._documents[doc_id] = doc
+            self._lengths[doc_id] = len(tokens)
+            ids.append(doc_id)
+        return ids
+
+    def delete(self, ids: Iterable[int]) -> None:
+        """
+        Deletes pages from the index.
+
+        Args:
+            ids (Iterable[int]): The ids of the pages, as returned by add.
+        """
+        for doc_id in ids:
+            doc = self._documents.pop(doc_id, None)
+            if doc is None:
+                continue
+            del self._lengths[doc_id]
+            for term in set(tokenize(doc.page_content)):
+                postings = self._postings[term]
+                del postings[doc_id]
+                if not postings:
+                    del self._postings[term]
+
+    def scores(self, question: str) -> Dict[int, float]:
+        """
+        Returns the BM25 score of every page matching at least one word of a question.
+
+        Args:
+            question (str): The question.
+
+        Returns:
+            Dict[int, float]: The scores, by page id.
+        """
+        if not self._documents:
+            return {}
+
+        average_length = sum(self._lengths.values()) / len(self._documents)
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(question)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(
+                1 + (len(self._documents) - len(postings) + 0.5) / (len(postings) + 0.5)
+            )
+            for doc_id, count in postings.items():
+                length_norm = 1 - self.b + self.b * self._lengths[doc_id] / average_length
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * count * (
+                    self.k1 + 1
+                ) / (count + self.k1 * length_norm)
+        return scores
+
+    def search_with_scores(
+        self, question: str, k: Optional[int] = 4, paper: Optional[str] = None
+    ) -> List[Tuple[Document, float]]:
+        """
+        Returns the pages matching a question and their BM25 scores, best first.
+
+        Args:
+            question (str): The question.
+            k (Optional[int]): The max number of pages to return. Default is 4, None for every matching page.
+            paper (Optional[str]): The name of the paper to search in. Default is None, for every page.
+
+        Returns:
+            List[Tuple[Document, float]]: The pages matching at least one word of the question and
+                their scores, which can be fewer than k.
+        """
+        with instrumentation.timed("search"):
+            scores = self.scores(question)
+            if paper is not None:
+                scores = {
+                    doc_id: score
+                    for doc_id, score in scores.items()
+                    if self._documents[doc_id].metadata.get("paper") == paper
+                }
+            ranked = sorted(scores, key=lambda doc_id: (-scores[doc_id], doc_id))
+        return [(self._documents[doc_id], scores[doc_id]) for doc_id in ranked[:k]]
+
+    def search(
+        self, question: str, k: Optional[int] = 4, paper: Optional[str] = None
+    ) -> List[Document]:
+        """
+        Returns the pages matching a question, best first.
+
+        Args:
+            question (str): The question.
+            k (Optional[int]): The max number of pages to return. Default is 4, None for every matching page.
+            paper (Optional[str]): The name of the paper to search in. Default is None, for every page.
+
+        Returns:
+            List[Document]: The pages matching at least one word of the question, which can be fewer than k.
+        """
+        return [doc for doc, _ in self.search_with_scores(question, k, paper)]
+
+    def save(self, path: str) -> None:
+        """
+        Saves the index to a JSON file, atomically.
+
+        Args:
+            path (str): The path to the file.
+        """
+        index = {
+            "k1": self.k1,
+            "b": self.b,
+            "next_id": self._next_id,
+            "documents": {
+                doc_id: {"page_content": doc.page_content, "metadata": doc.metadata}
+                for doc_id, doc in self._documents.items()
+            },
+            "lengths": self._lengths,
+            "postings": self._postings,
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(index, file)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """
+        Loads an index saved to a JSON file.
+
+        Args:
+            path (str): The path to the file.
+
+        Returns:
+            BM25Index: The index.
+        """
+        with open(path, "r", encoding="utf-8") as file:
+            index = json.load(file)
+
+        # JSON object keys are strings, the page ids are integers
+        bm25 = cls(k1=index["k1"], b=index["b"])
+        bm25._next_id = index["next_id"]
+        bm25._documents = {
+            int(doc_id): Document(**doc) for doc_id, doc in index["documents"].items()
+        }
+        bm25._lengths = {int(doc_id): length for doc_id, length in index["lengths"].items()}
+        bm25._postings = {
+            term: {int(doc_id): count for doc_id, count in postings.items()}
+            for term, postings in index["postings"].items()
+        }
+        return bm25
@@ -0,0 +1,261 @@
+"""This module implements the token budgets of a parse run, and the estimation of its cost"""
+import threading
+from dataclasses import dataclass
+from typing import List, Optional
+
+from langchain.embeddings.base import Embeddings
+
+from paperplumber import instrumentation
+from paperplumber.logger import get_logger
+from paperplumber.parsing.llm_backend import LLMBackend, LLMSettings
+from paperplumber.parsing.options import BudgetAction, EmbeddingBackend
+from paperplumber.tokens import estimate_tokens
+
+logger = get_logger(__name__)
+
+# The kinds of tokens a budget adds up
+LLM_TOKENS = "llm_tokens"
+EMBEDDING_TOKENS = "embedding_tokens"
+
+# The model of the OpenAI embeddings of langchain
+OPENAI_EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# The USD price of a thousand prompt and completion tokens of the OpenAI models, by model name prefix
+PRICES_PER_1K_TOKENS = {
+    "gpt-3.5-turbo": (0.0015, 0.002),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4": (0.03, 0.06),
+    "text-embedding-ada-002": (0.0001, 0.0),
+}
+
+
+class BudgetExceeded(RuntimeError):
+    """Raised before a request to a model that would use more tokens than the hard budget left."""
+
+
+class TokenBudget:
+    """
+    A thread-safe account of the tokens sent to the language and embedding models against a hard and
+    a soft budget. The tokens are also counted for the paper being parsed in the run report, if the
+    instrumentation is enabled.
+
+    Every request is charged before it is sent: a request that would take the total over the hard budget
+    raises BudgetExceeded instead, and so does every later one, so that the run stops cleanly with the
+    papers parsed so far. Once the total goes over the soft budget, a warning is logged, and the pages that
+    do not pass the pre-filter are skipped from then on if the soft action is prefilter.
+
+    Attributes:
+    hard (Optional[int]): The max number of tokens of the run, or None for no cap.
+    soft (Optional[int]): The number of tokens after which the soft action is taken, or None for never.
+    action (BudgetAction): What happens once the soft budget is used up.
+    totals (Dict[str, int]): The tokens of the language model prompts and answers (llm_tokens) and of the
+        embedded texts (embedding_tokens).
+    exceeded (bool): Whether a request was refused, after which every request is.
+    """
+
+    def __init__(
+        self,
+        hard: Optional[int] = None,
+        soft: Optional[int] = None,
+        action: BudgetAction = BudgetAction.WARN,
+    ):
+        self.hard = hard
+        self.soft = soft
+        self.action = BudgetAction(action)
+        self.totals = {LLM_TOKENS: 0, EMBEDDING_TOKENS: 0}
+        self.exceeded = False
+        self._soft_exceeded = False
+        self._lock = threading.Lock()
+
+    @property
+    def used(self) -> int:
+        """The tokens used so far."""
+        return sum(self.totals.values())
+
+    def check(self) -> None:
+        """Raises BudgetExceeded if a request was already refused."""
+        if self.exceeded:
+            raise BudgetExceeded(f"The token budget of {self.hard} tokens is used up")
+
+    def charge(self, kind: str, tokens: int) -> None:
+        """
+        Charges the tokens of a request about to be sent.
+
+        Args:
+            kind (str): The kind of tokens, LLM_TOKENS or EMBEDDING_TOKENS.
+            tokens (int): The number of tokens of the request.
+
+        Raises:
+            BudgetExceeded: If the request would take the tokens used over the hard budget.
+        """
+        with self._lock:
+            self.check()
+            if self.hard is not None and self.used + tokens > self.hard:
+                self.exceeded = True
+                raise BudgetExceeded(
+                    f"The token budget of {self.hard} tokens is used up, "
+                    f"{self.used} tokens were used and the next request needs {tokens}"
+                )
+            self._add(kind, tokens)
+
+    def record(self, kind: str, tokens: int) -> None:
+        """Adds tokens already used, e.g. of an answer, without enforcing the hard budget."""
+        with self._lock:
+            self._add(kind, tokens)
+
+    def _add(self, kind: str, tokens: int) -> None:
+        self.totals[kind] += tokens
+        instrumentation.count(kind, tokens)
+        if self.soft is not None and not self._soft_exceeded and self.used > self.soft:
+            self._soft_exceeded = True
+            logger.warning(
+                "The soft token budget of %d tokens is used up%s",
+                self.soft,
+                (
+                    ", only the pages passing the pre-filter are read from now on"
+                    if self.action == BudgetAction.PREFILTER
+                    else ""
+                ),
+            )
+
+    def soft_exceeded(self) -> bool:
+        """Returns whether the soft budget is used up."""
+        return self._soft_exceeded
+
+    def prefilter_only(self) -> bool:
+        """Returns whether only the pages passing the pre-filter are to be read from now on."""
+        return self._soft_exceeded and self.action == BudgetAction.PREFILTER
+
+
+@dataclass
+class BudgetSettings:
+    """
+    The token budgets of a parse run.
+
+    Attributes:
+    hard (Optional[int]): The max number of tokens sent to the models, or None for no cap.
+    soft (Optional[int]): The number of tokens after which the action is taken, or None for never.
+    action (BudgetAction): What happens once the soft budget is used up.
+    """
+
+    hard: Optional[int] = None
+    soft: Optional[int] = None
+    action: BudgetAction = BudgetAction.WARN
+
+    def account(self) -> Optional[TokenBudget]:
+        """Returns a new account of the tokens of the run, or None if it has no budget."""
+        if self.hard is None and self.soft is None:
+            return None
+        return TokenBudget(self.hard, self.soft, self.action)
+
+    def spend(self, budget: Optional[TokenBudget]) -> "BudgetSettings":
+        """
+        Returns the budgets left after the tokens of another account, e.g. of the corpus index search,
+        or nothing left if it refused a request.
+        """
+        if budget is None:
+            return self
+
+        def left(total: Optional[int]) -> Optional[int]:
+            if total is None:
+                return None
+            return 0 if budget.exceeded else max(total - budget.used, 0)
+
+        return BudgetSettings(left(self.hard), left(self.soft), self.action)
+
+    def share(self, workers: int) -> "BudgetSettings":
+        """Returns the equal share of the budgets of every one of the worker processes."""
+
+        def shared(total: Optional[int]) -> Optional[int]:
+            return None if total is None else total // workers
+
+        return BudgetSettings(shared(self.hard), shared(self.soft), self.action)
+
+
+class BudgetedEmbeddings(Embeddings):
+    """
+    An embedding model charging the tokens of every request to a TokenBudget before sending it.
+
+    It takes the name of the embedding model it wraps, so that the cached indexes are shared with it.
+    The requests to a local model, flagged by a true ``local`` attribute, are free and not charged.
+    """
+
+    def __init__(self, embedder: Embeddings, budget: TokenBudget):
+        self.embedder = embedder
+        self.budget = budget
+        self.model = getattr(embedder, "model", None) or type(embedder).__name__
+        self.local = getattr(embedder, "local", False)
+
+    def count_tokens(self, text: str) -> int:
+        """Returns the number of tokens of a text for the wrapped model."""
+        count = getattr(self.embedder, "count_tokens", None)
+        if count is not None:
+            return count(text)
+        return estimate_tokens(text, self.model)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not self.local:
+            self.budget.charge(EMBEDDING_TOKENS, sum(map(self.count_tokens, texts)))
+        return self.embedder.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        if not self.local:
+            self.budget.charge(EMBEDDING_TOKENS, self.count_tokens(text))
+        return self.embedder.embed_query(text)
+
+
+def _price(model_name: str) -> Optional[tuple]:
+    """Returns the prices of the OpenAI model with the longest matching name prefix, if any."""
+    prefixes = [prefix for prefix in PRICES_PER_1K_TOKENS if model_name.startswith(prefix)]
+    if not prefixes:
+        return None
+    return PRICES_PER_1K_TOKENS[max(prefixes, key=len)]
+
+
+@dataclass
+class CostEstimate:
+    """
+    The estimated tokens of a parse run, as sent to the models without any cache hit.
+
+    Attributes:
+    papers (int): The number of papers.
+    prompts (int): The number of prompts sent to the language model.
+    prompt_tokens (int): The tokens of the prompts.
+    completion_tokens (int): The tokens of the answers.
+    embedding_tokens (int): The tokens of the embedded pages and targets.
+    """
+
+    papers: int = 0
+    prompts: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    embedding_tokens: int = 0
+
+    def merge(self, other: "CostEstimate") -> None:
+        """Adds the papers, prompts and tokens of another estimate to this one."""
+        self.papers += other.papers
+        self.prompts += other.prompts
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.embedding_tokens += other.embedding_tokens
+
+    @property
+    def tokens(self) -> int:
+        """The tokens of the run."""
+        return self.prompt_tokens + self.completion_tokens + self.embedding_tokens
+
+    def llm_cost(self, llm: LLMSettings) -> Optional[float]:
+        """Returns the USD cost of the prompts and answers, or None if the price of the model is unknown."""
+        backend = LLMBackend(llm.backend)
+        if backend == LLMBackend.FAKE:
+            return 0.0
+        price = _price(llm.model_name) if backend == LLMBackend.OPENAI else None
+        if price is None:
+            return None
+        return (self.prompt_tokens * price[0] + self.completion_tokens * price[1]) / 1000
+
+    def embedding_cost(self, embedding: EmbeddingBackend) -> Optional[float]:
+        """Returns the USD cost of the embedded texts."""
+        if EmbeddingBackend(embedding) == EmbeddingBackend.HASHING:
+            return 0.0
+        return self.embedding_tokens * _price(OPENAI_EMBEDDING_MODEL)[0] / 1000
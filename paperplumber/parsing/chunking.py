@@ -0,0 +1,77 @@
+"""This module implements the token-aware chunking of the pages of a pdf file"""
+import bisect
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional
+
+from langchain.docstore.document import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from paperplumber.logger import get_logger
+from paperplumber.tokens import count_tokens
+
+logger = get_logger(__name__)
+
+
+@dataclass(frozen=True)
+class TokenChunker:
+    """
+    Splits the pages of a pdf into chunks of a given number of tokens.
+
+    The text is split on paragraphs, then lines, then words, so that a chunk is cut at the
+    most natural place that keeps it under the size. By default a chunk never spans two pages,
+    so that its page number is exact; with ``respect_pages`` False, the pages are joined first
+    and a chunk gets the number of the page it starts in.
+
+    Attributes:
+    chunk_tokens (int): The max number of tokens of a chunk.
+    chunk_overlap (int): The number of tokens shared by two consecutive chunks.
+    respect_pages (bool): Whether to split every page on its own.
+    model_name (Optional[str]): The model whose tokenizer counts the tokens, or None for the default one.
+    """
+
+    chunk_tokens: int = 500
+    chunk_overlap: int = 50
+    respect_pages: bool = True
+    model_name: Optional[str] = None
+
+    def settings(self) -> Dict[str, Any]:
+        """Returns the settings of the chunker, which are part of the page cache key."""
+        return {"splitter": type(self).__name__, **asdict(self)}
+
+    def _count_tokens(self, text: str) -> int:
+        return count_tokens(text, self.model_name)
+
+    def _splitter(self, add_start_index: bool = False) -> RecursiveCharacterTextSplitter:
+        return RecursiveCharacterTextSplitter(
+            chunk_size=self.chunk_tokens,
+            chunk_overlap=self.chunk_overlap,
+            length_function=self._count_tokens,
+            add_start_index=add_start_index,
+        )
+
+    def split(self, pages: List[Document]) -> List[Document]:
+        """
+        Splits pages into chunks.
+
+        Args:
+            pages (List[Document]): The pages, with their number in the ``page`` metadata.
+
+        Returns:
+            List[Document]: The chunks, with the metadata of the page they start in.
+        """
+        if self.respect_pages:
+            return self._splitter().split_documents(pages)
+
+        separator = "\n\n"
+        starts, offset = [], 0
+        for page in pages:
+            starts.append(offset)
+            offset += len(page.page_content) + len(separator)
+        text = separator.join(page.page_content for page in pages)
+
+        chunks = []
+        for chunk in self._splitter(add_start_index=True).create_documents([text]):
+            start = chunk.metadata.pop("start_index")
+            page = pages[max(0, bisect.bisect_right(starts, start) - 1)]
+            chunks.append(Document(page_content=chunk.page_content, metadata=dict(page.metadata)))
+        return chunks
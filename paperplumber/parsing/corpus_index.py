@@ -0,0 +1,568 @@
+"""This module implements a vector index over all the pdf files of a database"""
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores import FAISS
+
+from paperplumber.cache import DiskCache, file_sha256
+from paperplumber.logger import get_logger
+from paperplumber.parsing.batch_embedding import BatchEmbedder
+from paperplumber.parsing.bm25 import BM25Index, reciprocal_rank_fusion
+from paperplumber.parsing.budget import BudgetExceeded
+from paperplumber.parsing.chunking import TokenChunker
+from paperplumber.parsing.embedding_search import default_embedder
+from paperplumber.parsing.pdf_parser import PageRange, PDFParser
+
+logger = get_logger(__name__)
+
+
+class CorpusIndex:  # pylint: disable=too-many-instance-attributes
+    """
+    A FAISS index holding every page of every pdf of a database, stored on disk.
+
+    Each page is indexed with the name of its pdf file (``paper``) and its page number
+    (``page``) as metadata. The index is updated incrementally: new pdfs are added, changed
+    pdfs are embedded again and removed pdfs are dropped, without rebuilding the rest. The
+    pdfs indexed with other chunking settings or another page range are indexed again too.
+
+    Attributes
+    ----------
+    directory : str
+        The directory where the index is stored.
+    _embedder : Embeddings
+        The embedding model used for the pages and the questions.
+    _page_cache : Optional[DiskCache]
+        The cache of extracted pages, if any.
+    _chunker : Optional[TokenChunker]
+        The token-aware chunker of the pages, if any.
+    _page_range : Optional[PageRange]
+        The pages of every pdf to index, or None for every page.
+    _papers : Dict[str, Dict]
+        The content hash, the chunking settings and the docstore ids of every indexed paper.
+    errors : Dict[str, str]
+        The error message of every pdf that the last update could not index.
+    _faiss_index : Optional[FAISS]
+        The FAISS index, or None if nothing was indexed yet.
+
+    The FAISS index is handled by the ``_init_index``, ``_load_index``, ``_save_index``,
+    ``_add_pages``, ``_delete_pages`` and ``_search`` methods, which the indexes of other
+    kinds override.
+
+    Methods
+    -------
+    pending(pdf_paths: Iterable[str]):
+        Returns the names of the pdfs that update would index.
+    update(pdf_paths: Iterable[str]):
+        Adds new and changed pdfs to the index, and drops the ones not given.
+    similarity_search(question: str, k: int = 4, paper: Optional[str] = None):
+        Returns the top k pages for a question across the corpus, or within one paper.
+    search_per_paper(question: str, k: int = 2, papers: Optional[Iterable[str]] = None):
+        Returns the top k pages of every paper, or of the given papers, for a question.
+    """
+
+    _PAPERS_FILENAME = "papers.json"
+
+    def __init__(
+        self,
+        directory: str,
+        embedder: Optional[Embeddings] = None,
+        page_cache: Optional[DiskCache] = None,
+        chunker: Optional[TokenChunker] = None,
+        page_range: Optional[PageRange] = None,
+    ):
+        self.directory = directory
+        self._page_cache = page_cache
+        self._chunker = chunker
+        self._page_range = page_range
+        self._papers: Dict[str, Dict] = {}
+        self.errors: Dict[str, str] = {}
+        self._init_index(embedder)
+
+        self._load()
+
+    def _init_index(self, embedder: Optional[Embeddings]) -> None:
+        """
+        Sets up an empty index.
+        """
+        self._embedder = embedder or default_embedder()
+        self._faiss_index: Optional[FAISS] = None
+
+    def _papers_path(self) -> str:
+        return os.path.join(self.directory, self._PAPERS_FILENAME)
+
+    def _load(self) -> None:
+        """
+        Loads the index from its directory, if it was saved before.
+        """
+        if not os.path.exists(self._papers_path()):
+            return
+
+        with open(self._papers_path(), "r", encoding="utf-8") as file:
+            self._papers = json.load(file)
+        if any(paper["ids"] for paper in self._papers.values()):
+            self._load_index()
+
+    def _load_index(self) -> None:
+        """
+        Loads the saved index from its directory.
+        """
+        self._faiss_index = FAISS.load_local(self.directory, self._embedder)
+
+    def _save_index(self) -> None:
+        """
+        Saves the index to its directory, if not empty.
+        """
+        if self._faiss_index is not None:
+            self._faiss_index.save_local(self.directory)
+
+    def save(self) -> None:
+        """
+        Saves the index to its directory.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self._save_index()
+
+        # Write the list of papers last, so that it never refers to missing vectors
+        tmp_path = self._papers_path() + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(self._papers, file)
+        os.replace(tmp_path, self._papers_path())
+
+    @property
+    def papers(self) -> List[str]:
+        """
+        Returns the names of the indexed papers.
+        """
+        return sorted(self._papers)
+
+    def __len__(self) -> int:
+        return 0 if self._faiss_index is None else self._faiss_index.index.ntotal
+
+    def _get_pages(self, name: str, pdf_path: str) -> List[Document]:
+        """
+        Returns the pages of a pdf, with the paper name and page number as metadata.
+        """
+        return [
+            Document(
+                page_content=page.page_content,
+                metadata={
+                    **page.metadata,
+                    "paper": name,
+                    "page": page.metadata.get("page"),
+                },
+            )
+            for page in PDFParser(
+                pdf_path,
+                page_cache=self._page_cache,
+                chunker=self._chunker,
+                page_range=self._page_range,
+            ).pages
+        ]
+
+    def _add(
+        self,
+        name: str,
+        content_hash: str,
+        pages: List[Document],
+        vectors: Optional[List[List[float]]] = None,
+    ) -> None:
+        """
+        Adds every page of a paper to the index, embedding them unless the vectors are given.
+        """
+        self._papers[name] = {
+            "hash": content_hash,
+            "chunking": self._chunking(),
+            "ids": self._add_pages(pages, vectors),
+        }
+
+    def _chunking(self) -> Optional[Dict]:
+        """
+        Returns the chunking settings of the pages, or None for the default splitter and every page.
+        """
+        chunking = self._chunker.settings() if self._chunker is not None else None
+        if self._page_range is None:
+            return chunking
+        return {**(chunking or {}), "pages": [self._page_range.first, self._page_range.last]}
+
+    def _add_pages(
+        self, pages: List[Document], vectors: Optional[List[List[float]]]
+    ) -> List:
+        """
+        Adds pages to the index, and returns their ids.
+        """
+        if vectors is None:
+            vectors = self._embedder.embed_documents(
+                [page.page_content for page in pages]
+            )
+        text_embeddings = list(zip((page.page_content for page in pages), vectors))
+        metadatas = [page.metadata for page in pages]
+
+        if not pages:
+            ids = []
+        elif self._faiss_index is None:
+            self._faiss_index = FAISS.from_embeddings(
+                text_embeddings, self._embedder, metadatas=metadatas
+            )
+            ids = list(self._faiss_index.index_to_docstore_id.values())
+        else:
+            ids = self._faiss_index.add_embeddings(text_embeddings, metadatas=metadatas)
+        return ids
+
+    def _delete_pages(self, ids: List) -> None:
+        """
+        Deletes pages from the index.
+        """
+        if len(self) == len(ids):
+            self._faiss_index = None
+        else:
+            self._faiss_index.delete(ids)
+
+    def remove(self, name: str) -> None:
+        """
+        Removes every page of a paper from the index.
+
+        Parameters
+        ----------
+            name : str
+                The name of the paper, i.e. the name of its pdf file.
+        """
+        paper = self._papers.pop(name, None)
+        if paper is not None and paper["ids"]:
+            self._delete_pages(paper["ids"])
+
+    def _fail(self, name: str, error: Exception) -> None:
+        """
+        Logs a pdf that could not be indexed, with its error.
+        """
+        logger.error("Failed to add %s to the corpus index: %s", name, error)
+        self.errors[name] = f"{type(error).__name__}: {error}"
+
+    def _is_current(self, name: str, content_hash: str) -> bool:
+        """
+        Returns whether a paper is indexed with the given content and the current chunking settings.
+        """
+        paper = self._papers.get(name, {})
+        return paper.get("hash") == content_hash and paper.get("chunking") == self._chunking()
+
+    def pending(self, pdf_paths: Iterable[str]) -> List[str]:
+        """
+        Returns the names of the pdfs that update would index, without reading them.
+
+        Parameters
+        ----------
+            pdf_paths : Iterable[str]
+                The paths to every pdf of the corpus.
+
+        Returns
+        -------
+        List[str]
+            The names of the new and changed pdfs, and of the ones indexed with other settings.
+        """
+        return sorted(
+            os.path.basename(pdf_path)
+            for pdf_path in pdf_paths
+            if not self._is_current(os.path.basename(pdf_path), file_sha256(pdf_path))
+        )
+
+    def update(
+        self,
+        pdf_paths: Iterable[str],
+        save: bool = True,
+        batch_embedder: Optional[BatchEmbedder] = None,
+    ) -> List[str]:
+        """
+        Adds new and changed pdfs to the index, and removes the papers whose pdf is not given.
+        A pdf that cannot be read or embedded is logged in ``errors`` and left out of the index,
+        and the others are indexed.
+
+        Parameters
+        ----------
+            pdf_paths : Iterable[str]
+                The paths to every pdf of the corpus.
+            save : bool, optional
+                Whether to save the index if it changed (default is True).
+            batch_embedder : Optional[BatchEmbedder], optional
+                If given, the pages of all the new pdfs are embedded with batched requests, and
+                one pdf at a time if a batch fails (default is None, for one request per pdf).
+
+        Returns
+        -------
+        List[str]
+            The names of the papers that were (re-)indexed.
+        """
+        pdf_paths = {os.path.basename(pdf_path): pdf_path for pdf_path in pdf_paths}
+        removed = [name for name in self._papers if name not in pdf_paths]
+        for name in removed:
+            self.remove(name)
+
+        self.errors = {}
+        added = {}
+        for name, pdf_path in sorted(pdf_paths.items()):
+            try:
+                content_hash = file_sha256(pdf_path)
+                if self._is_current(name, content_hash):
+                    continue
+                logger.info("Adding %s to the corpus index", name)
+                pages = self._get_pages(name, pdf_path)
+            except Exception as error:  # pylint: disable=broad-except
+                self._fail(name, error)
+                if name in self._papers:
+                    removed.append(name)
+                    self.remove(name)
+                continue
+            # The previous pages of a changed pdf are dropped, even if it cannot be embedded again
+            if name in self._papers:
+                removed.append(name)
+                self.remove(name)
+            added[name] = (content_hash, pages)
+
+        vectors = self._embed_batched(added, batch_embedder) if batch_embedder else {}
+        for name, (content_hash, pages) in list(added.items()):
+            try:
+                self._add(name, content_hash, pages, vectors.get(name))
+            except BudgetExceeded:
+                raise
+            except Exception as error:  # pylint: disable=broad-except
+                self._fail(name, error)
+                del added[name]
+
+        if save and (added or removed):
+            self.save()
+        return list(added)
+
+    @staticmethod
+    def _embed_batched(
+        added: Dict[str, Tuple[str, List[Document]]], batch_embedder: BatchEmbedder
+    ) -> Dict[str, List[List[float]]]:
+        """
+        Embeds the pages of the new pdfs in batches, or returns no vectors if a batch fails.
+        """
+        try:
+            return batch_embedder.embed_documents(
+                {
+                    name: [page.page_content for page in pages]
+                    for name, (_, pages) in added.items()
+                }
+            )
+        except BudgetExceeded:
+            raise
+        except Exception as error:  # pylint: disable=broad-except
+            # Leave the pdfs of the failed batch to be embedded one by one
+            logger.warning("Batched embedding failed: %s", error)
+            return {}
+
+    def similarity_search(
+        self, question: str, k: int = 4, paper: Optional[str] = None
+    ) -> List[Document]:
+        """
+        Performs a similarity search in the index for a given question.
+
+        Parameters
+        ----------
+            question : str
+                The question for which to find similar pages.
+            k : int, optional
+                The number of similar pages to find (default is 4).
+            paper : Optional[str], optional
+                The name of the paper to search in (default is None, for the whole corpus).
+
+        Returns
+        -------
+        List[Document]
+            A list of top k similar pages.
+        """
+        return self._search(question, k, paper)
+
+    def _search(
+        self, question: str, k: Optional[int], paper: Optional[str] = None
+    ) -> List[Document]:
+        """
+        Returns the top k pages for a question, or every page if k is None.
+        """
+        if self._faiss_index is None:
+            return []
+        k = len(self) if k is None else k
+        if paper is None:
+            return self._faiss_index.similarity_search(question, k=k)
+        return self._faiss_index.similarity_search(
+            question, k=k, filter={"paper": paper}, fetch_k=len(self)
+        )
+
+    def search_per_paper(
+        self, question: str, k: int = 2, papers: Optional[Iterable[str]] = None
+    ) -> Dict[str, List[Document]]:
+        """
+        Finds the top k pages of every paper for a given question.
+
+        The best ``k`` pages per paper of the whole index are ranked first, and twice as many
+        again until every paper has its k pages, so that the cost of a search grows with the
+        number of papers searched instead of the number of pages of the corpus.
+
+        Parameters
+        ----------
+            question : str
+                The question for which to find similar pages.
+            k : int, optional
+                The number of similar pages to find per paper (default is 2).
+            papers : Optional[Iterable[str]], optional
+                The names of the papers to search in (default is None, for every indexed paper).
+
+        Returns
+        -------
+        Dict[str, List[Document]]
+            The top k similar pages, by paper name.
+        """
+        names = self.papers if papers is None else sorted(set(papers) & set(self._papers))
+        wanted = {name: min(k, len(self._papers[name]["ids"])) for name in names}
+        fetch_k = k * len(wanted)
+        while True:
+            results: Dict[str, List[Document]] = {name: [] for name in wanted}
+            docs = self._search(question, k=min(fetch_k, len(self))) if fetch_k else []
+            for doc in docs:
+                pages = results.get(doc.metadata["paper"])
+                if pages is not None and len(pages) < k:
+                    pages.append(doc)
+            # Every paper has its pages, or every matching page of the corpus was ranked
+            if len(docs) < fetch_k or all(
+                len(results[name]) >= count for name, count in wanted.items()
+            ):
+                return results
+            fetch_k *= 2
+
+
+class LexicalCorpusIndex(CorpusIndex):
+    """
+    A BM25 index holding every page of every pdf of a database, stored on disk.
+
+    It is updated and searched as a CorpusIndex, but the pages are indexed by their words
+    instead of their embeddings, so no embedding model, and no network access, is needed.
+    """
+
+    _INDEX_FILENAME = "bm25.json"
+
+    def __init__(
+        self,
+        directory: str,
+        page_cache: Optional[DiskCache] = None,
+        chunker: Optional[TokenChunker] = None,
+        page_range: Optional[PageRange] = None,
+    ):
+        super().__init__(
+            directory, page_cache=page_cache, chunker=chunker, page_range=page_range
+        )
+
+    def _init_index(self, embedder: Optional[Embeddings]) -> None:
+        self._bm25 = BM25Index()
+
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, self._INDEX_FILENAME)
+
+    def _load_index(self) -> None:
+        self._bm25 = BM25Index.load(self._index_path())
+
+    def _save_index(self) -> None:
+        self._bm25.save(self._index_path())
+
+    def __len__(self) -> int:
+        return len(self._bm25)
+
+    def _add_pages(
+        self, pages: List[Document], vectors: Optional[List[List[float]]]
+    ) -> List:
+        return self._bm25.add(pages)
+
+    def _delete_pages(self, ids: List) -> None:
+        self._bm25.delete(ids)
+
+    def _search(
+        self, question: str, k: Optional[int], paper: Optional[str] = None
+    ) -> List[Document]:
+        return self._bm25.search(question, k=k, paper=paper)
+
+
+class HybridCorpusIndex:
+    """
+    A pair of corpus indexes, dense and lexical, whose rankings are fused with reciprocal
+    rank fusion.
+
+    Attributes
+    ----------
+    dense : CorpusIndex
+        The index of the page embeddings.
+    lexical : LexicalCorpusIndex
+        The index of the page words.
+    fetch_k : int
+        The min number of pages ranked by each index before the fusion.
+    """
+
+    fetch_k = 8
+
+    def __init__(self, dense: CorpusIndex, lexical: LexicalCorpusIndex):
+        self.dense = dense
+        self.lexical = lexical
+
+    @property
+    def papers(self) -> List[str]:
+        """
+        Returns the names of the indexed papers.
+        """
+        return self.dense.papers
+
+    @property
+    def errors(self) -> Dict[str, str]:
+        """
+        Returns the error message of every pdf that the last update could not index.
+        """
+        return {**self.lexical.errors, **self.dense.errors}
+
+    def update(
+        self,
+        pdf_paths: Iterable[str],
+        save: bool = True,
+        batch_embedder: Optional[BatchEmbedder] = None,
+    ) -> List[str]:
+        """
+        Updates both indexes, see CorpusIndex.update.
+        """
+        pdf_paths = list(pdf_paths)
+        added = self.dense.update(pdf_paths, save, batch_embedder)
+        added += self.lexical.update(pdf_paths, save)
+        return sorted(set(added))
+
+    def pending(self, pdf_paths: Iterable[str]) -> List[str]:
+        """
+        Returns the names of the pdfs that update would embed, see CorpusIndex.pending.
+        """
+        return self.dense.pending(pdf_paths)
+
+    def similarity_search(
+        self, question: str, k: int = 4, paper: Optional[str] = None
+    ) -> List[Document]:
+        """
+        Returns the top k pages of the fused rankings, see CorpusIndex.similarity_search.
+        """
+        fetch_k = max(self.fetch_k, 4 * k)
+        return reciprocal_rank_fusion(
+            [
+                self.dense.similarity_search(question, fetch_k, paper),
+                self.lexical.similarity_search(question, fetch_k, paper),
+            ]
+        )[:k]
+
+    def search_per_paper(
+        self, question: str, k: int = 2, papers: Optional[Iterable[str]] = None
+    ) -> Dict[str, List[Document]]:
+        """
+        Returns the top k pages of the fused rankings of every paper, see CorpusIndex.search_per_paper.
+        """
+        papers = list(papers) if papers is not None else None
+        fetch_k = max(self.fetch_k, 4 * k)
+        dense = self.dense.search_per_paper(question, fetch_k, papers)
+        lexical = self.lexical.search_per_paper(question, fetch_k, papers)
+        return {
+            name: reciprocal_rank_fusion([pages, lexical.get(name, [])])[:k]
+            for name, pages in dense.items()
+        }
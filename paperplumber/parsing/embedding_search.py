@@ -1,19 +1,42 @@
 """This module implements the embedding search of a pdf file"""
-from typing import List
+from typing import Iterable, List, Optional, Tuple
+from langchain.docstore.document import Document
 from langchain.vectorstores import FAISS
+from langchain.embeddings.base import Embeddings
 from langchain.embeddings.openai import OpenAIEmbeddings
 
+from paperplumber import instrumentation
+from paperplumber.cache import DiskCache, make_key
 from paperplumber.logger import get_logger
-from paperplumber.parsing.pdf_parser import PDFParser
+from paperplumber.parsing.batch_embedding import BatchEmbedder
+from paperplumber.parsing.chunking import TokenChunker
+from paperplumber.parsing.local_embedding import HashingEmbeddings
+from paperplumber.parsing.options import EmbeddingBackend
+from paperplumber.parsing.pdf_parser import PageRange, PDFParser
 
 
 logger = get_logger(__name__)
 
 
+def default_embedder(backend: EmbeddingBackend = EmbeddingBackend.OPENAI) -> Embeddings:
+    """Returns the embedding model of a backend, the OpenAI one by default."""
+    if EmbeddingBackend(backend) == EmbeddingBackend.HASHING:
+        return HashingEmbeddings()
+    return OpenAIEmbeddings(
+        request_timeout=10,
+        max_retries=10,
+    )
+
+
 class EmbeddingSearcher(PDFParser):
     """
     A class used to represent Document Embeddings for a specific PDF document.
 
+    If an index cache is given, the FAISS index of the document (and therefore the page
+    embeddings) is stored in it, keyed by the contents of the PDF file, the parsing settings
+    and the embedding model, and later searchers of the same file load it instead of
+    embedding the pages again.
+
     ...
 
     Attributes
@@ -24,26 +47,142 @@ class EmbeddingSearcher(PDFParser):
         The object responsible for loading and splitting the PDF document into pages.
     _pages : List[str]
         The list of pages from the loaded PDF document.
-    _faiss_index : FAISS
-        FAISS index built from the document pages.
+    _embedder : Embeddings
+        The embedding model used for the pages and the questions.
+    _index_cache : Optional[DiskCache]
+        The cache of FAISS indexes, if any.
+    _faiss_index : Optional[FAISS]
+        FAISS index built from the document pages, or None until the pages are embedded.
 
     Methods
     -------
+    set_page_embeddings(vectors: List[List[float]]):
+        Builds the FAISS index from page embeddings computed elsewhere, e.g. by a BatchEmbedder.
+    embed_all(searchers: Iterable[EmbeddingSearcher], batch_embedder: BatchEmbedder):
+        Embeds the pages of many searchers with batched requests.
     similarity_search(question: str, k: int = 2):
         Returns top k similar documents for a given question using similarity search in the FAISS index.
+    similarity_search_with_score(question: str, k: int = 2):
+        Returns top k similar documents for a given question and their similarity scores.
     """
 
-    def __init__(self, pdf_path: str):
-        super().__init__(pdf_path)
+    def __init__(
+        self,
+        pdf_path: str,
+        *,
+        page_cache: Optional[DiskCache] = None,
+        index_cache: Optional[DiskCache] = None,
+        embedder: Optional[Embeddings] = None,
+        pages: Optional[List[Document]] = None,
+        chunker: Optional[TokenChunker] = None,
+        page_range: Optional[PageRange] = None,
+    ):
+        super().__init__(
+            pdf_path,
+            page_cache=page_cache,
+            pages=pages,
+            chunker=chunker,
+            page_range=page_range,
+        )
 
         # Set up an embedding model
-        self._embedder = OpenAIEmbeddings(
-            request_timeout=10,
-            max_retries=10,
+        self._embedder = embedder or default_embedder()
+        self._index_cache = index_cache
+
+        # The index is built on the first search, unless it is cached or embedded in a batch
+        self._faiss_index = self._load_cached_index()
+
+    @property
+    def embedding_model_name(self) -> str:
+        """
+        Returns the name of the embedding model, used to tell apart cached indexes.
+        """
+        return getattr(self._embedder, "model", None) or type(self._embedder).__name__
+
+    @property
+    def needs_embedding(self) -> bool:
+        """
+        Returns whether the pages of the document still have to be embedded.
+        """
+        return self._faiss_index is None
+
+    def _index_key(self) -> str:
+        return make_key(self._cache_key(), self.embedding_model_name)
+
+    def _load_cached_index(self) -> Optional[FAISS]:
+        """
+        Returns the cached FAISS index of the document, or None if it is not cached.
+        """
+        if self._index_cache is None:
+            return None
+
+        entry = self._index_cache.get(self._index_key())
+        if entry is None:
+            instrumentation.count("index_cache_misses")
+            return None
+        instrumentation.count("index_cache_hits")
+        logger.debug("Loading cached embeddings of %s", self._pdf_path)
+        return FAISS.load_local(entry, self._embedder)
+
+    def _set_index(self, faiss_index: FAISS) -> None:
+        """
+        Sets the FAISS index of the document, and stores it in the index cache.
+        """
+        self._faiss_index = faiss_index
+        if self._index_cache is not None:
+            self._index_cache.put(self._index_key(), faiss_index.save_local)
+
+    def set_page_embeddings(self, vectors: List[List[float]]) -> None:
+        """
+        Builds the FAISS index from page embeddings computed elsewhere.
+
+        Parameters
+        ----------
+            vectors : List[List[float]]
+                The embedding of every page, in the same order as the pages.
+        """
+        self._set_index(
+            FAISS.from_embeddings(
+                list(zip((page.page_content for page in self._pages), vectors)),
+                self._embedder,
+                metadatas=[page.metadata for page in self._pages],
+            )
         )
 
-        # Build a FAISS index from the document pages
-        self._faiss_index = FAISS.from_documents(self._pages, self._embedder)
+    def _ensure_index(self) -> None:
+        """
+        Embeds the pages of the document one by one, unless they were embedded already.
+        """
+        if self._faiss_index is None:
+            with instrumentation.timed("embed"):
+                self._set_index(FAISS.from_documents(self._pages, self._embedder))
+
+    @staticmethod
+    def embed_all(
+        searchers: Iterable["EmbeddingSearcher"], batch_embedder: BatchEmbedder
+    ) -> None:
+        """
+        Embeds the pages of every searcher that needs it with batched requests.
+
+        Parameters
+        ----------
+            searchers : Iterable[EmbeddingSearcher]
+                The searchers to embed.
+            batch_embedder : BatchEmbedder
+                The batch embedder to use.
+        """
+        pending = [searcher for searcher in searchers if searcher.needs_embedding]
+        if not pending:
+            return
+
+        vectors = batch_embedder.embed_documents(
+            {
+                i: [page.page_content for page in searcher.pages]
+                for i, searcher in enumerate(pending)
+            }
+        )
+        for i, searcher in enumerate(pending):
+            searcher.set_page_embeddings(vectors[i])
 
     def similarity_search(self, question: str, k: int = 2) -> List[str]:
         """
@@ -62,5 +201,34 @@ class EmbeddingSearcher(PDFParser):
             A list of top k similar documents.
         """
 
-        docs = self._faiss_index.similarity_search(question, k=k)
+        self._ensure_index()
+        with instrumentation.timed("search"):
+            docs = self._faiss_index.similarity_search(question, k=k)
         return docs
+
+    def similarity_search_with_score(
+        self, question: str, k: int = 2
+    ) -> List[Tuple[Document, float]]:
+        """
+        Performs a similarity search in the FAISS index for a given question, with scores.
+
+        The score of a page is 1 minus half its squared L2 distance to the question, which is
+        their cosine similarity for normalized embeddings such as the OpenAI ones.
+
+        Parameters
+        ----------
+            question : str
+                The question for which to find similar documents.
+            k : int, optional
+                The number of similar documents to find (default is 2).
+
+        Returns
+        -------
+        List[Tuple[Document, float]]
+            A list of top k similar documents and their scores, the higher the more similar.
+        """
+
+        self._ensure_index()
+        with instrumentation.timed("search"):
+            scored = self._faiss_index.similarity_search_with_score(question, k=k)
+        return [(doc, 1.0 - float(distance) / 2) for doc, distance in scored]
@@ -0,0 +1,831 @@
+"""This module extracts target values from many pdf files, optionally in parallel"""
+import json
+import math
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from paperplumber import instrumentation
+from paperplumber.cache import DiskCache
+from paperplumber.logger import get_logger
+from paperplumber.parsing.batch_embedding import BatchEmbedder
+from paperplumber.parsing.budget import (
+    OPENAI_EMBEDDING_MODEL,
+    BudgetedEmbeddings,
+    BudgetExceeded,
+    CostEstimate,
+)
+from paperplumber.parsing.chunking import TokenChunker
+from paperplumber.parsing.embedding_search import EmbeddingSearcher, default_embedder
+from paperplumber.parsing.file_scan import FileScanner
+from paperplumber.parsing.lexical_search import HybridSearcher, LexicalSearcher
+from paperplumber.parsing.llmreader import OpenAIReader
+from paperplumber.parsing.local_embedding import HashingEmbeddings
+from paperplumber.parsing.options import EmbeddingBackend, Retrieval
+from paperplumber.parsing.pdf_parser import PageRange, PDFParser
+from paperplumber.parsing.pipeline import Failure, Pipeline, Stage
+from paperplumber.parsing.prefilter import PreFilter
+from paperplumber.parsing.response_cache import ResponseCache
+from paperplumber.parsing.settings import ParseSettings
+from paperplumber.tokens import estimate_tokens
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class ExtractionResult:
+    """
+    The outcome of the extraction of a set of papers.
+
+    Attributes:
+    values (Dict[str, Dict[str, List[str]]]): The values found, by paper and then by target.
+    errors (Dict[str, str]): The error message of every paper that could not be parsed.
+    stats (Dict[str, int]): Counters of the run, e.g. the response cache hits and misses.
+    stage_stats (Dict[str, Dict[str, float]]): The statistics of every stage of the pipelined engine, if used.
+    stopped (Optional[str]): Why the run stopped before parsing every paper, e.g. its token budget was used up.
+    skipped (List[str]): The papers left unparsed because the run stopped, to be parsed when it is resumed.
+    """
+
+    values: Dict[str, Dict[str, List[str]]] = field(default_factory=dict)
+    errors: Dict[str, str] = field(default_factory=dict)
+    stats: Dict[str, int] = field(default_factory=dict)
+    stage_stats: Dict[str, Dict[str, float]] = field(default_factory=dict)
+    stopped: Optional[str] = None
+    skipped: List[str] = field(default_factory=list)
+
+    def merge(self, other: "ExtractionResult") -> None:
+        """Adds the papers and counters of another result to this one."""
+        self.values.update(other.values)
+        self.errors.update(other.errors)
+        for name, count in other.stats.items():
+            self.stats[name] = self.stats.get(name, 0) + count
+        self.stage_stats.update(other.stage_stats)
+        self.stopped = self.stopped or other.stopped
+        self.skipped += other.skipped
+
+    def stop(self, error: BudgetExceeded, names: List[str]) -> None:
+        """Records that the run stopped on an error, leaving some papers unparsed."""
+        if self.stopped is None:
+            logger.warning("Stopping the parse: %s", error)
+            self.stopped = str(error)
+        self.skipped += names
+
+    def sorted(self) -> "ExtractionResult":
+        """Returns a copy of the result with the papers sorted by name."""
+        return ExtractionResult(
+            values=dict(sorted(self.values.items())),
+            errors=dict(sorted(self.errors.items())),
+            stats=dict(self.stats),
+            stage_stats=dict(self.stage_stats),
+            stopped=self.stopped,
+            skipped=sorted(self.skipped),
+        )
+
+
+# Called with the name and the values of every paper as soon as it is parsed
+ResultCallback = Callable[[str, Dict[str, List[str]]], None]
+
+
+def _record_values(
+    result: ExtractionResult,
+    name: str,
+    values: Dict[str, List[str]],
+    on_result: Optional[ResultCallback],
+) -> None:
+    if on_result is None:
+        result.values[name] = values
+    else:
+        on_result(name, values)
+
+
+def _record_error(result: ExtractionResult, name: str, error: Exception) -> None:
+    logger.error("Failed to parse %s: %s", name, error)
+    logger.debug(error, exc_info=True)
+    result.errors[name] = f"{type(error).__name__}: {error}"
+
+
+@dataclass
+class ExtractorCaches:
+    """
+    The caches of a PaperExtractor, all None if the caches are disabled.
+
+    Attributes:
+    pages (Optional[DiskCache]): The cache of the extracted pages.
+    embeddings (Optional[DiskCache]): The cache of the page embeddings.
+    responses (Optional[ResponseCache]): The cache of the language model responses.
+    """
+
+    pages: Optional[DiskCache] = None
+    embeddings: Optional[DiskCache] = None
+    responses: Optional[ResponseCache] = None
+
+
+@dataclass
+class CallCounts:
+    """
+    The language model calls of a PaperExtractor, added up across the threads scanning the papers.
+
+    Attributes:
+    sent (int): The prompts sent.
+    saved (int): The calls saved by the pre-filter.
+    skipped (Dict[str, int]): The calls skipped by the early stopping, by reason.
+    """
+
+    sent: int = 0
+    saved: int = 0
+    skipped: Dict[str, int] = field(
+        default_factory=lambda: {"early_stop": 0, "call_cap": 0}
+    )
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, scanner: FileScanner) -> None:
+        """Adds the calls of a scanner."""
+        with self._lock:
+            self.sent += scanner.calls
+            self.saved += scanner.saved_calls
+            for reason, count in scanner.skipped_calls.items():
+                self.skipped[reason] += count
+
+
+class PaperExtractor:
+    """
+    A class used to extract target values from groups of papers.
+
+    The pages of the papers of a group that are not embedded yet are embedded together,
+    then every paper is scanned for all the targets. A paper that fails is recorded in the
+    errors of the result instead of aborting the group, unless the token budget is used up,
+    which leaves the paper and the next ones unparsed.
+    """
+
+    def __init__(self, settings: ParseSettings):
+        self.settings = settings
+        self.caches = ExtractorCaches(
+            settings.cache.disk_cache("pages"),
+            settings.cache.disk_cache("embeddings"),
+            settings.cache.response_cache(),
+        )
+
+        self.prefilter = None
+        if settings.reading.prefilter_threshold is not None:
+            self.prefilter = PreFilter(settings.reading.prefilter_threshold)
+        self.counts = CallCounts()
+        self.chunker = settings.chunker()
+        self.budget = settings.budget.account()
+
+        # The lexical search does not need any embedding model
+        self.batch_embedder = None
+        if settings.search.embeds():
+            embedder = default_embedder(settings.search.embedding)
+            if self.budget is not None:
+                embedder = BudgetedEmbeddings(embedder, self.budget)
+            self.batch_embedder = BatchEmbedder(
+                embedder,
+                max_batch_tokens=settings.search.batch_tokens,
+                max_concurrency=settings.search.concurrency,
+            )
+
+    def _embed(
+        self, pdf_paths: Dict[str, str], pages: Optional[Dict[str, List]] = None
+    ) -> Tuple[Dict[str, EmbeddingSearcher], Dict[str, Exception]]:
+        """
+        Builds the searchers of a group of papers, embedding their pages together
+        unless the retrieval is lexical.
+
+        Returns the searchers and the errors, by paper name.
+        """
+        pages = pages or {}
+        searchers, errors = {}, {}
+        for name, pdf_path in pdf_paths.items():
+            try:
+                with instrumentation.paper(name):
+                    searchers[name] = self._searcher(pdf_path, pages.get(name))
+            except Exception as error:  # pylint: disable=broad-except
+                errors[name] = error
+
+        if self.batch_embedder is None:
+            return searchers, errors
+        try:
+            EmbeddingSearcher.embed_all(searchers.values(), self.batch_embedder)
+        except BudgetExceeded:
+            raise
+        except Exception as error:  # pylint: disable=broad-except
+            # Leave the papers of the failed batch to be embedded one by one
+            logger.warning("Batched embedding failed: %s", error)
+        return searchers, errors
+
+    def _searcher(self, pdf_path: str, pages: Optional[List] = None) -> PDFParser:
+        """Builds the searcher of a paper for the retrieval of the settings, without embedding its pages."""
+        if self.settings.search.retrieval == Retrieval.LEXICAL:
+            return LexicalSearcher(
+                pdf_path,
+                page_cache=self.caches.pages,
+                pages=pages,
+                chunker=self.chunker,
+                page_range=self.settings.chunking.page_range,
+            )
+        searcher_class = (
+            HybridSearcher
+            if self.settings.search.retrieval == Retrieval.HYBRID
+            else EmbeddingSearcher
+        )
+        return searcher_class(
+            pdf_path,
+            page_cache=self.caches.pages,
+            index_cache=self.caches.embeddings,
+            embedder=self.batch_embedder.embedder,
+            pages=pages,
+            chunker=self.chunker,
+            page_range=self.settings.chunking.page_range,
+        )
+
+    def extract_paper(
+        self,
+        pdf_path: str,
+        searcher: Optional[EmbeddingSearcher] = None,
+        pages_by_target: Optional[Dict[str, List]] = None,
+        pages: Optional[List] = None,
+    ) -> Dict[str, List[str]]:
+        """
+        Extracts the target values from a paper.
+
+        Args:
+            pdf_path (str): The path to the pdf of the paper.
+            searcher (Optional[EmbeddingSearcher]): The searcher used to select the pages of each target.
+            pages_by_target (Optional[Dict[str, List]]): The pages to read for each target, e.g. from the corpus index.
+            pages (Optional[List]): The pages of the paper, if they were already extracted.
+
+        Returns:
+            Dict[str, List[str]]: The values found, by target.
+        """
+        targets = self.settings.targets
+        if pages_by_target is None and searcher is not None:
+            selection = self.settings.search.selection
+            pages_by_target = {
+                target: selection.search(searcher, target) for target in targets
+            }
+
+        prefilter = self.prefilter
+        if prefilter is None and self.budget is not None and self.budget.prefilter_only():
+            prefilter = PreFilter()
+
+        if pages_by_target is not None:
+            scanner = FileScanner.from_pages(
+                [page for pages in pages_by_target.values() for page in pages]
+            )
+        elif pages is not None:
+            scanner = FileScanner.from_pages(pages)
+        else:
+            scanner = FileScanner(
+                pdf_path,
+                page_cache=self.caches.pages,
+                chunker=self.chunker,
+                page_range=self.settings.chunking.page_range,
+                lazy=self.settings.chunking.lazy_pages,
+            )
+        reading = self.settings.reading
+        values = scanner.scan_targets(
+            targets,
+            pages_by_target,
+            response_cache=self.caches.responses,
+            concurrency=reading.concurrency,
+            prefilter=prefilter,
+            pack_tokens=reading.pack_tokens,
+            early_stop=reading.early_stop(),
+            llm=reading.llm,
+            budget=self.budget,
+        )
+        self.counts.add(scanner)
+        return values
+
+    def extract_group(
+        self,
+        pdf_paths: Dict[str, str],
+        pages_by_paper: Optional[Dict[str, Dict[str, List]]] = None,
+        on_result: Optional[ResultCallback] = None,
+    ) -> ExtractionResult:
+        """
+        Extracts the target values from a group of papers.
+
+        Args:
+            pdf_paths (Dict[str, str]): The path to the pdf of every paper, by paper name.
+            pages_by_paper (Optional[Dict[str, Dict[str, List]]]): The pages to read for each target,
+                by paper name. If not given, the pages are selected by embedding search or not at all,
+                depending on the settings. The papers missing from it are read from their pdf.
+            on_result (Optional[ResultCallback]): If given, it is called with the values of every paper
+                as soon as it is parsed, and the values are not kept in the result.
+
+        Returns:
+            ExtractionResult: The values found and the errors of the group.
+        """
+        result = ExtractionResult()
+        counters = self.counters()
+        pending = list(pdf_paths)
+
+        try:
+            searchers = {}
+            if self.settings.search.enabled and pages_by_paper is None:
+                self.check_budget()
+                searchers, errors = self._embed(pdf_paths)
+                for name, error in errors.items():
+                    _record_error(result, name, error)
+                    pending.remove(name)
+
+            for name in list(pending):
+                self.check_budget()
+                try:
+                    with instrumentation.paper(name):
+                        values = self.extract_paper(
+                            pdf_paths[name],
+                            searchers.get(name),
+                            pages_by_paper.get(name) if pages_by_paper is not None else None,
+                        )
+                except BudgetExceeded:
+                    raise
+                except Exception as error:  # pylint: disable=broad-except
+                    _record_error(result, name, error)
+                else:
+                    _record_values(result, name, values, on_result)
+                pending.remove(name)
+        except BudgetExceeded as error:
+            result.stop(error, pending)
+
+        result.stats = self.counters(since=counters)
+        return result
+
+    def check_budget(self) -> None:
+        """Raises BudgetExceeded if the token budget is used up."""
+        if self.budget is not None:
+            self.budget.check()
+
+    def counters(self, since: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+        """
+        Returns the counters of the extractor so far: the hits and misses of the response cache,
+        the prompts sent, the language model calls saved by the pre-filter and skipped by the
+        early stopping, and the tokens charged to the budget if any, minus the given ones.
+        """
+        responses = self.caches.responses
+        counters = {
+            "llm_cache_hits": responses.hits if responses else 0,
+            "llm_cache_misses": responses.misses if responses else 0,
+            "llm_calls": self.counts.sent,
+            "prefilter_saved_calls": self.counts.saved,
+            "early_stop_skipped_calls": self.counts.skipped["early_stop"],
+            "call_cap_skipped_calls": self.counts.skipped["call_cap"],
+        }
+        if self.budget is not None:
+            counters.update(self.budget.totals)
+        if since is not None:
+            counters = {name: count - since[name] for name, count in counters.items()}
+        return counters
+
+    def load(self, job: "PaperJob") -> "PaperJob":
+        """The load stage of the pipelined engine: extracts the pages of a paper, unless they are selected already
+        or streamed by the scan stage."""
+        # Do not extract the papers that cannot be read anymore
+        self.check_budget()
+        if job.pages_by_target is None and not self.settings.streams_pages():
+            with instrumentation.paper(job.name):
+                job.pages = PDFParser(
+                    job.pdf_path,
+                    page_cache=self.caches.pages,
+                    chunker=self.chunker,
+                    page_range=self.settings.chunking.page_range,
+                ).pages
+        return job
+
+    def select_pages(self, jobs: List["PaperJob"]) -> List[Any]:
+        """
+        The embed stage of the pipelined engine: embeds the pages of a batch of papers together,
+        and selects the pages to read for each target.
+        """
+        pending = {job.name: job for job in jobs if job.pages_by_target is None}
+        if not self.settings.search.enabled or not pending:
+            return jobs
+
+        searchers, errors = self._embed(
+            {name: job.pdf_path for name, job in pending.items()},
+            {name: job.pages for name, job in pending.items()},
+        )
+        selection = self.settings.search.selection
+        results = []
+        for job in jobs:
+            if job.name in errors:
+                results.append(Failure(job, "embed", errors[job.name]))
+                continue
+            if job.name in searchers:
+                try:
+                    with instrumentation.paper(job.name):
+                        job.pages_by_target = {
+                            target: selection.search(searchers[job.name], target)
+                            for target in self.settings.targets
+                        }
+                except Exception as error:  # pylint: disable=broad-except
+                    results.append(Failure(job, "embed", error))
+                    continue
+            results.append(job)
+        return results
+
+    def scan(self, job: "PaperJob") -> "PaperJob":
+        """The scan stage of the pipelined engine: reads the selected pages of a paper with the language model."""
+        with instrumentation.paper(job.name):
+            job.values = self.extract_paper(
+                job.pdf_path, pages_by_target=job.pages_by_target, pages=job.pages
+            )
+        # Release the pages, the results may wait a while before being collected
+        job.pages = job.pages_by_target = None
+        return job
+
+
+@dataclass
+class PaperJob:
+    """
+    A paper going through the stages of the pipelined engine.
+
+    Attributes:
+    name (str): The name of the paper.
+    pdf_path (str): The path to the pdf of the paper.
+    pages (Optional[List]): The pages of the paper, once loaded.
+    pages_by_target (Optional[Dict[str, List]]): The pages to read for each target, once selected.
+    values (Optional[Dict[str, List[str]]]): The values found, by target, once scanned.
+    """
+
+    name: str
+    pdf_path: str
+    pages: Optional[List] = None
+    pages_by_target: Optional[Dict[str, List]] = None
+    values: Optional[Dict[str, List[str]]] = None
+
+
+# The extractor of a worker process, set up once by the pool initializer
+_WORKER_EXTRACTOR: Optional[PaperExtractor] = None
+
+
+def _init_worker(settings: ParseSettings) -> None:
+    global _WORKER_EXTRACTOR  # pylint: disable=global-statement
+    _WORKER_EXTRACTOR = PaperExtractor(settings)
+    if settings.instrument:
+        instrumentation.enable()
+
+
+def _extract_group_in_worker(
+    pdf_paths: Dict[str, str], pages_by_paper: Optional[Dict[str, Dict[str, List]]]
+) -> Tuple[ExtractionResult, Optional[Dict[str, Any]]]:
+    """Extracts a group of papers, and returns their timings and counters too if the worker is instrumented."""
+    result = _WORKER_EXTRACTOR.extract_group(pdf_paths, pages_by_paper)
+    if instrumentation.active() is None:
+        return result, None
+    # Start afresh for the next group, the parent process adds up the snapshots
+    snapshot = instrumentation.active().snapshot()
+    instrumentation.enable()
+    return result, snapshot
+
+
+# The page cache, chunker and page range of a loader process of the pipelined engine
+_LOADER_PAGE_CACHE: Optional[DiskCache] = None
+_LOADER_CHUNKER: Optional[TokenChunker] = None
+_LOADER_PAGE_RANGE: Optional[PageRange] = None
+
+
+def _init_loader(settings: ParseSettings) -> None:
+    # pylint: disable=global-statement
+    global _LOADER_PAGE_CACHE, _LOADER_CHUNKER, _LOADER_PAGE_RANGE
+    _LOADER_CHUNKER = settings.chunker()
+    _LOADER_PAGE_RANGE = settings.chunking.page_range
+    _LOADER_PAGE_CACHE = settings.cache.disk_cache("pages")
+
+
+def _load_pages_in_loader(pdf_path: str) -> List:
+    return PDFParser(
+        pdf_path,
+        page_cache=_LOADER_PAGE_CACHE,
+        chunker=_LOADER_CHUNKER,
+        page_range=_LOADER_PAGE_RANGE,
+    ).pages
+
+
+def _group(items: List[Any], size: int) -> List[List[Any]]:
+    return [items[first : first + size] for first in range(0, len(items), size)]
+
+
+def extract_papers(  # pylint: disable=too-many-branches
+    pdf_paths: Dict[str, str],
+    settings: ParseSettings,
+    *,
+    workers: int = 1,
+    group_size: int = 32,
+    pages_by_paper: Optional[Dict[str, Dict[str, List]]] = None,
+    on_result: Optional[ResultCallback] = None,
+) -> ExtractionResult:
+    """
+    Extracts the target values from many papers, spreading groups of papers across worker processes.
+
+    Args:
+        pdf_paths (Dict[str, str]): The path to the pdf of every paper, by paper name.
+        settings (ParseSettings): The settings of the run.
+        workers (int): The number of worker processes. With 1, the papers are parsed in this process.
+        group_size (int): The max number of papers whose pages are embedded together.
+        pages_by_paper (Optional[Dict[str, Dict[str, List]]]): The pages to read for each target, by paper name,
+            the papers missing from it are read from their pdf.
+        on_result (Optional[ResultCallback]): If given, it is called in this process with the values of every
+            paper as soon as it is parsed (or its group, with worker processes), and the values are not kept
+            in the result, so that the memory does not grow with the number of papers.
+
+    Returns:
+        ExtractionResult: The values found and the errors, with the papers sorted by name.
+    """
+    names = sorted(pdf_paths)
+    if workers > 1:
+        # Make sure that every worker gets some papers
+        group_size = max(1, min(group_size, math.ceil(len(names) / workers)))
+    groups = [
+        {name: pdf_paths[name] for name in group} for group in _group(names, group_size)
+    ]
+
+    def pages_of(group: Dict[str, str]):
+        if pages_by_paper is None:
+            return None
+        return {name: pages_by_paper.get(name) for name in group}
+
+    result = ExtractionResult()
+    if workers <= 1:
+        extractor = PaperExtractor(settings)
+        for number, group in enumerate(groups):
+            result.merge(extractor.extract_group(group, pages_of(group), on_result))
+            if result.stopped:
+                result.skipped += [name for rest in groups[number + 1 :] for name in rest]
+                break
+        return result.sorted()
+
+    # Every worker process accounts for its own share of the token budgets
+    worker_settings = replace(settings, budget=settings.budget.share(workers))
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(worker_settings,)
+    ) as executor:
+        futures = {
+            executor.submit(_extract_group_in_worker, group, pages_of(group)): group
+            for group in groups
+        }
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            try:
+                group_result, snapshot = future.result()
+            except Exception as error:  # pylint: disable=broad-except
+                # E.g. a BrokenProcessPool if a worker died
+                for name in futures[future]:
+                    _record_error(result, name, error)
+                continue
+            if snapshot is not None and instrumentation.active() is not None:
+                instrumentation.active().merge(snapshot)
+            if on_result is not None:
+                for name, values in group_result.values.items():
+                    on_result(name, values)
+                group_result.values = {}
+            result.merge(group_result)
+            if group_result.stopped:
+                # Leave the groups that have not started yet for the next run
+                for other, group in futures.items():
+                    if other.cancel():
+                        result.skipped += list(group)
+    return result.sorted()
+
+
+def extract_papers_pipelined(
+    pdf_paths: Dict[str, str],
+    settings: ParseSettings,
+    *,
+    load_workers: int = 1,
+    embed_workers: int = 1,
+    scan_workers: int = 4,
+    queue_size: int = 8,
+    group_size: int = 32,
+    pages_by_paper: Optional[Dict[str, Dict[str, List]]] = None,
+    on_result: Optional[ResultCallback] = None,
+) -> ExtractionResult:
+    """
+    Extracts the target values from many papers with a pipeline whose stages overlap.
+
+    The papers go through three stages connected by bounded queues: ``load`` extracts the
+    pages of the pdfs, ``embed`` embeds the pages of the papers waiting in its queue together
+    and selects the pages of each target, and ``scan`` reads them with the language model.
+    While a paper waits for the language model, the next ones are already being extracted
+    and embedded, and a slow stage blocks the ones before it instead of piling up pages.
+
+    Args:
+        pdf_paths (Dict[str, str]): The path to the pdf of every paper, by paper name.
+        settings (ParseSettings): The settings of the run.
+        load_workers (int): The number of pdfs extracted at the same time. With more than one,
+            they are extracted by a pool of processes, since pdfium cannot be used by several threads.
+        embed_workers (int): The number of batches of papers embedded at the same time.
+        scan_workers (int): The number of papers read by the language model at the same time.
+        queue_size (int): The max number of papers waiting between two stages.
+        group_size (int): The max number of papers whose pages are embedded together.
+        pages_by_paper (Optional[Dict[str, Dict[str, List]]]): The pages to read for each target, by paper name,
+            the papers missing from it are read from their pdf.
+        on_result (Optional[ResultCallback]): If given, it is called in this thread with the values of every
+            paper as soon as it is parsed, and the values are not kept in the result.
+
+    Returns:
+        ExtractionResult: The values found and the errors, with the papers sorted by name,
+            and the statistics of every stage.
+    """
+    extractor = PaperExtractor(settings)
+    counters = extractor.counters()
+
+    executor = None
+    load = extractor.load
+    if load_workers > 1:
+        executor = ProcessPoolExecutor(
+            max_workers=load_workers, initializer=_init_loader, initargs=(settings,)
+        )
+        # Start the processes before the threads of the pipeline, forking with running threads is unsafe
+        executor.submit(os.getpid).result()
+
+        def load_in_process(job: PaperJob) -> PaperJob:
+            extractor.check_budget()
+            if job.pages_by_target is None and not settings.streams_pages():
+                # The loader processes are not instrumented, the extraction is timed from here
+                with instrumentation.paper(job.name), instrumentation.timed("extract"):
+                    job.pages = executor.submit(
+                        _load_pages_in_loader, job.pdf_path
+                    ).result()
+            return job
+
+        load = load_in_process
+
+    pipeline = Pipeline(
+        [
+            Stage("load", load, workers=load_workers),
+            Stage(
+                "embed",
+                extractor.select_pages,
+                workers=embed_workers,
+                batch_size=group_size,
+            ),
+            Stage("scan", extractor.scan, workers=scan_workers),
+        ],
+        queue_size=queue_size,
+    )
+    jobs = (
+        PaperJob(
+            name,
+            pdf_paths[name],
+            pages_by_target=(
+                pages_by_paper.get(name) if pages_by_paper is not None else None
+            ),
+        )
+        for name in sorted(pdf_paths)
+    )
+
+    result = ExtractionResult()
+    try:
+        for job in pipeline.run(jobs):
+            if isinstance(job, Failure) and isinstance(job.error, BudgetExceeded):
+                result.stop(job.error, [job.item.name])
+            elif isinstance(job, Failure):
+                _record_error(result, job.item.name, job.error)
+            else:
+                _record_values(result, job.name, job.values, on_result)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    result.stats = extractor.counters(since=counters)
+    result.stage_stats = pipeline.stats()
+    return result.sorted()
+
+
+def _estimated_jobs(
+    pages: List, settings: ParseSettings, pages_by_target: Optional[Dict[str, List]]
+) -> List[Tuple[str, List[str]]]:
+    """Returns the texts a paper would be read for and their targets, at most the cap of prompts."""
+    targets = settings.targets
+    if pages_by_target is None and settings.search.enabled:
+        # Without searching, assume the longest pages are the ones selected
+        longest = sorted(pages, key=lambda page: len(page.page_content), reverse=True)
+        max_pages = settings.search.selection.max_k
+        pages_by_target = {target: longest[:max_pages] for target in targets}
+    elif pages_by_target is None:
+        pages_by_target = {target: pages for target in targets}
+
+    if settings.reading.prefilter_threshold is not None:
+        prefilter = PreFilter(settings.reading.prefilter_threshold)
+        pages_by_target = {
+            target: prefilter.filter(pages_by_target.get(target, []), target)
+            for target in targets
+        }
+
+    targets_by_text: Dict[str, List[str]] = {}
+    for target in targets:
+        for page in pages_by_target.get(target, []):
+            page_targets = targets_by_text.setdefault(page.page_content, [])
+            if target not in page_targets:
+                page_targets.append(target)
+    return list(targets_by_text.items())[: settings.reading.max_calls]
+
+
+def _embedding_token_counter(embedding: EmbeddingBackend) -> Callable[[str], int]:
+    """Returns the function counting the tokens of a text for an embedding model."""
+    if EmbeddingBackend(embedding) == EmbeddingBackend.HASHING:
+        return HashingEmbeddings.count_tokens
+    return lambda text: estimate_tokens(text, OPENAI_EMBEDDING_MODEL)
+
+
+def estimate_embedding(pdf_paths: Dict[str, str], settings: ParseSettings) -> CostEstimate:
+    """
+    Estimates the tokens of embedding the pages of many papers and the targets once, as the corpus index
+    does, without sending any request.
+
+    Args:
+        pdf_paths (Dict[str, str]): The path to the pdf of every paper to embed, by paper name.
+        settings (ParseSettings): The settings of the run.
+
+    Returns:
+        CostEstimate: The estimated embedding tokens, without any paper or prompt.
+    """
+    page_cache = settings.cache.disk_cache("pages")
+    embedding_tokens = _embedding_token_counter(settings.search.embedding)
+
+    texts = list(settings.targets)
+    for name in sorted(pdf_paths):
+        try:
+            pages = PDFParser(
+                pdf_paths[name],
+                page_cache=page_cache,
+                chunker=settings.chunker(),
+                page_range=settings.chunking.page_range,
+            ).pages
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning("Could not estimate the cost of %s: %s", name, error)
+            continue
+        texts += [page.page_content for page in pages]
+    return CostEstimate(embedding_tokens=sum(map(embedding_tokens, texts)))
+
+
+def estimate_papers(
+    pdf_paths: Dict[str, str],
+    settings: ParseSettings,
+    pages_by_paper: Optional[Dict[str, Dict[str, List]]] = None,
+) -> CostEstimate:
+    """
+    Estimates the tokens sent to the models to extract the target values from many papers, without
+    sending any request.
+
+    The pages of the pdfs are extracted, or loaded from the page cache, and the prompts of every page are
+    counted as if no response was cached, with one prompt per page and the early stopping ignored except
+    for the cap of prompts per paper. With the embedding search, every page and target is counted as
+    embedded, and the longest pages as the ones read for every target, unless pages_by_paper is given, as
+    the corpus index embeds the pages instead (see estimate_embedding).
+
+    Args:
+        pdf_paths (Dict[str, str]): The path to the pdf of every paper, by paper name.
+        settings (ParseSettings): The settings of the run.
+        pages_by_paper (Optional[Dict[str, Dict[str, List]]]): The pages to read for each target, by paper name.
+
+    Returns:
+        CostEstimate: The estimated prompts and tokens.
+    """
+    page_cache = settings.cache.disk_cache("pages")
+    chunker = settings.chunker()
+    embeds = settings.search.embeds() and pages_by_paper is None
+    embedding_tokens = _embedding_token_counter(settings.search.embedding)
+    model_name = settings.reading.llm.model_name
+
+    estimate = CostEstimate()
+    for name in sorted(pdf_paths):
+        try:
+            pages = PDFParser(
+                pdf_paths[name],
+                page_cache=page_cache,
+                chunker=chunker,
+                page_range=settings.chunking.page_range,
+            ).pages
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning("Could not estimate the cost of %s: %s", name, error)
+            continue
+        estimate.papers += 1
+
+        if embeds:
+            estimate.embedding_tokens += sum(
+                embedding_tokens(text)
+                for text in [page.page_content for page in pages] + settings.targets
+            )
+
+        paper_pages = pages_by_paper.get(name) if pages_by_paper is not None else None
+        for text, page_targets in _estimated_jobs(pages, settings, paper_pages):
+            if len(page_targets) == 1:
+                prompt = OpenAIReader.PROMPT_TEMPLATE.format(
+                    target=page_targets[0], text=text
+                )
+            else:
+                prompt = OpenAIReader.MULTI_TARGET_PROMPT_TEMPLATE.format(
+                    targets=json.dumps(page_targets), text=text
+                )
+            estimate.prompts += 1
+            estimate.prompt_tokens += estimate_tokens(prompt, model_name)
+            estimate.completion_tokens += OpenAIReader.ANSWER_TOKENS_PER_VALUE * len(
+                page_targets
+            )
+    return estimate
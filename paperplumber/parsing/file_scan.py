@@ -1,18 +1,89 @@
 """This module implements the embedding search of a pdf file"""
-from typing import List
+import asyncio
+import itertools
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from paperplumber.cache import DiskCache
 from paperplumber.logger import get_logger
+from paperplumber.parsing.bm25 import BM25Index
+from paperplumber.parsing.budget import BudgetExceeded, TokenBudget
+from paperplumber.parsing.chunking import TokenChunker
+from paperplumber.parsing.llm_backend import LLMSettings
 from paperplumber.parsing.llmreader import OpenAIReader
-from paperplumber.parsing.pdf_parser import PDFParser
+from paperplumber.parsing.pdf_parser import PageRange, PDFParser
+from paperplumber.parsing.prefilter import PreFilter
+from paperplumber.parsing.response_cache import ResponseCache
 
 logger = get_logger(__name__)
 
 
+@dataclass
+class EarlyStop:
+    """When to stop reading the pages of a paper.
+
+    Attributes:
+        consistent_values (Optional[int]): The number of times the same value must be found for a
+            target before its remaining pages are skipped, or None to read them all.
+        max_calls (Optional[int]): The max number of prompts sent for the paper, or None for no cap.
+    """
+
+    consistent_values: Optional[int] = None
+    max_calls: Optional[int] = None
+
+    def is_done(self, counts: Counter) -> bool:
+        """Returns whether a target whose values were found as many times as counted is done."""
+        return (
+            self.consistent_values is not None
+            and bool(counts)
+            and counts.most_common(1)[0][1] >= self.consistent_values
+        )
+
+
 class FileScanner(PDFParser):
     """A class used to scan a PDF file for data using
-    the OpenAIReader functionality."""
+    the OpenAIReader functionality.
+
+    The pages can be read one after the other, or concurrently with asyncio up to a
+    given number of pages at a time. In the concurrent mode, a page whose reading fails
+    is recorded in ``failures`` with its page number and skipped, instead of aborting the whole scan.
+
+    If a PreFilter is given, the pages it scores below its threshold for a target are not
+    read for that target, and the number of pages left unread is added to ``saved_calls``.
+
+    If a max number of prompt tokens is given, the pages to read for the same targets are packed
+    into as few prompts as fit in it, each answered with the values of every page.
+
+    If an EarlyStop is given, the pages are read best first, in waves of ``concurrency`` prompts,
+    and a target is not read any more once the same value was found for it often enough, nor any
+    target once the paper used up its prompts. The prompts sent are counted in ``calls``, including
+    the ones sent again after an answer that could not be parsed, and the ones skipped in
+    ``skipped_calls``, by reason.
+
+    In lazy mode, a scan of every page of the document streams through the pdf, extracting and
+    reading ``concurrency`` pages at a time, unless the pages are ranked or packed first."""
+
+    def __init__(
+        self,
+        pdf_path: str,
+        *,
+        page_cache: Optional[DiskCache] = None,
+        chunker: Optional[TokenChunker] = None,
+        page_range: Optional[PageRange] = None,
+        lazy: bool = False,
+    ):
+        super().__init__(
+            pdf_path, page_cache=page_cache, chunker=chunker, page_range=page_range, lazy=lazy
+        )
+        self._init_counters()
 
-    def __init__(self, pdf_path: str):
-        super(PDFParser, self).__init__(pdf_path)
+    def _init_counters(self) -> None:
+        """Sets up the failures and the counters of the scans, before the first one."""
+        self.failures: List[Tuple[int, Exception]] = []
+        self.saved_calls = 0
+        self.calls = 0
+        self.skipped_calls = {"early_stop": 0, "call_cap": 0}
+        self._page_numbers: Dict[str, Optional[int]] = {}
 
     @classmethod
     def from_pages(cls, pages: List):
@@ -26,9 +97,20 @@ class FileScanner(PDFParser):
 
         scanner = cls.__new__(cls)
         scanner._pages = pages
+        scanner._init_counters()
         return scanner
 
-    def scan(self, target: str) -> List[str]:
+    def scan(
+        self,
+        target: str,
+        *,
+        response_cache: Optional[ResponseCache] = None,
+        concurrency: Optional[int] = None,
+        prefilter: Optional[PreFilter] = None,
+        pack_tokens: Optional[int] = None,
+        early_stop: Optional[EarlyStop] = None,
+        llm: Optional[LLMSettings] = None,
+    ) -> List[str]:
         """Scans the pages of a document for a specified target using the OpenAIReader.
 
         This function scans each page of the document and retrieves values related to
@@ -37,6 +119,14 @@ class FileScanner(PDFParser):
 
         Args:
             target (str): The target to be scanned within the document pages.
+            response_cache (Optional[ResponseCache]): The cache of model responses, if any.
+            concurrency (Optional[int]): The number of pages read at the same time. If not
+                    given, the pages are read one after the other.
+            prefilter (Optional[PreFilter]): The filter of the pages worth reading, if any.
+            pack_tokens (Optional[int]): The max number of tokens of a prompt packing several pages,
+                    or None to read every page with its own prompt.
+            early_stop (Optional[EarlyStop]): When to stop reading the pages, if before the last one.
+            llm (Optional[LLMSettings]): The language model reading the pages, the OpenAI one by default.
 
         Returns:
             List[str]: A list of unique values found for the target in the document pages,
@@ -45,14 +135,357 @@ class FileScanner(PDFParser):
         Raises:
             Warning: If more than one unique value is found for the target."""
 
-        reader = OpenAIReader(target)
-        values = [reader.read(page.page_content) for page in self._pages]
+        return self.scan_targets(
+            [target],
+            response_cache=response_cache,
+            concurrency=concurrency,
+            prefilter=prefilter,
+            pack_tokens=pack_tokens,
+            early_stop=early_stop,
+            llm=llm,
+        )[target]
+
+    def scan_targets(
+        self,
+        targets: List[str],
+        pages_by_target: Optional[Dict[str, List]] = None,
+        *,
+        response_cache: Optional[ResponseCache] = None,
+        concurrency: Optional[int] = None,
+        prefilter: Optional[PreFilter] = None,
+        pack_tokens: Optional[int] = None,
+        early_stop: Optional[EarlyStop] = None,
+        llm: Optional[LLMSettings] = None,
+        budget: Optional[TokenBudget] = None,
+    ) -> Dict[str, List[str]]:
+        """Scans the pages of a document for several targets using the OpenAIReader.
+
+        Every page is read once: a page to be scanned for a single target is read with
+        the single-target prompt, and a page to be scanned for several targets is read
+        with a single prompt asking for all of them.
+
+        Args:
+            targets (List[str]): The targets to be scanned within the document pages.
+            pages_by_target (Optional[Dict[str, List]]): The pages to scan for each target, best first.
+                If not given, every page of the document is scanned for every target, ranked by
+                their BM25 score for the target with early stopping, or streamed from the pdf in lazy mode.
+            response_cache (Optional[ResponseCache]): The cache of model responses, if any.
+            concurrency (Optional[int]): The number of pages read at the same time. If not
+                    given, the pages are read one after the other.
+            prefilter (Optional[PreFilter]): The filter of the pages worth reading, if any.
+            pack_tokens (Optional[int]): The max number of tokens of a prompt packing several pages,
+                    or None to read every page with its own prompt.
+            early_stop (Optional[EarlyStop]): When to stop reading the pages, if before the last one.
+            llm (Optional[LLMSettings]): The language model reading the pages, the OpenAI one by default.
+            budget (Optional[TokenBudget]): The token budget every prompt is charged to, if any. A prompt over
+                its hard budget raises BudgetExceeded, even when the pages are read concurrently.
+
+        Returns:
+            Dict[str, List[str]]: The unique values found for each target in the document
+                    pages, excluding 'NA'."""
+
+        readers = {
+            target: OpenAIReader(target, response_cache, llm, budget)
+            for target in targets
+        }
+        if (
+            self._page_list is None
+            and pages_by_target is None
+            and pack_tokens is None
+            and early_stop is None
+        ):
+            answers = self._read_waves(
+                readers, self._stream_jobs(targets, prefilter), concurrency
+            )
+        else:
+            jobs = self._select_jobs(
+                readers,
+                targets,
+                pages_by_target,
+                prefilter=prefilter,
+                pack_tokens=pack_tokens,
+                early_stop=early_stop,
+            )
+            answers = self._read_jobs(readers, jobs, concurrency, early_stop)
+
+        values: Dict[str, List[str]] = {target: [] for target in targets}
+        for job_answers in answers:
+            for page_answers in job_answers:
+                for target, value in page_answers.items():
+                    values[target].append(value)
+
+        return {
+            target: self._clean_values(target, target_values)
+            for target, target_values in values.items()
+        }
+
+    def _select_jobs(
+        self,
+        readers: Dict[str, OpenAIReader],
+        targets: List[str],
+        pages_by_target: Optional[Dict[str, List]],
+        *,
+        prefilter: Optional[PreFilter],
+        pack_tokens: Optional[int],
+        early_stop: Optional[EarlyStop],
+    ) -> List[Tuple[List[str], List[str]]]:
+        """Returns the pages to read and their targets, grouped by page and packed if asked."""
+        if pages_by_target is None and early_stop is not None:
+            pages_by_target = self._rank_pages(targets)
+        elif pages_by_target is None:
+            pages_by_target = {target: self._pages for target in targets}
+
+        if prefilter is not None:
+            candidates = {
+                page.page_content
+                for target in targets
+                for page in pages_by_target.get(target, [])
+            }
+            pages_by_target = {
+                target: prefilter.filter(pages_by_target.get(target, []), target)
+                for target in targets
+            }
+
+        self._remember_pages(
+            page for target in targets for page in pages_by_target.get(target, [])
+        )
+        targets_by_text = self._group_targets(
+            targets, pages_by_target, best_first=early_stop is not None
+        )
+        if prefilter is not None:
+            self.saved_calls += len(candidates) - len(targets_by_text)
+
+        jobs = [([text], page_targets) for text, page_targets in targets_by_text.items()]
+        if pack_tokens is not None:
+            jobs = self._pack_jobs(readers, targets_by_text, pack_tokens)
+        return jobs
+
+    def _stream_jobs(
+        self, targets: List[str], prefilter: Optional[PreFilter]
+    ) -> Iterator[Tuple[List[str], List[str]]]:
+        """Yields every page of the document and its targets as it is extracted, skipping the
+        pages the prefilter finds not worth reading for any target."""
+        for page in self.iter_pages():
+            page_targets = [
+                target
+                for target in targets
+                if prefilter is None or prefilter.filter([page], target)
+            ]
+            if page_targets:
+                self._remember_pages([page])
+                yield [page.page_content], page_targets
+            else:
+                self.saved_calls += 1
+
+    def _read_waves(
+        self,
+        readers: Dict[str, OpenAIReader],
+        jobs: Iterable[Tuple[List[str], List[str]]],
+        concurrency: Optional[int],
+    ) -> List[List[Dict[str, str]]]:
+        """Reads a stream of pages in waves of ``concurrency`` pages, so that no more pages
+        than that are held at a time."""
+        jobs = iter(jobs)
+        answers: List[List[Dict[str, str]]] = []
+        while True:
+            wave = list(itertools.islice(jobs, concurrency or 1))
+            if not wave:
+                return answers
+            self.calls += len(wave)
+            if concurrency is None:
+                answers += [self._read_page(readers, *job) for job in wave]
+            else:
+                answers += asyncio.run(self._aread_pages(readers, wave, concurrency))
+            self._count_retries(readers)
+            # The pages of the stream are not kept once read
+            self._page_numbers.clear()
+
+    @staticmethod
+    def _group_targets(
+        targets: List[str], pages_by_target: Dict[str, List], best_first: bool
+    ) -> Dict[str, List[str]]:
+        """Groups the targets of every distinct page, in the order of the pages of the targets,
+        or by the best rank of the pages for any target."""
+        targets_by_text: Dict[str, List[str]] = {}
+        ranks: Dict[str, int] = {}
+        for target in targets:
+            for rank, page in enumerate(pages_by_target.get(target, [])):
+                page_targets = targets_by_text.setdefault(page.page_content, [])
+                if target not in page_targets:
+                    page_targets.append(target)
+                ranks[page.page_content] = min(rank, ranks.get(page.page_content, rank))
+
+        if best_first:
+            return dict(sorted(targets_by_text.items(), key=lambda item: ranks[item[0]]))
+        return targets_by_text
+
+    def _read_jobs(
+        self,
+        readers: Dict[str, OpenAIReader],
+        jobs: List[Tuple[List[str], List[str]]],
+        concurrency: Optional[int],
+        early_stop: Optional[EarlyStop],
+    ) -> List[List[Dict[str, str]]]:
+        """Reads the pages of every job, one after the other or concurrently, until done if early stopping."""
+        if early_stop is not None:
+            return self._read_until_done(readers, jobs, concurrency, early_stop)
+
+        self.calls += len(jobs)
+        if concurrency is None:
+            answers = [self._read_page(readers, *job) for job in jobs]
+        else:
+            answers = asyncio.run(self._aread_pages(readers, jobs, concurrency))
+        self._count_retries(readers)
+        return answers
+
+    def _rank_pages(self, targets: List[str]) -> Dict[str, List]:
+        """Returns the pages of the document for every target, the ones with the best BM25 score first."""
+        bm25 = BM25Index()
+        bm25.add(self._pages)
+        pages_by_target = {}
+        for target in targets:
+            ranked = bm25.search(target, k=None)
+            matched = {id(page) for page in ranked}
+            pages_by_target[target] = ranked + [
+                page for page in self._pages if id(page) not in matched
+            ]
+        return pages_by_target
+
+    def _read_until_done(
+        self,
+        readers: Dict[str, OpenAIReader],
+        jobs: List[Tuple[List[str], List[str]]],
+        concurrency: Optional[int],
+        early_stop: EarlyStop,
+    ) -> List[List[Dict[str, str]]]:
+        """Reads the pages in waves, until every target is done or the prompts are used up."""
+        counts: Dict[str, Counter] = {}
+        done: Set[str] = set()
+        answers: List[List[Dict[str, str]]] = []
+        jobs = list(jobs)
+        while jobs:
+            wave = []
+            while jobs and len(wave) < (concurrency or 1):
+                texts, page_targets = jobs.pop(0)
+                page_targets = [target for target in page_targets if target not in done]
+                if not page_targets:
+                    self.skipped_calls["early_stop"] += 1
+                elif early_stop.max_calls is not None and self.calls >= early_stop.max_calls:
+                    self.skipped_calls["call_cap"] += 1
+                else:
+                    self.calls += 1
+                    wave.append((texts, page_targets))
+
+            if concurrency is None:
+                results = [self._read_page(readers, *job) for job in wave]
+            else:
+                results = asyncio.run(self._aread_pages(readers, wave, concurrency))
+            self._count_retries(readers)
+            for job_answers in results:
+                answers.append(job_answers)
+                for page_answers in job_answers:
+                    for target, value in page_answers.items():
+                        if value != "NA":
+                            counts.setdefault(target, Counter())[value] += 1
+            done.update(
+                target for target, count in counts.items() if early_stop.is_done(count)
+            )
+        return answers
+
+    @staticmethod
+    def _pack_jobs(
+        readers: Dict[str, OpenAIReader],
+        targets_by_text: Dict[str, List[str]],
+        pack_tokens: int,
+    ) -> List[Tuple[List[str], List[str]]]:
+        """Packs the pages to read for the same targets into groups fitting in a prompt."""
+        texts_by_targets: Dict[Tuple[str, ...], List[str]] = {}
+        for text, page_targets in targets_by_text.items():
+            texts_by_targets.setdefault(tuple(page_targets), []).append(text)
+
+        jobs = []
+        for page_targets, texts in texts_by_targets.items():
+            reader = readers[page_targets[0]]
+            for group in reader.pack(texts, list(page_targets), pack_tokens):
+                jobs.append((group, list(page_targets)))
+        return jobs
+
+    @staticmethod
+    def _read_page(
+        readers: Dict[str, OpenAIReader], texts: List[str], page_targets: List[str]
+    ) -> List[Dict[str, str]]:
+        """Reads pages for their targets, with a single prompt if there are several pages or targets."""
+        if len(texts) > 1:
+            return readers[page_targets[0]].read_packed(texts, page_targets)
+        if len(page_targets) == 1:
+            return [{page_targets[0]: readers[page_targets[0]].read(texts[0])}]
+        return [readers[page_targets[0]].read_targets(texts[0], page_targets)]
+
+    async def _aread_pages(
+        self,
+        readers: Dict[str, OpenAIReader],
+        jobs: List[Tuple[List[str], List[str]]],
+        concurrency: int,
+    ) -> List[List[Dict[str, str]]]:
+        """Reads pages concurrently, keeping their order and recording their failures."""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def read_page(
+            texts: List[str], page_targets: List[str]
+        ) -> List[Dict[str, str]]:
+            reader = readers[page_targets[0]]
+            async with semaphore:
+                if len(texts) > 1:
+                    return await reader.aread_packed(texts, page_targets)
+                if len(page_targets) == 1:
+                    return [{page_targets[0]: await reader.aread(texts[0])}]
+                return [await reader.aread_targets(texts[0], page_targets)]
+
+        results = await asyncio.gather(
+            *(read_page(*job) for job in jobs), return_exceptions=True
+        )
+
+        answers = []
+        for (texts, _), result in zip(jobs, results):
+            if isinstance(result, BudgetExceeded):
+                raise result
+            if isinstance(result, Exception):
+                numbers = [self._page_numbers.get(text) for text in texts]
+                logger.warning(
+                    "Failed to read page %s: %s", ", ".join(map(str, numbers)), result
+                )
+                self.failures += [(number, result) for number in numbers]
+            else:
+                answers.append(result)
+        return answers
+
+    def _remember_pages(self, pages: Iterable) -> None:
+        """Remembers the number of the pages to read by their text, to report their failures. The
+        number is the one of the page metadata, or else the position of the page in the document."""
+        positions = None
+        for page in pages:
+            number = page.metadata.get("page")
+            if number is None:
+                if positions is None:
+                    positions = {id(other): i for i, other in enumerate(self._pages)}
+                number = positions.get(id(page))
+            self._page_numbers.setdefault(page.page_content, number)
+
+    def _count_retries(self, readers: Dict[str, OpenAIReader]) -> None:
+        """Adds the prompts the readers sent again, after answers that could not be parsed, to ``calls``."""
+        for reader in readers.values():
+            self.calls += reader.retries
+            reader.retries = 0
+
+    @staticmethod
+    def _clean_values(target: str, values: List[str]) -> List[str]:
+        """Removes the NAs and duplicates from the values found for a target."""
 
-        # Remove NAs
-        clean_values = {value for value in values if value != "NA"}
+        # Remove NAs, keeping the order in which the values were found
+        clean_values = list(dict.fromkeys(value for value in values if value != "NA"))
 
         # Warn if multiple values are found
         if len(clean_values) > 1:
-            logger.warning("Found multiple values for % as the target.", target)
+            logger.warning("Found multiple values for %s as the target.", target)
 
-        return list(clean_values)
+        return clean_values
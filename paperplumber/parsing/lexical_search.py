@@ -0,0 +1,149 @@
+"""This module implements the lexical and hybrid searches of a pdf file"""
+from typing import List, Optional, Tuple
+
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+
+from paperplumber.cache import DiskCache
+from paperplumber.logger import get_logger
+from paperplumber.parsing.bm25 import BM25Index, reciprocal_rank_scores
+from paperplumber.parsing.chunking import TokenChunker
+from paperplumber.parsing.embedding_search import EmbeddingSearcher
+from paperplumber.parsing.pdf_parser import PageRange, PDFParser
+
+logger = get_logger(__name__)
+
+
+class LexicalSearcher(PDFParser):
+    """
+    A class used to search the pages of a PDF document with a BM25 index of their words.
+
+    The index is built locally from the pages, so no embedding model, and no network access,
+    is needed. The pages are matched on the exact words of the question, so symbols and
+    abbreviations such as ``T2`` or ``k_f`` are found, but not their synonyms.
+
+    Attributes:
+    _bm25 (BM25Index): The index of the pages.
+    """
+
+    needs_embedding = False
+
+    def __init__(
+        self,
+        pdf_path: str,
+        *,
+        page_cache: Optional[DiskCache] = None,
+        pages: Optional[List[Document]] = None,
+        chunker: Optional[TokenChunker] = None,
+        page_range: Optional[PageRange] = None,
+    ):
+        super().__init__(
+            pdf_path,
+            pages=pages,
+            page_cache=page_cache,
+            chunker=chunker,
+            page_range=page_range,
+        )
+        self._bm25 = BM25Index()
+        self._bm25.add(self._pages)
+
+    def similarity_search(self, question: str, k: int = 2) -> List[Document]:
+        """
+        Returns the top k pages for a question, best first.
+
+        Args:
+            question (str): The question for which to find pages.
+            k (int): The number of pages to find. Default is 2.
+
+        Returns:
+            List[Document]: The top k pages holding words of the question, which can be fewer than k.
+        """
+        return self._bm25.search(question, k=k)
+
+    def similarity_search_with_score(
+        self, question: str, k: int = 2
+    ) -> List[Tuple[Document, float]]:
+        """
+        Returns the top k pages for a question and their BM25 scores, best first.
+
+        Args:
+            question (str): The question for which to find pages.
+            k (int): The number of pages to find. Default is 2.
+
+        Returns:
+            List[Tuple[Document, float]]: The top k pages holding words of the question and their scores.
+        """
+        return self._bm25.search_with_scores(question, k=k)
+
+
+class HybridSearcher(EmbeddingSearcher):
+    """
+    A class used to search the pages of a PDF document with both the embedding and the BM25
+    indexes, fusing their rankings with reciprocal rank fusion.
+
+    The pages similar in meaning to the question and the pages holding its exact words are
+    both ranked first. The page embeddings are computed, cached and batched as for an
+    EmbeddingSearcher.
+
+    Attributes:
+    fetch_k (int): The min number of pages ranked by each index before the fusion.
+    _bm25 (BM25Index): The index of the pages.
+    """
+
+    fetch_k = 8
+
+    def __init__(
+        self,
+        pdf_path: str,
+        *,
+        page_cache: Optional[DiskCache] = None,
+        index_cache: Optional[DiskCache] = None,
+        embedder: Optional[Embeddings] = None,
+        pages: Optional[List[Document]] = None,
+        chunker: Optional[TokenChunker] = None,
+        page_range: Optional[PageRange] = None,
+    ):
+        super().__init__(
+            pdf_path,
+            page_cache=page_cache,
+            index_cache=index_cache,
+            embedder=embedder,
+            pages=pages,
+            chunker=chunker,
+            page_range=page_range,
+        )
+        self._bm25 = BM25Index()
+        self._bm25.add(self._pages)
+
+    def similarity_search(self, question: str, k: int = 2) -> List[Document]:
+        """
+        Returns the top k pages for a question, best first.
+
+        Args:
+            question (str): The question for which to find pages.
+            k (int): The number of pages to find. Default is 2.
+
+        Returns:
+            List[Document]: The top k pages of the fused rankings.
+        """
+        return [doc for doc, _ in self.similarity_search_with_score(question, k=k)]
+
+    def similarity_search_with_score(
+        self, question: str, k: int = 2
+    ) -> List[Tuple[Document, float]]:
+        """
+        Returns the top k pages for a question and their fused scores, best first.
+
+        Args:
+            question (str): The question for which to find pages.
+            k (int): The number of pages to find. Default is 2.
+
+        Returns:
+            List[Tuple[Document, float]]: The top k pages of the fused rankings and their scores.
+        """
+        fetch_k = max(self.fetch_k, 4 * k)
+        rankings = [
+            super().similarity_search(question, k=fetch_k),
+            self._bm25.search(question, k=fetch_k),
+        ]
+        return reciprocal_rank_scores(rankings)[:k]
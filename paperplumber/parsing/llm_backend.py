@@ -0,0 +1,140 @@
+"""This module implements the choice of the language model, and a deterministic local stand-in for it"""
+import asyncio
+import json
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, List, Optional
+
+from langchain.llms.base import LLM
+
+from paperplumber.logger import get_logger
+from paperplumber.parsing.options import DEFAULT_MODEL_NAME, LLMBackend
+from paperplumber.parsing.prefilter import NUMBER_WITH_UNIT_PATTERN
+
+logger = get_logger(__name__)
+
+# The lines of a prompt of the OpenAIReader giving the targets, and numbering the packed chunks
+_TARGETS_LINE = re.compile(r"^ {4}(Targets?): (.*)$", re.MULTILINE)
+_CHUNK_LINE = re.compile(r"^ {4}Chunk (\d+): ", re.MULTILINE)
+
+
+@dataclass(frozen=True)
+class LLMSettings:
+    """
+    The language model reading the pages, and its generation parameters.
+
+    Attributes:
+    backend (LLMBackend): The kind of language model.
+    model_name (str): The name of the model.
+    base_url (Optional[str]): The base URL of the API of an openai-compatible server.
+    temperature (Optional[float]): The sampling temperature, or None for the default of the model.
+    max_tokens (Optional[int]): The max number of tokens of an answer, or None for the default of the model.
+    fake_latency (float): The seconds the fake model takes to answer a prompt.
+    fake_answer (Optional[str]): The answer of the fake model for every target, or None to answer with the
+        first number with a unit of the text.
+    """
+
+    backend: LLMBackend = LLMBackend.OPENAI
+    model_name: str = DEFAULT_MODEL_NAME
+    base_url: Optional[str] = None
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = None
+    fake_latency: float = 0.0
+    fake_answer: Optional[str] = None
+
+    def __post_init__(self):
+        if (
+            LLMBackend(self.backend) == LLMBackend.OPENAI_COMPATIBLE
+            and self.base_url is None
+        ):
+            raise ValueError("Please provide the base URL of the openai-compatible server")
+
+    def cache_name(self) -> str:
+        """
+        Returns the name the responses of the model are cached under, which changes with anything that
+        changes them. It is the bare model name for the OpenAI API with its default parameters.
+        """
+        backend = LLMBackend(self.backend)
+        parts = [self.model_name]
+        if backend != LLMBackend.OPENAI:
+            parts.insert(0, backend.value)
+        if backend == LLMBackend.OPENAI_COMPATIBLE:
+            parts.append(self.base_url)
+        if backend == LLMBackend.FAKE:
+            parts.append(str(self.fake_answer))
+        if self.temperature is not None:
+            parts.append(f"temperature={self.temperature}")
+        if self.max_tokens is not None:
+            parts.append(f"max_tokens={self.max_tokens}")
+        return ":".join(parts)
+
+
+class FakeLLM(LLM):  # pylint: disable=abstract-method
+    """
+    A deterministic local language model answering the prompts of the OpenAIReader, for tests
+    and benchmarks that must neither spend API credit nor depend on the network.
+
+    The answer about a target is the configured one, or else the first number with a unit of
+    the text (e.g. ``20 µs``), or NA. The prompts for several targets and several chunks are
+    answered with the JSON objects they ask for. Every prompt takes the configured latency,
+    slept with asyncio when the model is called asynchronously.
+
+    Attributes:
+    model_name (str): The name of the model.
+    latency (float): The seconds taken to answer a prompt.
+    answer (Optional[str]): The answer for every target, or None to pick a number of the text.
+    """
+
+    model_name: str = DEFAULT_MODEL_NAME
+    latency: float = 0.0
+    answer: Optional[str] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _value(self, text: str) -> str:
+        if self.answer is not None:
+            return self.answer
+        match = NUMBER_WITH_UNIT_PATTERN.search(text)
+        return match.group(0).strip() if match else "NA"
+
+    def respond(self, prompt: str) -> str:
+        """Returns the answer to a prompt of the OpenAIReader."""
+        targets_line = list(_TARGETS_LINE.finditer(prompt))[-1]
+        body = prompt[targets_line.end() :].rsplit("Answer:", 1)[0]
+        if targets_line.group(1) == "Target":
+            return self._value(body.split("Text: ", 1)[-1])
+
+        targets = json.loads(targets_line.group(2))
+        chunks = _CHUNK_LINE.split(body)
+        if len(chunks) == 1:
+            value = self._value(body.split("Text: ", 1)[-1])
+            return json.dumps({target: value for target in targets})
+        return json.dumps(
+            {
+                number: {target: self._value(text) for target in targets}
+                for number, text in zip(chunks[1::2], chunks[2::2])
+            }
+        )
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> str:
+        time.sleep(self.latency)
+        return self.respond(prompt)
+
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> str:
+        await asyncio.sleep(self.latency)
+        return self.respond(prompt)
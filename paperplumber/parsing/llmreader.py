@@ -1,17 +1,38 @@
 """Functionality to process text for mining."""
 
+import hashlib
+import json
 import os
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 from langchain import PromptTemplate
 from langchain.llms import OpenAI
 
+from paperplumber import instrumentation
+from paperplumber.logger import get_logger
+from paperplumber.parsing.budget import LLM_TOKENS, TokenBudget
+from paperplumber.parsing.llm_backend import (
+    DEFAULT_MODEL_NAME,
+    FakeLLM,
+    LLMBackend,
+    LLMSettings,
+)
+from paperplumber.parsing.options import DEFAULT_CONTEXT_TOKENS
+from paperplumber.parsing.response_cache import ResponseCache
+from paperplumber.tokens import count_tokens, estimate_tokens
+
+logger = get_logger(__name__)
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 
 
 class OpenAIReader:
-    """Class to parse text using OpenAI's models."""
+    """Class to parse text using OpenAI's models.
+
+    The model is the OpenAI one by default, or the one of the given LLMSettings: a model of any
+    server with the OpenAI API, or a deterministic local FakeLLM. If a TokenBudget is given, every
+    prompt is charged to it before being sent, and its answer after. The prompts sent again one by
+    one after an answer that could not be parsed are counted in ``retries``."""
 
     PROMPT_TEMPLATE = """
     Can you read the following text from a scientific article, and
@@ -34,12 +55,174 @@ class OpenAIReader:
     Answer:
     """
 
-    def __init__(self, target: str):
+    MULTI_TARGET_PROMPT_TEMPLATE = """
+    Can you read the following text from a scientific article, and
+    tell me if it contains information about the values of the targets
+    listed below? Please answer with a JSON object with one key per target.
+    If the value of a target is not quoted in the text, use just 'NA' for
+    it. If the value is quoted in the text, please use the value. If units
+    are reported, please make sure that they are written using ^ to specify
+    superindices (e.g. s^-1).
+
+    Targets: ["coherence time", "speed of light"]
+    Text: We measured a single-qubit coherence time of 10 +/- .5 milliseconds
+    Answer: {{"coherence time": "10 ms", "speed of light": "NA"}}
+
+    Targets: {targets}
+    Text: {text}
+    Answer:
+    """
+
+    PACKED_PROMPT_TEMPLATE = """
+    Can you read the following numbered chunks of text from a scientific
+    article, and tell me if each of them contains information about the values
+    of the targets listed below? Please answer with a JSON object with one key
+    per chunk number, whose value is a JSON object with one key per target.
+    If the value of a target is not quoted in a chunk, use just 'NA' for it.
+    If the value is quoted in the chunk, please use the value. If units are
+    reported, please make sure that they are written using ^ to specify
+    superindices (e.g. s^-1).
+
+    Targets: ["coherence time", "speed of light"]
+    Chunk 1: We measured a single-qubit coherence time of 10 +/- .5 milliseconds
+    Chunk 2: Chocolate is delicious
+    Answer: {{"1": {{"coherence time": "10 ms", "speed of light": "NA"}}, "2": {{"coherence time": "NA", "speed of light": "NA"}}}}
+
+    Targets: {targets}
+    {chunks}
+    Answer:
+    """
+
+    # The prompts only depend on the templates, so every reader uses the same ones
+    prompt = PromptTemplate(input_variables=["target", "text"], template=PROMPT_TEMPLATE)
+    multi_target_prompt = PromptTemplate(
+        input_variables=["targets", "text"], template=MULTI_TARGET_PROMPT_TEMPLATE
+    )
+    packed_prompt = PromptTemplate(
+        input_variables=["targets", "chunks"], template=PACKED_PROMPT_TEMPLATE
+    )
+
+    MODEL_NAME = DEFAULT_MODEL_NAME
+
+    # The number of tokens of the prompts and answers the model can handle
+    CONTEXT_TOKENS = DEFAULT_CONTEXT_TOKENS
+
+    # The tokens kept for the answer about every target in every chunk of a packed prompt
+    ANSWER_TOKENS_PER_VALUE = 16
+
+    def __init__(
+        self,
+        target: str,
+        cache: Optional[ResponseCache] = None,
+        llm: Optional[LLMSettings] = None,
+        budget: Optional[TokenBudget] = None,
+    ):
         self.target = target
-        self.prompt = PromptTemplate(
-            input_variables=["target", "text"], template=self.PROMPT_TEMPLATE
+        self.cache = cache
+        self.llm = llm or LLMSettings()
+        self.budget = budget
+        self.model = self._make_model()
+        self.retries = 0
+
+    def _make_model(self):
+        """Create the language model of the settings."""
+        if LLMBackend(self.llm.backend) == LLMBackend.FAKE:
+            return FakeLLM(
+                model_name=self.llm.model_name,
+                latency=self.llm.fake_latency,
+                answer=self.llm.fake_answer,
+            )
+
+        params = {"model_name": self.llm.model_name}
+        if self.llm.base_url is not None:
+            # Self-hosted servers usually accept any key
+            params["openai_api_base"] = self.llm.base_url
+            params["openai_api_key"] = OPENAI_API_KEY or "EMPTY"
+        if self.llm.temperature is not None:
+            params["temperature"] = self.llm.temperature
+        if self.llm.max_tokens is not None:
+            params["max_tokens"] = self.llm.max_tokens
+        return OpenAI(**params)
+
+    @staticmethod
+    def template_version(template: str) -> str:
+        """Return the version of a prompt template, which changes whenever the template does."""
+        return hashlib.sha256(template.encode("utf-8")).hexdigest()[:16]
+
+    @classmethod
+    def template_versions(cls) -> List[str]:
+        """Return the versions of the current prompt templates."""
+        return [
+            cls.template_version(cls.PROMPT_TEMPLATE),
+            cls.template_version(cls.MULTI_TARGET_PROMPT_TEMPLATE),
+            cls.template_version(cls.PACKED_PROMPT_TEMPLATE),
+        ]
+
+    def _cache_key(self, template: str, target: str, text: str) -> Tuple[str, str]:
+        """Return the template version and the response cache key of a prompt."""
+        version = self.template_version(template)
+        return version, self.cache.key(self.llm.cache_name(), version, target, text)
+
+    def _charge(self, prompt: str) -> None:
+        """Charge a prompt to the budget, if any, before it is sent."""
+        if self.budget is not None:
+            self.budget.charge(LLM_TOKENS, estimate_tokens(prompt, self.llm.model_name))
+
+    def _count_request(self, prompt: str, response: str) -> None:
+        """Count a request to the model and its tokens, if the instrumentation is enabled,
+        and charge its answer to the budget, if any."""
+        if self.budget is not None:
+            self.budget.record(
+                LLM_TOKENS, estimate_tokens(response, self.llm.model_name)
+            )
+        if instrumentation.active() is None:
+            return
+        instrumentation.count("llm_requests")
+        instrumentation.count(
+            "prompt_tokens", estimate_tokens(prompt, self.llm.model_name)
+        )
+        instrumentation.count(
+            "completion_tokens", estimate_tokens(response, self.llm.model_name)
         )
-        self.model = OpenAI(model_name="gpt-3.5-turbo")
+
+    def _request(self, prompt: str) -> str:
+        """Send a prompt to the model."""
+        self._charge(prompt)
+        with instrumentation.timed("llm"):
+            response = self.model(prompt)
+        self._count_request(prompt, response)
+        return response
+
+    def _call_model(self, prompt: str, template: str, target: str, text: str) -> str:
+        """Call the model with a prompt, unless its response is cached."""
+        if self.cache is None:
+            return self._request(prompt)
+
+        version, key = self._cache_key(template, target, text)
+        response = self.cache.get(key)
+        if response is None:
+            response = self._request(prompt)
+            self.cache.put(key, response, version)
+        return response
+
+    async def _acall_model(
+        self, prompt: str, template: str, target: str, text: str
+    ) -> str:
+        """Call the model asynchronously with a prompt, unless its response is cached."""
+        if self.cache is not None:
+            version, key = self._cache_key(template, target, text)
+            response = self.cache.get(key)
+            if response is not None:
+                return response
+
+        self._charge(prompt)
+        with instrumentation.timed("llm"):
+            result = await self.model.agenerate([prompt])
+        response = result.generations[0][0].text
+        self._count_request(prompt, response)
+        if self.cache is not None:
+            self.cache.put(key, response, version)
+        return response
 
     def clean_response(self, response: str):
         """Clean the response from the model."""
@@ -50,5 +233,214 @@ class OpenAIReader:
     def read(self, text: str) -> Optional[str]:
         """Read text and return the value of the target variable."""
         prompt = self.prompt.format(target=self.target, text=text)
-        response = self.model(prompt)
+        response = self._call_model(prompt, self.PROMPT_TEMPLATE, self.target, text)
         return self.clean_response(response)
+
+    def parse_targets_response(
+        self, response: str, targets: List[str]
+    ) -> Optional[Dict[str, str]]:
+        """Parse the JSON answer of the model to a multi-target prompt.
+
+        Returns None if the answer is not a JSON object."""
+        start, end = response.find("{"), response.rfind("}")
+        try:
+            answers = json.loads(response[start : end + 1])
+        except ValueError:
+            return None
+        if not isinstance(answers, dict):
+            return None
+        return {
+            target: self.clean_response(str(answers.get(target, "NA")))
+            for target in targets
+        }
+
+    def read_targets(self, text: str, targets: List[str]) -> Dict[str, str]:
+        """Read text and return the value of several target variables with a single prompt.
+
+        If the model does not answer with a JSON object, every target is read on its own."""
+        targets_json = json.dumps(targets)
+        prompt = self.multi_target_prompt.format(targets=targets_json, text=text)
+        response = self._call_model(
+            prompt, self.MULTI_TARGET_PROMPT_TEMPLATE, targets_json, text
+        )
+        answers = self.parse_targets_response(response, targets)
+        if answers is None:
+            logger.warning(
+                "Could not parse the answer for %s, reading them one by one.", targets
+            )
+            answers = {}
+            self.retries += len(targets)
+            for target in targets:
+                prompt = self.prompt.format(target=target, text=text)
+                response = self._call_model(prompt, self.PROMPT_TEMPLATE, target, text)
+                answers[target] = self.clean_response(response)
+        return answers
+
+    async def aread(self, text: str) -> Optional[str]:
+        """Read text asynchronously and return the value of the target variable."""
+        prompt = self.prompt.format(target=self.target, text=text)
+        response = await self._acall_model(
+            prompt, self.PROMPT_TEMPLATE, self.target, text
+        )
+        return self.clean_response(response)
+
+    async def aread_targets(self, text: str, targets: List[str]) -> Dict[str, str]:
+        """Read text asynchronously and return the value of several target variables
+        with a single prompt, like read_targets."""
+        targets_json = json.dumps(targets)
+        prompt = self.multi_target_prompt.format(targets=targets_json, text=text)
+        response = await self._acall_model(
+            prompt, self.MULTI_TARGET_PROMPT_TEMPLATE, targets_json, text
+        )
+        answers = self.parse_targets_response(response, targets)
+        if answers is None:
+            logger.warning(
+                "Could not parse the answer for %s, reading them one by one.", targets
+            )
+            answers = {}
+            self.retries += len(targets)
+            for target in targets:
+                prompt = self.prompt.format(target=target, text=text)
+                response = await self._acall_model(
+                    prompt, self.PROMPT_TEMPLATE, target, text
+                )
+                answers[target] = self.clean_response(response)
+        return answers
+
+    @staticmethod
+    def _format_chunk(number: int, text: str) -> str:
+        return f"Chunk {number}: {text}"
+
+    def pack(
+        self, texts: List[str], targets: List[str], max_tokens: Optional[int] = None
+    ) -> List[List[str]]:
+        """Split texts into groups, each fitting in a packed prompt with its answer.
+
+        The texts are kept in order, and a text too long to share a prompt gets a group of its own.
+
+        Args:
+            texts (List[str]): The texts to read.
+            targets (List[str]): The targets to read them for.
+            max_tokens (Optional[int]): The max number of tokens of a prompt and its answer.
+                Default is None, for the context size of the model.
+
+        Returns:
+            List[List[str]]: The groups of texts."""
+        max_tokens = max_tokens or self.CONTEXT_TOKENS
+        overhead = count_tokens(
+            self.packed_prompt.format(targets=json.dumps(targets), chunks=""),
+            self.llm.model_name,
+        )
+        answer_tokens = self.ANSWER_TOKENS_PER_VALUE * (len(targets) + 1)
+
+        def chunk_tokens(number: int, text: str) -> int:
+            return count_tokens(self._format_chunk(number, text), self.llm.model_name)
+
+        # The texts are numbered from 1 in every prompt, as in _packed_prompt
+        groups: List[List[str]] = [[]]
+        tokens = overhead
+        for text in texts:
+            cost = chunk_tokens(len(groups[-1]) + 1, text) + answer_tokens
+            if groups[-1] and tokens + cost > max_tokens:
+                groups.append([])
+                tokens = overhead
+                cost = chunk_tokens(1, text) + answer_tokens
+            groups[-1].append(text)
+            tokens += cost
+        return [group for group in groups if group]
+
+    def _packed_prompt(self, texts: List[str], targets: List[str]) -> Tuple[str, str, str]:
+        """Return the packed prompt of texts, and the target and text of its cache key."""
+        targets_json = json.dumps(targets)
+        chunks = "\n".join(
+            self._format_chunk(number, text) for number, text in enumerate(texts, start=1)
+        )
+        prompt = self.packed_prompt.format(targets=targets_json, chunks=chunks)
+        return prompt, targets_json, chunks
+
+    def parse_packed_response(
+        self, response: str, texts: List[str], targets: List[str]
+    ) -> Optional[List[Dict[str, str]]]:
+        """Parse the JSON answer of the model to a packed prompt.
+
+        Returns None if the answer is not a JSON object with an object for every chunk."""
+        start, end = response.find("{"), response.rfind("}")
+        try:
+            answers = json.loads(response[start : end + 1])
+        except ValueError:
+            return None
+        if not isinstance(answers, dict):
+            return None
+
+        chunk_answers = []
+        for number in range(1, len(texts) + 1):
+            answer = answers.get(str(number))
+            if not isinstance(answer, dict):
+                return None
+            chunk_answers.append(
+                {
+                    target: self.clean_response(str(answer.get(target, "NA")))
+                    for target in targets
+                }
+            )
+        return chunk_answers
+
+    def _read_chunk(self, text: str, targets: List[str]) -> Dict[str, str]:
+        """Read a single text for its targets, with the single or multi-target prompt."""
+        if len(targets) > 1:
+            return self.read_targets(text, targets)
+        prompt = self.prompt.format(target=targets[0], text=text)
+        response = self._call_model(prompt, self.PROMPT_TEMPLATE, targets[0], text)
+        return {targets[0]: self.clean_response(response)}
+
+    async def _aread_chunk(self, text: str, targets: List[str]) -> Dict[str, str]:
+        """Read a single text asynchronously for its targets, like _read_chunk."""
+        if len(targets) > 1:
+            return await self.aread_targets(text, targets)
+        prompt = self.prompt.format(target=targets[0], text=text)
+        response = await self._acall_model(
+            prompt, self.PROMPT_TEMPLATE, targets[0], text
+        )
+        return {targets[0]: self.clean_response(response)}
+
+    def read_packed(self, texts: List[str], targets: List[str]) -> List[Dict[str, str]]:
+        """Read several texts with a single prompt and return the value of every target in each text.
+
+        If the model does not answer with a JSON object for every text, every text is read on its own."""
+        if len(texts) == 1:
+            return [self._read_chunk(texts[0], targets)]
+
+        prompt, targets_json, chunks = self._packed_prompt(texts, targets)
+        response = self._call_model(
+            prompt, self.PACKED_PROMPT_TEMPLATE, targets_json, chunks
+        )
+        answers = self.parse_packed_response(response, texts, targets)
+        if answers is None:
+            logger.warning(
+                "Could not parse the answer for %d packed chunks, reading them one by one.",
+                len(texts),
+            )
+            self.retries += len(texts)
+            answers = [self._read_chunk(text, targets) for text in texts]
+        return answers
+
+    async def aread_packed(
+        self, texts: List[str], targets: List[str]
+    ) -> List[Dict[str, str]]:
+        """Read several texts asynchronously with a single prompt, like read_packed."""
+        if len(texts) == 1:
+            return [await self._aread_chunk(texts[0], targets)]
+
+        prompt, targets_json, chunks = self._packed_prompt(texts, targets)
+        response = await self._acall_model(
+            prompt, self.PACKED_PROMPT_TEMPLATE, targets_json, chunks
+        )
+        answers = self.parse_packed_response(response, texts, targets)
+        if answers is None:
+            logger.warning(
+                "Could not parse the answer for %d packed chunks, reading them one by one.",
+                len(texts),
+            )
+            self.retries += len(texts)
+            answers = [await self._aread_chunk(text, targets) for text in texts]
+        return answers
@@ -0,0 +1,70 @@
+"""This module implements a local embedding model, needing neither network access nor an API key"""
+import zlib
+from typing import List
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from paperplumber.logger import get_logger
+from paperplumber.parsing.prefilter import tokenize
+
+logger = get_logger(__name__)
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    A local embedding model hashing the words and word pairs of a text into a fixed number of
+    dimensions, as the hashing trick of scikit-learn's HashingVectorizer does.
+
+    Every word and pair of consecutive words adds +1 or -1, by the sign of its CRC32 hash, to
+    the dimension its hash falls in. The counts are damped logarithmically and the vectors are
+    normalized, so that the FAISS L2 search ranks the pages by cosine similarity. The vectors
+    only depend on the text, so they are deterministic across runs and processes, and they are
+    computed with NumPy in a fraction of the time of an API request, for free.
+
+    The words of a page are matched exactly, without their synonyms, so the quality of the
+    search is closer to BM25 than to a neural embedding model, which is enough for pre-screening
+    and for tests.
+
+    Attributes:
+    size (int): The number of dimensions of the vectors.
+    model (str): The name of the model, which tells apart the cached indexes of other sizes.
+    local (bool): Whether the model runs locally, so that its tokens are not charged to a budget.
+    """
+
+    local = True
+
+    def __init__(self, size: int = 1024):
+        self.size = size
+        self.model = f"hashing-{size}"
+
+    @staticmethod
+    def count_tokens(text: str) -> int:
+        """Returns the number of words of a text, which the batches of embedded pages are sized by."""
+        return len(tokenize(text))
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        """Returns the normalized vectors of texts, one per row."""
+        vectors = np.zeros((len(texts), self.size), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = tokenize(text)
+            features = words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+            if not features:
+                continue
+            hashes = np.fromiter(
+                (zlib.crc32(feature.encode("utf-8")) for feature in features),
+                dtype=np.uint32,
+                count=len(features),
+            )
+            signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+            np.add.at(vectors[row], hashes % self.size, signs)
+
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1.0)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text])[0].tolist()
@@ -0,0 +1,187 @@
+"""This module implements the manifest of the pdf files parsed in a database"""
+import json
+import os
+from typing import Any, Dict, Iterable, List
+
+from paperplumber.cache import file_sha256, make_key
+from paperplumber.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class ParseManifest:
+    """
+    A JSON file recording, for every parsed pdf of a database, the size, modification time
+    and content hash of the pdf, and the targets it was parsed for with the settings used.
+
+    A pdf whose size and modification time did not change is assumed unchanged, otherwise its
+    contents are hashed, so touching a file does not cause it to be parsed again. The settings
+    that affect the values found are recorded once under their key, and each target of a pdf
+    refers to the key of the settings it was parsed with.
+
+    Attributes:
+    path (str): The path to the manifest file.
+    """
+
+    _VERSION = 1
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._papers: Dict[str, Dict[str, Any]] = {}
+        self._settings: Dict[str, Dict[str, Any]] = {}
+        # The content hashes computed by this instance, by paper name
+        self._hashes: Dict[str, str] = {}
+
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                manifest = json.load(file)
+            if manifest.get("version") == self._VERSION:
+                self._papers = manifest["papers"]
+                self._settings = manifest["settings"]
+            else:
+                logger.warning("Ignoring the outdated manifest %s", path)
+
+    @staticmethod
+    def settings_key(settings: Dict[str, Any]) -> str:
+        """
+        Returns the key of the settings affecting the values found.
+        """
+        return make_key(settings)[:16]
+
+    def content_hash(self, name: str, pdf_path: str) -> str:
+        """
+        Returns the content hash of the pdf of a paper, computed once per instance.
+        """
+        if name not in self._hashes:
+            self._hashes[name] = file_sha256(pdf_path)
+        return self._hashes[name]
+
+    def is_unchanged(self, name: str, pdf_path: str) -> bool:
+        """
+        Returns whether a pdf was parsed before and did not change since.
+
+        Args:
+            name (str): The name of the paper.
+            pdf_path (str): The path to the pdf of the paper.
+
+        Returns:
+            bool: False if the paper is not in the manifest or its pdf changed.
+        """
+        paper = self._papers.get(name)
+        if paper is None:
+            return False
+
+        stat = os.stat(pdf_path)
+        if paper["size"] == stat.st_size and paper["mtime"] == stat.st_mtime_ns:
+            return True
+        if paper["size"] == stat.st_size and paper["hash"] == self.content_hash(name, pdf_path):
+            # Only the modification time changed, e.g. the file was copied
+            paper["mtime"] = stat.st_mtime_ns
+            return True
+        return False
+
+    def pending(
+        self, pdf_paths: Dict[str, str], targets: List[str], settings: Dict[str, Any]
+    ) -> Dict[str, List[str]]:
+        """
+        Returns the targets that each pdf still has to be parsed for.
+
+        A new or changed pdf has to be parsed for every target, and an unchanged one for the
+        targets it was not parsed for, or parsed for with other settings.
+
+        Args:
+            pdf_paths (Dict[str, str]): The path to the pdf of every paper, by paper name.
+            targets (List[str]): The targets of the parse.
+            settings (Dict[str, Any]): The settings affecting the values found.
+
+        Returns:
+            Dict[str, List[str]]: The targets to parse, by paper name, for the papers with any.
+        """
+        key = self.settings_key(settings)
+        pending = {}
+        for name, pdf_path in pdf_paths.items():
+            if not self.is_unchanged(name, pdf_path):
+                pending[name] = list(targets)
+                continue
+            parsed = self._papers[name]["targets"]
+            missing = [target for target in targets if parsed.get(target) != key]
+            if missing:
+                pending[name] = missing
+        return pending
+
+    def record(
+        self,
+        name: str,
+        pdf_path: str,
+        targets: Iterable[str],
+        settings: Dict[str, Any],
+    ) -> None:
+        """
+        Records that a pdf was parsed for some targets.
+
+        The targets recorded before are kept, unless the pdf changed since.
+
+        Args:
+            name (str): The name of the paper.
+            pdf_path (str): The path to the pdf of the paper.
+            targets (Iterable[str]): The targets the paper was parsed for.
+            settings (Dict[str, Any]): The settings affecting the values found.
+        """
+        key = self.settings_key(settings)
+        self._settings[key] = settings
+
+        stat = os.stat(pdf_path)
+        content_hash = self.content_hash(name, pdf_path)
+        paper = self._papers.get(name)
+        if paper is None or paper["hash"] != content_hash:
+            paper = self._papers[name] = {"targets": {}}
+        paper.update(size=stat.st_size, mtime=stat.st_mtime_ns, hash=content_hash)
+        paper["targets"].update({target: key for target in targets})
+
+    def targets(self, name: str) -> List[str]:
+        """
+        Returns the targets a paper was parsed for.
+        """
+        return list(self._papers.get(name, {}).get("targets", {}))
+
+    @property
+    def papers(self) -> List[str]:
+        """
+        Returns the names of the papers in the manifest.
+        """
+        return sorted(self._papers)
+
+    def prune(self, names: Iterable[str]) -> None:
+        """
+        Removes the papers that are not given, e.g. whose pdf was deleted.
+        """
+        names = set(names)
+        for name in [name for name in self._papers if name not in names]:
+            del self._papers[name]
+
+    def clear(self) -> None:
+        """
+        Removes every paper from the manifest.
+        """
+        self._papers = {}
+        self._settings = {}
+
+    def save(self) -> None:
+        """
+        Writes the manifest to its file, atomically.
+        """
+        used = {
+            key for paper in self._papers.values() for key in paper["targets"].values()
+        }
+        manifest = {
+            "version": self._VERSION,
+            "settings": {
+                key: settings for key, settings in self._settings.items() if key in used
+            },
+            "papers": dict(sorted(self._papers.items())),
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(manifest, file, indent=1)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,62 @@
+"""
+This module holds the choices of the options of a parse run and of the listing of the papers, so
+that the command line can offer them without importing the language models, the embedding models
+and the pdf parsers.
+"""
+from enum import Enum
+
+DEFAULT_MODEL_NAME = "gpt-3.5-turbo"
+
+# The number of tokens of the prompts and answers the default model can handle
+DEFAULT_CONTEXT_TOKENS = 4096
+
+
+class LLMBackend(str, Enum):
+    """
+    The language model reading the pages: the OpenAI API (openai), any server with the same API at
+    another base URL (openai-compatible), or a deterministic local stand-in (fake).
+    """
+
+    OPENAI = "openai"
+    OPENAI_COMPATIBLE = "openai-compatible"
+    FAKE = "fake"
+
+
+class EmbeddingBackend(str, Enum):
+    """
+    The embedding model of the pages: the OpenAI API (openai), or the local hashing vectorizer (hashing).
+    """
+
+    OPENAI = "openai"
+    HASHING = "hashing"
+
+
+class Retrieval(str, Enum):
+    """
+    How the pages most similar to a target are found: by the embeddings of the pages (dense),
+    by their words with a local BM25 index (lexical), or by both with their rankings fused (hybrid).
+    """
+
+    DENSE = "dense"
+    LEXICAL = "lexical"
+    HYBRID = "hybrid"
+
+
+class BudgetAction(str, Enum):
+    """
+    What happens once the soft budget is used up: a warning only (warn), or also reading only the
+    pages that pass the pre-filter from then on (prefilter).
+    """
+
+    WARN = "warn"
+    PREFILTER = "prefilter"
+
+
+class ListFormat(str, Enum):
+    """
+    How the papers are listed: as a table (table), as a JSON record per line (jsonl), or as CSV rows (csv).
+    """
+
+    TABLE = "table"
+    JSONL = "jsonl"
+    CSV = "csv"
@@ -0,0 +1,115 @@
+"""This module implements the adaptive selection of the pages found by a search"""
+from dataclasses import dataclass
+from typing import List, Optional, Set, Tuple
+
+from langchain.docstore.document import Document
+
+from paperplumber.logger import get_logger
+from paperplumber.parsing.prefilter import tokenize
+
+logger = get_logger(__name__)
+
+
+def _similarity(words: Set[str], other_words: Set[str]) -> float:
+    """Returns the Jaccard similarity of the words of two pages."""
+    if not words or not other_words:
+        return 0.0
+    return len(words & other_words) / len(words | other_words)
+
+
+@dataclass
+class PageSelection:
+    """
+    Selects an adaptive number of the pages found by a search, from their scores.
+
+    The best ``min_k`` pages are always kept. The next ones, up to ``max_k``, are kept while their
+    score reaches the threshold and does not drop too far below the best score, so that a paper
+    whose value is on a single page costs a single language model call, and a review holding it
+    on many pages gets them all.
+
+    With MMR (maximal marginal relevance), the pages are first reordered so that a page nearly
+    identical to a better one, e.g. an overlapping chunk, comes after the pages that bring new text.
+    The similarity of two pages is the overlap of their words, so that it works for every search.
+
+    Attributes:
+    min_k (int): The min number of pages to select.
+    max_k (int): The max number of pages to select.
+    score_threshold (Optional[float]): The min score of the pages selected after the first min_k ones.
+    relative_drop (Optional[float]): The max drop of the score of the selected pages below the best one,
+        as a fraction of it, e.g. 0.1 to only select the pages within 10% of the best one.
+    mmr_lambda (Optional[float]): The trade-off between the score and the novelty of the pages, from
+        0 for the novelty only to 1 for the score only, or None to keep the order of the scores.
+    """
+
+    min_k: int = 2
+    max_k: int = 2
+    score_threshold: Optional[float] = None
+    relative_drop: Optional[float] = None
+    mmr_lambda: Optional[float] = None
+
+    @property
+    def fetch_k(self) -> int:
+        """Returns the number of pages to fetch from the search, more than max_k to reorder them with MMR."""
+        return self.max_k if self.mmr_lambda is None else 2 * self.max_k
+
+    def _mmr(self, scored: List[Tuple[Document, float]]) -> List[Tuple[Document, float]]:
+        """Reorders scored pages by maximal marginal relevance."""
+        scores = [score for _, score in scored]
+        spread = (max(scores) - min(scores)) or 1.0
+        words = [set(tokenize(doc.page_content)) for doc, _ in scored]
+
+        selected: List[int] = []
+        remaining = list(range(len(scored)))
+        while remaining:
+            best = max(
+                remaining,
+                key=lambda i: self.mmr_lambda * (scores[i] - min(scores)) / spread
+                - (1 - self.mmr_lambda)
+                * max((_similarity(words[i], words[j]) for j in selected), default=0.0),
+            )
+            selected.append(best)
+            remaining.remove(best)
+        return [scored[i] for i in selected]
+
+    def select(self, scored: List[Tuple[Document, float]]) -> List[Document]:
+        """
+        Selects pages from their scores.
+
+        Args:
+            scored (List[Tuple[Document, float]]): The pages and their scores, the higher the
+                better, best first.
+
+        Returns:
+            List[Document]: The selected pages.
+        """
+        if not scored:
+            return []
+        if self.mmr_lambda is not None:
+            scored = self._mmr(scored)
+
+        best_score = max(score for _, score in scored)
+        selected = []
+        for doc, score in scored[: self.max_k]:
+            if len(selected) >= self.min_k:
+                if self.score_threshold is not None and score < self.score_threshold:
+                    continue
+                if (
+                    self.relative_drop is not None
+                    and score < best_score - self.relative_drop * abs(best_score)
+                ):
+                    continue
+            selected.append(doc)
+        return selected
+
+    def search(self, searcher, question: str) -> List[Document]:
+        """
+        Searches pages for a question and selects them.
+
+        Args:
+            searcher: A searcher with a ``similarity_search_with_score`` method, e.g. an EmbeddingSearcher.
+            question (str): The question for which to find pages.
+
+        Returns:
+            List[Document]: The selected pages.
+        """
+        return self.select(searcher.similarity_search_with_score(question, k=self.fetch_k))
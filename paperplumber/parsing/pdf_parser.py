@@ -1,51 +1,139 @@
 """Abstract base class to parse PDFs."""
 
+import json
 import os
+from dataclasses import dataclass
+from typing import Iterator, List, Optional
 
+import pypdfium2
+from langchain.docstore.document import Document
 from langchain.document_loaders import PyPDFium2Loader
+from langchain.text_splitter import RecursiveCharacterTextSplitter
 
+from paperplumber import instrumentation
+from paperplumber.cache import DiskCache, file_sha256, make_key
 from paperplumber.logger import get_logger
+from paperplumber.parsing.chunking import TokenChunker
 
 logger = get_logger(__name__)
 
 
+@dataclass(frozen=True)
+class PageRange:
+    """
+    A range of pages of a pdf file, numbered from 1.
+
+    Attributes:
+    first (int): The first page of the range.
+    last (Optional[int]): The last page of the range, included, or None for the last page of the pdf.
+    """
+
+    first: int = 1
+    last: Optional[int] = None
+
+    def __post_init__(self):
+        if self.first < 1 or (self.last is not None and self.last < self.first):
+            raise ValueError(f"Invalid page range {self}")
+
+    @classmethod
+    def parse(cls, text: str) -> "PageRange":
+        """
+        Parses a page range such as "3-50", "3-" or "7".
+
+        Raises:
+        ValueError: If the text is not a valid page range.
+        """
+        first, _, last = text.partition("-")
+        try:
+            if not _:
+                return cls(int(first), int(first))
+            return cls(int(first) if first else 1, int(last) if last else None)
+        except ValueError as error:
+            raise ValueError(f"Invalid page range {text!r}, e.g. 3-50") from error
+
+    def indexes(self, page_count: int) -> range:
+        """Returns the 0-based indexes of the pages of the range in a pdf of page_count pages."""
+        last = page_count if self.last is None else min(self.last, page_count)
+        return range(self.first - 1, last)
+
+
 class PDFParser:
     """
     PDFParser is a class for parsing PDF documents.
 
     This class handles PDF parsing using the backend specified (default is "pdfium2").
+    If a page cache is given, the extracted pages are stored in it, keyed by the contents
+    of the PDF file and the parsing settings, and later parsers of the same file read them
+    back without calling the backend.
+
+    By default the pages are split into chunks of at most 4000 characters. If a TokenChunker is
+    given, they are split into chunks of a given number of tokens instead.
+
+    If a page range is given, only its pages are extracted. In lazy mode, the pages are only
+    extracted when first needed, and iter_pages streams through them one pdf page at a time,
+    without ever holding the whole document in memory.
 
     Attributes:
     _backend (str): The backend to use for PDF parsing. Default is "pdfium2".
     _pdf_path (str): The path to the PDF file to parse.
-    _loader: The PDF loader instance for the specified backend.
-    _pages: The list of pages obtained from the parsed PDF file.
+    _page_cache (Optional[DiskCache]): The cache of extracted pages, if any.
+    _text_splitter: The text splitter used to split the document into pages, shared by every parser.
+    _chunker (Optional[TokenChunker]): The token-aware chunker used instead of the text splitter, if any.
+    _page_range (Optional[PageRange]): The pages to extract, or None for every page.
+    _loader: The PDF loader instance for the specified backend, or None if the pages were cached.
+    _pages: The list of pages obtained from the parsed PDF file, extracted on first access in lazy mode.
 
     """
 
     _backend: str = "pdfium2"
 
-    def __init__(self, pdf_path: str) -> None:
+    # The default splitter only holds its settings, so every parser can use the same one
+    _text_splitter = RecursiveCharacterTextSplitter()
+
+    _PAGES_FILENAME = "pages.json"
+
+    def __init__(
+        self,
+        pdf_path: str,
+        *,
+        page_cache: Optional[DiskCache] = None,
+        pages: Optional[List[Document]] = None,
+        chunker: Optional[TokenChunker] = None,
+        page_range: Optional[PageRange] = None,
+        lazy: bool = False,
+    ) -> None:
         """
         Initialize a new instance of the PDFParser class.
 
         Parameters:
         pdf_path (str): The path to the PDF file to parse.
+        page_cache (Optional[DiskCache]): The cache of extracted pages. Default is None, for no caching.
+        pages (Optional[List[Document]]): The pages of the PDF file, if they were already extracted,
+            e.g. by another process. Default is None, to extract them.
+        chunker (Optional[TokenChunker]): The chunker splitting the pages by tokens. Default is None,
+            to split them by characters.
+        page_range (Optional[PageRange]): The pages to extract. Default is None, for every page.
+        lazy (bool): Whether to extract the pages when first needed instead of now. Default is False.
 
         Raises:
         FileNotFoundError: If the specified file does not exist.
         """
 
         self._pdf_path = pdf_path
+        self._page_cache = page_cache
+        self._chunker = chunker
+        self._page_range = page_range
+        self._loader = None
+        self._content_hash = None
+        self._page_list = pages
 
         # Check if the pdf exists
         if not os.path.exists(self._pdf_path):
             logger.error("File %s does not exist", str(self._pdf_path))
             raise FileNotFoundError(f"File {self._pdf_path} does not exist")
 
-        # Load and split the pdf into pages
-        self._loader = self._get_loader(self._backend)(pdf_path)
-        self._pages = self._loader.load_and_split()
+        if self._page_list is None and not lazy:
+            self._page_list = self._load_pages()
 
     def _get_loader(self, backend: str):
         """
@@ -65,6 +153,147 @@ class PDFParser:
             return PyPDFium2Loader
         raise ValueError("Invalid backend")
 
+    def _splitter_settings(self) -> dict:
+        """
+        Returns the settings of the text splitter that affect the extracted pages.
+        """
+        if self._chunker is not None:
+            return self._chunker.settings()
+        # pylint: disable=protected-access
+        return {
+            "splitter": type(self._text_splitter).__name__,
+            "chunk_size": self._text_splitter._chunk_size,
+            "chunk_overlap": self._text_splitter._chunk_overlap,
+        }
+
+    @property
+    def content_hash(self) -> str:
+        """
+        Returns the SHA-256 hex digest of the PDF file contents.
+        """
+        if self._content_hash is None:
+            self._content_hash = file_sha256(self._pdf_path)
+        return self._content_hash
+
+    def _cache_key(self) -> str:
+        """
+        Returns the page cache key of the PDF file, from its contents and the parsing settings.
+        """
+        if self._page_range is None:
+            return make_key(self.content_hash, self._backend, self._splitter_settings())
+        return make_key(
+            self.content_hash,
+            self._backend,
+            self._splitter_settings(),
+            [self._page_range.first, self._page_range.last],
+        )
+
+    @property
+    def page_count(self) -> int:
+        """
+        Returns the number of pages of the pdf file, without extracting their text.
+        """
+        pdf = pypdfium2.PdfDocument(self._pdf_path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+    def _iter_pdf_pages(self) -> Iterator[Document]:
+        """
+        Extracts the pages of the page range one at a time with pdfium, as the PyPDFium2Loader does.
+        """
+        pdf = pypdfium2.PdfDocument(self._pdf_path)
+        try:
+            for page_number in (self._page_range or PageRange()).indexes(len(pdf)):
+                with instrumentation.timed("extract"):
+                    page = pdf[page_number]
+                    text_page = page.get_textpage()
+                    content = text_page.get_text_range() + "\n"
+                    text_page.close()
+                    page.close()
+                yield Document(
+                    page_content=content,
+                    metadata={"source": self._pdf_path, "page": page_number},
+                )
+        finally:
+            pdf.close()
+
+    def _split(self, pages: List[Document]) -> List[Document]:
+        """
+        Splits pages into chunks.
+        """
+        if self._chunker is not None:
+            return self._chunker.split(pages)
+        return self._text_splitter.split_documents(pages)
+
+    def _extract_pages(self) -> List[Document]:
+        """
+        Loads and splits the pdf into pages with the backend.
+        """
+        if self._page_range is not None:
+            return self._split(list(self._iter_pdf_pages()))
+        self._loader = self._get_loader(self._backend)(self._pdf_path)
+        with instrumentation.timed("extract"):
+            pages = self._loader.load()
+        return self._split(pages)
+
+    def _cached_pages(self) -> Optional[List[Document]]:
+        """
+        Returns the pages of the pdf from the page cache, or None if they are not cached.
+        """
+        if self._page_cache is None:
+            return None
+
+        entry = self._page_cache.get(self._cache_key())
+        if entry is None:
+            instrumentation.count("page_cache_misses")
+            return None
+        instrumentation.count("page_cache_hits")
+        logger.debug("Loading cached pages of %s", self._pdf_path)
+        with open(
+            os.path.join(entry, self._PAGES_FILENAME), "r", encoding="utf-8"
+        ) as file:
+            return [Document(**page) for page in json.load(file)]
+
+    def _load_pages(self) -> List[Document]:
+        """
+        Returns the pages of the pdf, from the page cache if possible.
+        """
+        if self._page_cache is None:
+            return self._extract_pages()
+
+        pages = self._cached_pages()
+        if pages is not None:
+            return pages
+
+        pages = self._extract_pages()
+
+        def write_pages(directory: str) -> None:
+            with open(
+                os.path.join(directory, self._PAGES_FILENAME), "w", encoding="utf-8"
+            ) as file:
+                json.dump(
+                    [
+                        {"page_content": page.page_content, "metadata": page.metadata}
+                        for page in pages
+                    ],
+                    file,
+                )
+
+        self._page_cache.put(self._cache_key(), write_pages)
+        return pages
+
+    @property
+    def _pages(self) -> List[Document]:
+        if self._page_list is None:
+            self._page_list = self._load_pages()
+        return self._page_list
+
+    @_pages.setter
+    def _pages(self, pages: List[Document]) -> None:
+        self._page_list = pages
+
     @property
     def pages(self):
         """
@@ -74,3 +303,24 @@ class PDFParser:
         A list containing the split pages of the PDF file.
         """
         return self._pages
+
+    def iter_pages(self) -> Iterator[Document]:
+        """
+        Yields the split pages of the pdf file, one at a time.
+
+        In lazy mode, the pages that are neither loaded nor cached are extracted and split one pdf page
+        at a time, and neither kept nor cached, so that the memory used does not grow with the size of
+        the document. Chunks spanning several pages need the whole document, which is then split at once.
+
+        Returns:
+        An iterator over the split pages of the PDF file.
+        """
+        pages = self._page_list if self._page_list is not None else self._cached_pages()
+        if pages is not None:
+            yield from pages
+            return
+        if self._chunker is not None and not self._chunker.respect_pages:
+            yield from self._split(list(self._iter_pdf_pages()))
+            return
+        for page in self._iter_pdf_pages():
+            yield from self._split([page])
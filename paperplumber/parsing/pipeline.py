@@ -0,0 +1,248 @@
+"""This module implements a pipeline of concurrent stages connected by bounded queues"""
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from paperplumber.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Marks the end of the items of a queue
+_DONE = object()
+
+
+class Failure:
+    """
+    An item that failed in a stage of a pipeline.
+
+    Failures skip the remaining stages and come out of the pipeline like the other items.
+
+    Attributes:
+    item: The item given to the failed stage.
+    stage (str): The name of the failed stage.
+    error (Exception): The error raised by the stage.
+    """
+
+    def __init__(self, item: Any, stage: str, error: Exception):
+        self.item = item
+        self.stage = stage
+        self.error = error
+
+
+@dataclass
+class StageCounters:
+    """
+    The counters of a stage of a pipeline, updated by its worker threads.
+
+    Attributes:
+    processed (int): The number of items processed.
+    failed (int): The number of items that failed.
+    busy_seconds (float): The total time spent in the function, over all workers.
+    max_queue_depth (int): The largest number of items seen waiting in the input queue.
+    """
+
+    processed: int = 0
+    failed: int = 0
+    busy_seconds: float = 0.0
+    max_queue_depth: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, processed: int, failed: int, seconds: float) -> None:
+        """Adds the items of a call of the function, and the time it took."""
+        with self._lock:
+            self.busy_seconds += seconds
+            self.processed += processed
+            self.failed += failed
+
+
+class Stage:
+    """
+    A stage of a pipeline, run by a number of worker threads.
+
+    Attributes:
+    name (str): The name of the stage.
+    function (Callable): The function applied to every item, or to every batch of items.
+    workers (int): The number of worker threads.
+    batch_size (int): If larger than 1, the function is given a list of up to this many items
+        (all the items waiting in the queue) and must return a list of results in the same order,
+        in which the items that failed on their own can be replaced by a Failure.
+    counters (StageCounters): The items processed and failed, and the time spent on them.
+    """
+
+    def __init__(
+        self, name: str, function: Callable, workers: int = 1, batch_size: int = 1
+    ):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.batch_size = batch_size
+        self.counters = StageCounters()
+        self.input: Optional[queue.Queue] = None
+
+    def _next_batch(self) -> List[Any]:
+        """Waits for an item, then takes the items already waiting, up to the batch size."""
+        batch = [self.input.get()]
+        while batch[-1] is not _DONE and len(batch) < self.batch_size:
+            try:
+                batch.append(self.input.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _process(self, items: List[Any]) -> List[Any]:
+        started = time.perf_counter()
+        try:
+            if self.batch_size > 1:
+                results = list(self.function(items))
+            else:
+                results = [self.function(items[0])]
+            # A batch function can also fail some of its items only
+            failed = sum(isinstance(result, Failure) for result in results)
+        except Exception as error:  # pylint: disable=broad-except
+            logger.debug(error, exc_info=True)
+            results = [Failure(item, self.name, error) for item in items]
+            failed = len(items)
+
+        self.counters.add(len(items), failed, time.perf_counter() - started)
+        return results
+
+    def run_worker(self, output: queue.Queue, on_exit: Callable[[], None]) -> None:
+        """Processes the items of the input queue until the end marker."""
+        while True:
+            self.counters.max_queue_depth = max(
+                self.counters.max_queue_depth, self.input.qsize()
+            )
+            batch = self._next_batch()
+            done = batch[-1] is _DONE
+            items = [item for item in batch if item is not _DONE]
+
+            pending = [item for item in items if not isinstance(item, Failure)]
+            results = self._process(pending) if pending else []
+            for item in items:
+                output.put(item if isinstance(item, Failure) else results.pop(0))
+
+            if done:
+                on_exit()
+                return
+
+
+class Pipeline:
+    """
+    A chain of stages connected by bounded queues.
+
+    Every stage runs in its own worker threads, so the stages overlap, and the bounded
+    queues provide backpressure: a stage that falls behind blocks the stages before it,
+    which keeps the number of items in flight, and therefore the memory, bounded.
+
+    Attributes:
+    stages (List[Stage]): The stages, in order.
+    queue_size (int): The maximum number of items waiting between two stages.
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = 8):
+        self.stages = stages
+        self.queue_size = queue_size
+        self._started: Optional[float] = None
+        self._finished: Optional[float] = None
+
+    def run(self, items: Iterable[Any]) -> Iterator[Any]:
+        """
+        Runs the items through the stages.
+
+        Args:
+            items (Iterable[Any]): The items to process. They are read as the first stage has room for them.
+
+        Yields:
+            The results of the last stage, or a Failure for the items that failed, in completion order.
+        """
+        self._started = time.perf_counter()
+        self._finished = None
+
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        output: queue.Queue = queue.Queue()
+        threads = []
+        for i, stage in enumerate(self.stages):
+            stage.input = queues[i]
+            next_queue = queues[i + 1] if i + 1 < len(self.stages) else output
+            next_workers = (
+                self.stages[i + 1].workers if i + 1 < len(self.stages) else 1
+            )
+            on_exit = self._exit_counter(stage.workers, next_queue, next_workers)
+            for j in range(stage.workers):
+                threads.append(
+                    threading.Thread(
+                        target=stage.run_worker,
+                        args=(next_queue, on_exit),
+                        name=f"{stage.name}-{j}",
+                        daemon=True,
+                    )
+                )
+
+        def feed() -> None:
+            for item in items:
+                queues[0].put(item)
+            for _ in range(self.stages[0].workers):
+                queues[0].put(_DONE)
+
+        threads.append(threading.Thread(target=feed, name="feed", daemon=True))
+        for thread in threads:
+            thread.start()
+
+        while True:
+            result = output.get()
+            if result is _DONE:
+                break
+            yield result
+
+        for thread in threads:
+            thread.join()
+        self._finished = time.perf_counter()
+
+    @staticmethod
+    def _exit_counter(
+        workers: int, next_queue: queue.Queue, next_workers: int
+    ) -> Callable[[], None]:
+        """Returns a callback telling the next stage that it is done once every worker exited."""
+        lock = threading.Lock()
+        remaining = [workers]
+
+        def on_exit() -> None:
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    for _ in range(next_workers):
+                        next_queue.put(_DONE)
+
+        return on_exit
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns the statistics of every stage: the number of workers, the items processed and
+        failed, the current and maximum depth of the input queue, the busy time, the throughput
+        in items per second since the pipeline started and the utilization of the workers.
+        """
+        if self._started is None:
+            elapsed = 0.0
+        else:
+            elapsed = (self._finished or time.perf_counter()) - self._started
+
+        stats = {}
+        for stage in self.stages:
+            counters = stage.counters
+            stats[stage.name] = {
+                "workers": stage.workers,
+                "processed": counters.processed,
+                "failed": counters.failed,
+                "queue_depth": stage.input.qsize() if stage.input is not None else 0,
+                "max_queue_depth": counters.max_queue_depth,
+                "busy_seconds": round(counters.busy_seconds, 3),
+                "throughput": round(counters.processed / elapsed, 3) if elapsed else 0.0,
+                "utilization": (
+                    round(counters.busy_seconds / (elapsed * stage.workers), 3)
+                    if elapsed
+                    else 0.0
+                ),
+            }
+        return stats
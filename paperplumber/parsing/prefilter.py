@@ -0,0 +1,115 @@
+"""This module implements a cheap local filter of the pages to read with a language model"""
+import re
+from typing import List, Set
+
+from paperplumber.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Words of a target that say nothing about where its value is
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "by", "for", "from", "in", "is", "of", "on",
+    "or", "the", "to", "value", "values", "what", "which", "with",
+}  # fmt: skip
+
+# A number, e.g. 12, -0.5, 1,000, 3.2e-4, 5 × 10^-3 or 99.5%
+NUMBER_PATTERN = re.compile(
+    r"(?<![\w.])[-+−±]?\d+(?:[.,]\d+)*(?:\s*(?:[eE][-+−]?\d+|[×x]\s*10\^?[-+−]?\d+))?"
+)
+
+# A number followed by a unit, e.g. 20 µs, 4.2 K, 3 GHz, 12 kcal/mol, 5 s−1 or 99.5 %
+UNIT = (
+    r"(?:%|°\s?[CF]?|ppm|dB|Å|min|hr?|"
+    r"[pnµμumckMGT]?(?:s|Hz|K|eV|m|g|mol|M|L|l|J|W|V|A|Ω|F|T|Pa|bar|Da|cal|rad))"
+)
+NUMBER_WITH_UNIT_PATTERN = re.compile(
+    NUMBER_PATTERN.pattern
+    + rf"\s?{UNIT}(?:\s?(?:/|per\s)\s?{UNIT}|\s?\^?[-−]\d)*(?![a-zA-Z])"
+)
+
+# Lines that start the sections that never hold the values of a paper
+REFERENCE_HEADINGS = re.compile(
+    r"^\s*(?:\d+\.?\s*)?(references|bibliography|acknowledge?ments?)\s*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# Citations, which pages of references are full of
+CITATION_PATTERN = re.compile(r"et al\.|doi:|\(\d{4}\)|\[\d+\]", re.IGNORECASE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Splits a text into lowercase words, without the trailing s of plurals."""
+    return [
+        word[:-1] if len(word) > 3 and word.endswith("s") else word
+        for word in re.findall(r"\w+", text.lower())
+    ]
+
+
+class PreFilter:
+    """
+    Scores pages for a target with cheap local heuristics, so that the pages that cannot
+    hold its value are not sent to the language model.
+
+    The score of a page is the sum of:
+
+    + the fraction of the words of the target found in the page, plus 1 if the whole target is found,
+    + 0.25 if the page holds a number followed by a unit, or 0.1 if it only holds bare numbers,
+    + -2 if the page looks like a list of references or acknowledgements.
+
+    The pages scoring below the threshold are skipped. With the default threshold of 1, a page
+    is read if it holds every word of the target, or most of them and a measured value.
+
+    Attributes:
+    threshold (float): The minimum score of the pages to read.
+    """
+
+    def __init__(self, threshold: float = 1.0):
+        self.threshold = threshold
+
+    @staticmethod
+    def _terms(target: str) -> Set[str]:
+        return {word for word in tokenize(target) if word not in STOPWORDS}
+
+    def score(self, text: str, target: str) -> float:
+        """
+        Returns the score of a page for a target.
+
+        Args:
+            text (str): The text of the page.
+            target (str): The target.
+
+        Returns:
+            float: The score, the higher the more likely the page holds the value of the target.
+        """
+        score = 0.0
+
+        words = tokenize(text)
+        terms = self._terms(target)
+        if terms:
+            score += len(terms.intersection(words)) / len(terms)
+        if f" {' '.join(tokenize(target))} " in f" {' '.join(words)} ":
+            score += 1
+
+        if NUMBER_WITH_UNIT_PATTERN.search(text):
+            score += 0.25
+        elif NUMBER_PATTERN.search(text):
+            score += 0.1
+
+        if REFERENCE_HEADINGS.search(text) and len(CITATION_PATTERN.findall(text)) >= 5:
+            score -= 2
+        return score
+
+    def filter(self, pages: List, target: str) -> List:
+        """
+        Returns the pages whose score for a target reaches the threshold, in the same order.
+
+        Args:
+            pages (List): The pages, with their text in page_content.
+            target (str): The target.
+
+        Returns:
+            List: The pages to read.
+        """
+        return [
+            page for page in pages if self.score(page.page_content, target) >= self.threshold
+        ]
@@ -0,0 +1,228 @@
+"""This module implements a persistent cache of the responses of language models"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from paperplumber.cache import make_key
+from paperplumber.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Collapses the whitespace of a text, so that reflowed copies share a cache key."""
+    return re.sub(r"\s+", " ", text).strip()
+
+
+@dataclass
+class Eviction:
+    """
+    The eviction policy of a ResponseCache.
+
+    Attributes
+    ----------
+    max_entries : Optional[int]
+        The maximum number of entries, or None for no limit.
+    ttl : Optional[float]
+        The time to live of the entries in seconds, or None for no expiry.
+    """
+
+    max_entries: Optional[int] = None
+    ttl: Optional[float] = None
+
+
+class ResponseCache:
+    """
+    A SQLite database of language model responses.
+
+    Responses are keyed by the model name, the version of the prompt template, the target
+    and a hash of the normalized text. The database runs in WAL mode with a busy timeout,
+    so it can be shared by concurrent parse processes, and an instance can be shared by
+    threads. Entries older than the time to live are ignored and evicted, and the least
+    recently used entries are evicted beyond the maximum number of entries.
+
+    Attributes
+    ----------
+    path : str
+        The path to the SQLite database.
+    eviction : Eviction
+        The maximum number of entries and their time to live.
+    hits : int
+        The number of lookups that found a response.
+    misses : int
+        The number of lookups that did not find a response.
+
+    Methods
+    -------
+    key(model_name: str, template_version: str, target: str, text: str):
+        Returns the cache key of a prompt.
+    get(key: str):
+        Returns the cached response for a key, if any.
+    put(key: str, response: str, template_version: str):
+        Stores a response.
+    invalidate(keep_versions: Optional[Iterable[str]] = None):
+        Removes the responses of the other template versions, or every response.
+    """
+
+    # The entries are evicted every this many insertions, rather than on every one
+    _EVICT_EVERY = 100
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS responses (
+        key TEXT PRIMARY KEY,
+        response TEXT NOT NULL,
+        template_version TEXT NOT NULL,
+        created REAL NOT NULL,
+        last_used REAL NOT NULL
+    )
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: Optional[int] = None,
+        ttl: Optional[float] = None,
+    ):
+        self.path = path
+        self.eviction = Eviction(max_entries, ttl)
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(self._SCHEMA)
+        with self._lock:
+            self._evict(time.time())
+
+    @staticmethod
+    def key(model_name: str, template_version: str, target: str, text: str) -> str:
+        """
+        Returns the cache key of a prompt.
+
+        Parameters
+        ----------
+            model_name : str
+                The name of the language model.
+            template_version : str
+                The version of the prompt template.
+            target : str
+                The target of the prompt.
+            text : str
+                The text of the prompt, which is normalized before hashing.
+
+        Returns
+        -------
+        str
+            The cache key.
+        """
+        return make_key(
+            model_name, template_version, target, make_key(normalize_text(text))
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the cached response for a key, and marks it as recently used.
+
+        Parameters
+        ----------
+            key : str
+                The cache key.
+
+        Returns
+        -------
+        Optional[str]
+            The response, or None if it is not cached or expired.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            ttl = self.eviction.ttl
+            if row is None or (ttl is not None and row[1] < now - ttl):
+                self.misses += 1
+                return None
+            self._connection.execute(
+                "UPDATE responses SET last_used = ? WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+        return row[0]
+
+    def put(self, key: str, response: str, template_version: str) -> None:
+        """
+        Stores a response, evicting the expired and least recently used entries from time to time.
+
+        Parameters
+        ----------
+            key : str
+                The cache key.
+            response : str
+                The response of the model.
+            template_version : str
+                The version of the prompt template, used by invalidate.
+        """
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, response, template_version, now, now),
+            )
+            self._puts += 1
+            if self._puts % self._EVICT_EVERY == 0:
+                self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        if self.eviction.ttl is not None:
+            self._connection.execute(
+                "DELETE FROM responses WHERE created < ?", (now - self.eviction.ttl,)
+            )
+        if self.eviction.max_entries is not None:
+            self._connection.execute(
+                "DELETE FROM responses WHERE key NOT IN"
+                " (SELECT key FROM responses ORDER BY last_used DESC LIMIT ?)",
+                (self.eviction.max_entries,),
+            )
+
+    def invalidate(self, keep_versions: Optional[Iterable[str]] = None) -> int:
+        """
+        Removes the responses of outdated prompt templates.
+
+        Parameters
+        ----------
+            keep_versions : Optional[Iterable[str]], optional
+                The template versions whose responses are kept (default is None, to remove every response).
+
+        Returns
+        -------
+        int
+            The number of removed responses.
+        """
+        keep_versions = list(keep_versions or [])
+        with self._lock:
+            cursor = self._connection.execute(
+                "DELETE FROM responses WHERE template_version NOT IN"
+                f" ({', '.join('?' * len(keep_versions))})",  # nosec B608
+                keep_versions,
+            )
+        if cursor.rowcount:
+            logger.info("Removed %d cached responses", cursor.rowcount)
+        return cursor.rowcount
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM responses"
+            ).fetchone()[0]
+
+    def close(self) -> None:
+        """Closes the database connection."""
+        self._connection.close()
@@ -0,0 +1,224 @@
+"""This module implements an append-only file of parse results, one paper per line"""
+import json
+import os
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Union
+
+from paperplumber.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class ResultsFile:
+    """
+    A JSON Lines file holding the values found in every parsed paper.
+
+    Each line is a JSON object ``{"paper": ..., "values": {target: [values]}}`` written as soon
+    as the paper is parsed, and flushed, so that an interrupted parse loses at most the papers
+    in flight. A later line for the same paper overrides the values of its targets. A last line
+    left incomplete by a crash is dropped when the file is opened. The key of the settings the
+    paper was parsed with (``settings``) and the content hash of its pdf (``hash``) are recorded
+    too, so that a resumed parse only skips the papers parsed the same way from the same pdf, and
+    only keeps their values.
+
+    Attributes:
+    path (str): The path to the JSON Lines file.
+    fsync (bool): Whether every line is also synced to the disk, which survives a power loss
+        but is slower.
+    """
+
+    def __init__(self, path: str, fsync: bool = False) -> None:
+        self.path = path
+        self.fsync = fsync
+        self._file = None
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._repair()
+
+    def _repair(self) -> None:
+        """
+        Truncates the file after its last complete line.
+        """
+        if not os.path.exists(self.path):
+            return
+
+        valid_size = 0
+        with open(self.path, "rb") as file:
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    json.loads(line)
+                except ValueError:
+                    break
+                valid_size += len(line)
+
+            file.seek(0, os.SEEK_END)
+            if file.tell() == valid_size:
+                return
+
+        logger.warning("Dropping an incomplete result at the end of %s", self.path)
+        with open(self.path, "r+b") as file:
+            file.truncate(valid_size)
+
+    def records(self) -> Iterable[Dict]:
+        """
+        Yields the records of the file, in the order they were written.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                yield json.loads(line)
+
+    def values(
+        self,
+        papers: Optional[Iterable[str]] = None,
+        targets: Optional[Union[Iterable[str], Dict[str, Iterable[str]]]] = None,
+        settings_key: Optional[str] = None,
+    ) -> Dict[str, Dict[str, List[str]]]:
+        """
+        Returns the latest values of every paper of the file.
+
+        Args:
+            papers (Optional[Iterable[str]]): The papers to keep. Default is None, for every paper.
+            targets (Optional[Union[Iterable[str], Dict[str, Iterable[str]]]]): The targets to keep, for every
+                paper or by paper name. Default is None, for every target.
+            settings_key (Optional[str]): The key of the settings to keep the records of. Default is None, for
+                any settings.
+
+        Returns:
+            Dict[str, Dict[str, List[str]]]: The values, by paper sorted by name and then by target.
+        """
+        papers = set(papers) if papers is not None else None
+
+        values: Dict[str, Dict[str, List[str]]] = {}
+        for record in self.records():
+            if papers is not None and record["paper"] not in papers:
+                continue
+            if settings_key is not None and record.get("settings") != settings_key:
+                continue
+            values.setdefault(record["paper"], {}).update(record["values"])
+
+        if targets is not None:
+            if not isinstance(targets, dict):
+                targets = dict.fromkeys(values, list(targets))
+            values = {
+                paper: {
+                    target: paper_values[target]
+                    for target in targets.get(paper, [])
+                    if target in paper_values
+                }
+                for paper, paper_values in values.items()
+            }
+        return dict(sorted(values.items()))
+
+    def completed(
+        self,
+        targets: Iterable[str],
+        settings_key: Optional[str] = None,
+        content_hash: Optional[Callable[[str], Optional[str]]] = None,
+    ) -> Set[str]:
+        """
+        Returns the papers whose values were found for all the given targets.
+
+        Args:
+            targets (Iterable[str]): The targets of the parse.
+            settings_key (Optional[str]): The key of the settings of the parse. Default is None, for any
+                settings. If given, only the records of these settings count, so the papers parsed with other
+                settings are parsed again.
+            content_hash (Optional[Callable[[str], Optional[str]]]): The function returning the current
+                content hash of the pdf of a paper. Default is None, for any pdf. If given, only the records
+                of the same pdf count.
+
+        Returns:
+            Set[str]: The names of the papers.
+        """
+        targets = set(targets)
+        hashes: Dict[str, Optional[str]] = {}
+        found: Dict[str, Set[str]] = {}
+        for record in self.records():
+            paper = record["paper"]
+            if settings_key is not None and record.get("settings") != settings_key:
+                continue
+            if content_hash is not None:
+                if paper not in hashes:
+                    hashes[paper] = content_hash(paper)
+                if record.get("hash") != hashes[paper]:
+                    continue
+            found.setdefault(paper, set()).update(record["values"])
+        return {paper for paper, paper_targets in found.items() if targets <= paper_targets}
+
+    def append(
+        self,
+        paper: str,
+        values: Dict[str, List[str]],
+        settings_key: Optional[str] = None,
+        content_hash: Optional[str] = None,
+    ) -> None:
+        """
+        Writes the values of a paper at the end of the file.
+
+        Args:
+            paper (str): The name of the paper.
+            values (Dict[str, List[str]]): The values found, by target.
+            settings_key (Optional[str]): The key of the settings the paper was parsed with, if any.
+            content_hash (Optional[str]): The content hash of the pdf of the paper, if any.
+        """
+        record: Dict[str, Any] = {"paper": paper, "values": values}
+        if settings_key is not None:
+            record["settings"] = settings_key
+        if content_hash is not None:
+            record["hash"] = content_hash
+        if self._file is None:
+            self._file = open(  # pylint: disable=consider-using-with
+                self.path, "a", encoding="utf-8"
+            )
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def clear(self) -> None:
+        """
+        Removes every result from the file.
+        """
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def consolidate(
+        self,
+        output_path: str,
+        papers: Optional[Iterable[str]] = None,
+        targets: Optional[Union[Iterable[str], Dict[str, Iterable[str]]]] = None,
+        settings_key: Optional[str] = None,
+    ) -> None:
+        """
+        Writes the latest values of the papers to a single JSON file, atomically.
+
+        Args:
+            output_path (str): The path to the JSON file.
+            papers (Optional[Iterable[str]]): The papers to keep. Default is None, for every paper.
+            targets (Optional[Union[Iterable[str], Dict[str, Iterable[str]]]]): The targets to keep, for every
+                paper or by paper name. Default is None, for every target.
+            settings_key (Optional[str]): The key of the settings to keep the records of. Default is None, for
+                any settings.
+        """
+        tmp_path = output_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(self.values(papers, targets, settings_key), file)
+        os.replace(tmp_path, output_path)
+
+    def close(self) -> None:
+        """
+        Closes the file.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> "ResultsFile":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
@@ -0,0 +1,205 @@
+"""This module holds the settings of a parse run, shared by every worker process"""
+import os
+from dataclasses import asdict, dataclass, field, replace
+from typing import Any, Dict, List, Optional
+
+from paperplumber.cache import DiskCache
+from paperplumber.parsing.budget import BudgetSettings, TokenBudget
+from paperplumber.parsing.chunking import TokenChunker
+from paperplumber.parsing.file_scan import EarlyStop
+from paperplumber.parsing.llm_backend import LLMSettings
+from paperplumber.parsing.llmreader import OpenAIReader
+from paperplumber.parsing.options import EmbeddingBackend, Retrieval
+from paperplumber.parsing.page_selection import PageSelection
+from paperplumber.parsing.pdf_parser import PageRange
+from paperplumber.parsing.response_cache import ResponseCache
+
+
+@dataclass
+class SearchSettings:
+    """
+    How the pages read for each target are found.
+
+    Attributes:
+    enabled (bool): Whether to only read the pages most similar to each target, rather than every page.
+    retrieval (Retrieval): How the pages most similar to each target are found.
+    embedding (EmbeddingBackend): The embedding model of the pages, unless the retrieval is lexical.
+    batch_tokens (int): The max number of tokens in an embedding request.
+    concurrency (int): The max number of embedding requests sent at the same time.
+    selection (PageSelection): How many of the pages found are read for each target.
+    """
+
+    enabled: bool = True
+    retrieval: Retrieval = Retrieval.DENSE
+    embedding: EmbeddingBackend = EmbeddingBackend.OPENAI
+    batch_tokens: int = 100000
+    concurrency: int = 4
+    selection: PageSelection = field(default_factory=PageSelection)
+
+    def embeds(self) -> bool:
+        """Returns whether the pages are embedded to be searched."""
+        return self.enabled and self.retrieval != Retrieval.LEXICAL
+
+
+@dataclass
+class ChunkingSettings:
+    """
+    How the pdfs are split into the chunks read by the language model.
+
+    Attributes:
+    tokens (Optional[int]): The max number of tokens of a chunk, or None to split the pdfs into chunks
+        of at most 4000 characters.
+    overlap (int): The number of tokens shared by two consecutive chunks.
+    respect_pages (bool): Whether a chunk is kept within a single page.
+    page_range (Optional[PageRange]): The pages of the pdfs to parse, or None for every page.
+    lazy_pages (bool): Whether to stream the pages of the pdfs read in full instead of extracting them first.
+    """
+
+    tokens: Optional[int] = None
+    overlap: int = 50
+    respect_pages: bool = True
+    page_range: Optional[PageRange] = None
+    lazy_pages: bool = False
+
+    def chunker(self, model_name: str) -> Optional[TokenChunker]:
+        """Returns the token-aware chunker of the pdfs for a model, or None for the default splitter."""
+        if self.tokens is None:
+            return None
+        return TokenChunker(
+            chunk_tokens=self.tokens,
+            chunk_overlap=self.overlap,
+            respect_pages=self.respect_pages,
+            model_name=model_name,
+        )
+
+
+@dataclass
+class ReadingSettings:
+    """
+    How the pages are read by the language model.
+
+    Attributes:
+    llm (LLMSettings): The language model reading the pages, and its generation parameters.
+    concurrency (Optional[int]): The max number of pages read at the same time, or None to read them in turn.
+    prefilter_threshold (Optional[float]): The min score of the pages read by the language model
+        for a target, or None to read every page.
+    pack_tokens (Optional[int]): The max number of tokens of a prompt packing several chunks,
+        or None to read every chunk with its own prompt.
+    consistent_values (Optional[int]): The number of times the same value must be found for a target
+        before the remaining pages of a paper are skipped for it, or None to read them all.
+    max_calls (Optional[int]): The max number of prompts sent for a paper, or None for no cap.
+    """
+
+    llm: LLMSettings = field(default_factory=LLMSettings)
+    concurrency: Optional[int] = None
+    prefilter_threshold: Optional[float] = None
+    pack_tokens: Optional[int] = None
+    consistent_values: Optional[int] = None
+    max_calls: Optional[int] = None
+
+    def early_stop(self) -> Optional[EarlyStop]:
+        """Returns when to stop reading the pages of a paper, or None to read them all."""
+        if self.consistent_values is None and self.max_calls is None:
+            return None
+        return EarlyStop(self.consistent_values, self.max_calls)
+
+
+@dataclass
+class CacheSettings:
+    """
+    The on-disk caches of a parse run.
+
+    Attributes:
+    path (Optional[str]): The directory of the caches, or None to disable them.
+    size (int): The max size of each on-disk cache in megabytes.
+    llm_entries (Optional[int]): The max number of cached language model responses.
+    llm_ttl (Optional[float]): The time to live of the cached responses in seconds.
+    """
+
+    path: Optional[str] = None
+    size: int = 1024
+    llm_entries: Optional[int] = 100000
+    llm_ttl: Optional[float] = None
+
+    def disk_cache(self, name: str) -> Optional[DiskCache]:
+        """Returns the on-disk cache of a kind, e.g. pages, or None if the caches are disabled."""
+        if self.path is None:
+            return None
+        return DiskCache(
+            os.path.join(self.path, name), max_size=self.size * 1024 * 1024
+        )
+
+    def response_cache(self) -> Optional[ResponseCache]:
+        """Returns the cache of the language model responses, or None if the caches are disabled."""
+        if self.path is None:
+            return None
+        return ResponseCache(
+            os.path.join(self.path, "responses.sqlite"),
+            max_entries=self.llm_entries,
+            ttl=self.llm_ttl,
+        )
+
+
+@dataclass
+class ParseSettings:
+    """
+    The settings of a parse run, shared by every worker process.
+
+    Attributes:
+    targets (List[str]): The values to extract from the papers.
+    search (SearchSettings): How the pages read for each target are found.
+    chunking (ChunkingSettings): How the pdfs are split into chunks.
+    reading (ReadingSettings): How the pages are read by the language model.
+    cache (CacheSettings): The on-disk caches.
+    budget (BudgetSettings): The token budgets of the run.
+    instrument (bool): Whether the worker processes time the stages of every paper and count their events.
+    """
+
+    targets: List[str]
+    search: SearchSettings = field(default_factory=SearchSettings)
+    chunking: ChunkingSettings = field(default_factory=ChunkingSettings)
+    reading: ReadingSettings = field(default_factory=ReadingSettings)
+    cache: CacheSettings = field(default_factory=CacheSettings)
+    budget: BudgetSettings = field(default_factory=BudgetSettings)
+    instrument: bool = False
+
+    def streams_pages(self) -> bool:
+        """Returns whether the pages of the pdfs are streamed to the language model as they are extracted."""
+        return (
+            self.chunking.lazy_pages
+            and not self.search.enabled
+            and self.reading.pack_tokens is None
+            and self.reading.early_stop() is None
+        )
+
+    def chunker(self) -> Optional[TokenChunker]:
+        """Returns the token-aware chunker of the pdfs, or None for the default splitter."""
+        return self.chunking.chunker(self.reading.llm.model_name)
+
+    def spend(self, budget: Optional[TokenBudget]) -> "ParseSettings":
+        """
+        Returns the settings with the token budgets left after the tokens of another account, e.g. of the
+        corpus index search, see BudgetSettings.spend.
+        """
+        if budget is None:
+            return self
+        return replace(self, budget=self.budget.spend(budget))
+
+    def result_settings(self) -> Dict[str, Any]:
+        """Returns the settings that affect the values found, as opposed to how fast they are found."""
+        chunker = self.chunker()
+        page_range = self.chunking.page_range
+        return {
+            "filter_with_embedding_search": self.search.enabled,
+            "model": self.reading.llm.cache_name(),
+            "templates": sorted(OpenAIReader.template_versions()),
+            "prefilter_threshold": self.reading.prefilter_threshold,
+            "retrieval": Retrieval(self.search.retrieval).value,
+            "embedding": EmbeddingBackend(self.search.embedding).value,
+            "chunking": chunker.settings() if chunker is not None else None,
+            "pack_tokens": self.reading.pack_tokens,
+            "consistent_values": self.reading.consistent_values,
+            "max_llm_calls": self.reading.max_calls,
+            "page_selection": asdict(self.search.selection),
+            "page_range": asdict(page_range) if page_range is not None else None,
+        }
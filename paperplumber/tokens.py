@@ -0,0 +1,76 @@
+""" Utils for counting tokens """
+
+import functools
+from typing import Optional
+
+import tiktoken
+
+DEFAULT_ENCODING = "cl100k_base"
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model_name: Optional[str] = None) -> tiktoken.Encoding:
+    """
+    Returns the tiktoken encoding of a model, or the default encoding if the model is unknown.
+
+    Args:
+        model_name (Optional[str]): The name of the model.
+
+    Returns:
+        tiktoken.Encoding: The encoding.
+    """
+    if model_name is not None:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            pass
+    return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+
+def count_tokens(text: str, model_name: Optional[str] = None) -> int:
+    """
+    Counts the tokens of a text for a model.
+
+    Args:
+        text (str): The text.
+        model_name (Optional[str]): The name of the model.
+
+    Returns:
+        int: The number of tokens.
+    """
+    return len(get_encoding(model_name).encode(text, disallowed_special=()))
+
+
+@functools.lru_cache(maxsize=None)
+def tokenizer_available(model_name: Optional[str] = None) -> bool:
+    """
+    Returns whether the tiktoken encoding of a model can be loaded, which needs to download it once.
+
+    Args:
+        model_name (Optional[str]): The name of the model.
+
+    Returns:
+        bool: Whether the encoding can be loaded.
+    """
+    try:
+        get_encoding(model_name)
+    except Exception:  # pylint: disable=broad-except
+        return False
+    return True
+
+
+def estimate_tokens(text: str, model_name: Optional[str] = None) -> int:
+    """
+    Counts the tokens of a text for a model, or estimates them at 4 characters per token if the
+    encoding of the model cannot be loaded, e.g. offline.
+
+    Args:
+        text (str): The text.
+        model_name (Optional[str]): The name of the model.
+
+    Returns:
+        int: The number of tokens.
+    """
+    if tokenizer_available(model_name):
+        return count_tokens(text, model_name)
+    return len(text) // 4
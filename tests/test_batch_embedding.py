@@ -0,0 +1,72 @@
+"""Tests for the BatchEmbedder class."""
+
+import threading
+import time
+
+from langchain.embeddings.base import Embeddings
+
+from paperplumber.parsing.batch_embedding import BatchEmbedder
+
+
+class LengthEmbeddings(Embeddings):
+    """A local embedding model recording its requests."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self._lock:
+            self.requests.append(list(texts))
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.latency)
+        with self._lock:
+            self.active -= 1
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        return [float(len(text)), 1.0]
+
+
+def word_count(text):
+    return len(text.split())
+
+
+def test_pack_respects_limits():
+    batch_embedder = BatchEmbedder(
+        LengthEmbeddings(), max_batch_tokens=5, max_batch_size=3, token_counter=word_count
+    )
+    texts = ["a b", "c d", "e", "f g h i j k", "l", "m", "n", "o"]
+    assert batch_embedder.pack(texts) == [[0, 1, 2], [3], [4, 5, 6], [7]]
+
+
+def test_embed_documents_scatters_vectors():
+    embedder = LengthEmbeddings()
+    batch_embedder = BatchEmbedder(embedder, max_batch_tokens=4, token_counter=word_count)
+    documents = {
+        "short.pdf": ["one"],
+        "empty.pdf": [],
+        "long.pdf": ["one two", "one two three four", "x"],
+    }
+
+    vectors = batch_embedder.embed_documents(documents)
+
+    # Pages of different documents share requests
+    assert embedder.requests == [["one", "one two"], ["one two three four"], ["x"]]
+    assert batch_embedder.requests == 3
+    for name, pages in documents.items():
+        assert vectors[name] == [[float(len(text)), 1.0] for text in pages]
+
+
+def test_bounded_concurrency():
+    embedder = LengthEmbeddings(latency=0.02)
+    batch_embedder = BatchEmbedder(
+        embedder, max_batch_size=1, max_concurrency=2, token_counter=word_count
+    )
+    batch_embedder.embed_documents({"paper.pdf": [str(i) for i in range(8)]})
+    assert len(embedder.requests) == 8
+    assert embedder.max_active <= 2
@@ -0,0 +1,61 @@
+import os
+
+from benchmarks.bench_parse import Scenario, compare, run_scenario
+from benchmarks.synthetic import TARGETS, make_corpus
+from paperplumber.parsing.pdf_parser import PDFParser
+
+
+def test_make_corpus(tmp_path):
+    corpus = make_corpus(str(tmp_path), papers=2, pages=3)
+
+    pdfs = sorted(os.listdir(os.path.join(corpus, "pdfs")))
+    assert pdfs == ["synthetic-0000.pdf", "synthetic-0001.pdf"]
+    assert os.path.exists(os.path.join(corpus, "papers.json"))
+
+    parser = PDFParser(os.path.join(corpus, "pdfs", pdfs[0]))
+    assert parser.page_count == 3
+    text = " ".join(page.page_content for page in parser.pages)
+    assert any(target in text for target in TARGETS)
+
+
+def test_run_scenario(tmp_path):
+    corpus = make_corpus(str(tmp_path / "corpus"), papers=2, pages=2)
+
+    for scenario in [
+        Scenario("parse", papers=2, pages=2),
+        Scenario("scanner", papers=2, pages=2, component="file_scanner"),
+    ]:
+        metrics = run_scenario(scenario, corpus, llm_latency=0, embedding_latency=0)
+        assert metrics["papers_per_second"] > 0
+        assert metrics["pages_per_second"] == 2 * metrics["papers_per_second"]
+        assert metrics["llm_calls_per_paper"] > 0
+        assert metrics["peak_rss_mb"] > 0
+
+    # The corpus is left untouched
+    assert not os.path.exists(os.path.join(corpus, "output.json"))
+
+
+def test_compare():
+    baseline = {
+        "parse": {
+            "papers_per_second": 10.0,
+            "pages_per_second": 100.0,
+            "llm_calls_per_paper": 4.0,
+            "peak_rss_mb": 100.0,
+        }
+    }
+    results = {
+        "parse": {
+            "papers_per_second": 9.0,
+            "pages_per_second": 50.0,
+            "llm_calls_per_paper": 6.0,
+            "peak_rss_mb": 110.0,
+        },
+        "new": {"papers_per_second": 1.0},
+    }
+
+    regressions = compare(results, baseline, tolerance=0.25)
+
+    assert len(regressions) == 2
+    assert regressions[0].startswith("parse: pages_per_second")
+    assert regressions[1].startswith("parse: llm_calls_per_paper")
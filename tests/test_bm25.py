@@ -0,0 +1,53 @@
+"""Tests for the BM25 index and the reciprocal rank fusion."""
+
+from langchain.docstore.document import Document
+
+from paperplumber.parsing.bm25 import BM25Index, reciprocal_rank_fusion
+
+
+def page(text, paper="a.pdf"):
+    return Document(page_content=text, metadata={"paper": paper})
+
+
+PAGES = [
+    page("The protein folds in two states."),
+    page("The relaxation time T2 was 20 ms, and T1 was 1 s."),
+    page("The folding rate k_f depends on the contact order.", paper="b.pdf"),
+    page("References: Smith et al. (2001), protein folding."),
+]
+
+
+def test_exact_symbols_rank_first():
+    index = BM25Index()
+    assert index.add(PAGES) == [0, 1, 2, 3]
+
+    assert index.search("T2 relaxation", k=1) == [PAGES[1]]
+    assert index.search("k_f", k=2) == [PAGES[2]]
+    assert index.search("protein folding")[0] in (PAGES[0], PAGES[3])
+    assert index.search("protein", paper="b.pdf") == []
+    assert index.search("unrelated words") == []
+
+
+def test_delete_save_and_load(tmp_path):
+    index = BM25Index()
+    ids = index.add(PAGES)
+    index.delete(ids[1:2])
+    assert len(index) == 3
+    assert index.search("T2") == []
+
+    path = str(tmp_path / "bm25.json")
+    index.save(path)
+    loaded = BM25Index.load(path)
+    assert len(loaded) == 3
+    assert loaded.scores("folding rate") == index.scores("folding rate")
+    assert loaded.add([page("T2")]) == [4]
+
+
+def test_reciprocal_rank_fusion():
+    a, b, c = page("a"), page("b"), page("c")
+    # b is second in both rankings, and beats the pages first in only one of them
+    assert reciprocal_rank_fusion([[a, b], [c, b]]) == [b, a, c]
+    assert reciprocal_rank_fusion([[a, page("b", paper="b.pdf")], []]) == [
+        a,
+        page("b", paper="b.pdf"),
+    ]
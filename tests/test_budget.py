@@ -0,0 +1,213 @@
+"""Tests for the token budgets of a run and the estimation of its cost."""
+
+import json
+import logging
+import os
+import shutil
+from dataclasses import replace
+from unittest.mock import patch
+
+import pytest
+from langchain.docstore.document import Document
+
+from paperplumber import main
+from paperplumber.database.findpapers_integration import FindPapersDatabase
+from paperplumber.parsing.batch_embedding import BatchEmbedder
+from paperplumber.parsing.budget import (
+    BudgetAction,
+    BudgetedEmbeddings,
+    BudgetExceeded,
+    BudgetSettings,
+    CostEstimate,
+    TokenBudget,
+)
+from paperplumber.parsing.file_scan import FileScanner
+from paperplumber.parsing.llm_backend import LLMBackend, LLMSettings
+from paperplumber.parsing.llmreader import OpenAIReader
+from paperplumber.parsing.local_embedding import HashingEmbeddings
+from paperplumber.parsing.options import EmbeddingBackend, Retrieval
+from paperplumber.parsing.settings import ParseSettings, SearchSettings
+
+FAKE_LLM = LLMSettings(backend=LLMBackend.FAKE)
+TESTS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_hard_budget_refuses_requests_over_it():
+    budget = TokenBudget(hard=100)
+    budget.charge("llm_tokens", 60)
+    budget.record("embedding_tokens", 30)
+
+    with pytest.raises(BudgetExceeded):
+        budget.charge("llm_tokens", 20)
+    # Every later request is refused, even a smaller one
+    with pytest.raises(BudgetExceeded):
+        budget.charge("llm_tokens", 1)
+    assert budget.totals == {"llm_tokens": 60, "embedding_tokens": 30}
+
+
+def test_soft_budget_warns_once(caplog):
+    budget = TokenBudget(soft=10, action=BudgetAction.PREFILTER)
+    with caplog.at_level(logging.WARNING):
+        budget.charge("llm_tokens", 8)
+        assert not budget.soft_exceeded()
+        budget.charge("llm_tokens", 8)
+        budget.charge("llm_tokens", 8)
+
+    assert budget.prefilter_only()
+    assert sum("soft token budget" in message for message in caplog.messages) == 1
+    assert not TokenBudget(soft=0).prefilter_only()
+
+
+class PaidEmbeddings(HashingEmbeddings):
+    """The hashing embeddings, charged as if they were sent to an API."""
+
+    local = False
+
+
+def test_budgeted_embeddings_charge_before_embedding():
+    budget = TokenBudget(hard=5)
+    embedder = BudgetedEmbeddings(PaidEmbeddings(), budget)
+
+    assert embedder.model == "hashing-1024"
+    assert len(embedder.embed_documents(["one two", "three"])) == 2
+    assert budget.totals["embedding_tokens"] == 3
+    with pytest.raises(BudgetExceeded):
+        embedder.embed_query("four five six")
+
+
+def test_budgeted_embeddings_do_not_charge_local_models():
+    budget = TokenBudget(hard=1)
+    embedder = BudgetedEmbeddings(HashingEmbeddings(), budget)
+
+    assert len(embedder.embed_documents(["one two", "three"])) == 2
+    assert len(embedder.embed_query("four five six")) == 1024
+    assert budget.used == 0
+
+
+def test_settings_spend_the_corpus_index_tokens():
+    settings = ParseSettings(targets=["rate"], budget=BudgetSettings(100, 30))
+    assert settings.spend(None) is settings
+
+    budget = settings.budget.account()
+    budget.charge("embedding_tokens", 40)
+    assert settings.spend(budget).budget == BudgetSettings(60, 0)
+
+    with pytest.raises(BudgetExceeded):
+        budget.charge("embedding_tokens", 70)
+    assert settings.spend(budget).budget.hard == 0
+    assert ParseSettings(targets=["rate"]).spend(budget).budget.hard is None
+    assert BudgetSettings(100, 30).share(4) == BudgetSettings(25, 7)
+
+
+@pytest.fixture
+def database_path(tmp_path):
+    shutil.copy(os.path.join(TESTS_DIRECTORY, "test_db", "papers.json"), tmp_path)
+    os.mkdir(tmp_path / "pdfs")
+    for name in ("maxwell2005.pdf", "plaxco1997.pdf"):
+        shutil.copy(os.path.join(TESTS_DIRECTORY, name), tmp_path / "pdfs")
+    return str(tmp_path)
+
+
+def test_parse_charges_the_corpus_index(database_path, caplog):
+    args = ["parse", database_path, "rate", "--corpus-index", "--embedding", "hashing"]
+    args += ["--llm-backend", "fake", "--no-cache", "--token-budget", "50"]
+    with patch.object(HashingEmbeddings, "local", False):
+        main.app(args, prog_name="paperplumber", standalone_mode=False)
+
+    assert any("Stopping the corpus index search" in message for message in caplog.messages)
+    with open(os.path.join(database_path, "output.json"), encoding="utf-8") as file:
+        assert not any(json.load(file).values())
+
+
+def test_parse_leaves_out_the_papers_the_corpus_index_cannot_embed(database_path, caplog):
+    embed_documents = HashingEmbeddings.embed_documents
+
+    def failing_embed_documents(self, texts):
+        if any("Maxwell" in text for text in texts):
+            raise ValueError("The embedding request failed")
+        return embed_documents(self, texts)
+
+    args = ["parse", database_path, "rate", "--corpus-index", "--embedding", "hashing"]
+    args += ["--llm-backend", "fake", "--no-cache"]
+    with patch.object(HashingEmbeddings, "embed_documents", failing_embed_documents):
+        main.app(args, prog_name="paperplumber", standalone_mode=False)
+
+    assert any(
+        "Failed to parse 1 of 2 papers: maxwell2005.pdf" in message
+        for message in caplog.messages
+    )
+    with open(os.path.join(database_path, "output.jsonl"), encoding="utf-8") as file:
+        assert [json.loads(line)["paper"] for line in file] == ["plaxco1997.pdf"]
+
+
+def test_estimate_corpus_index(database_path):
+    database = FindPapersDatabase(database_path)
+    settings = ParseSettings(
+        targets=["rate"], search=SearchSettings(embedding=EmbeddingBackend.HASHING)
+    )
+
+    # Every pdf is counted as embedded until it is indexed, and the targets always are
+    assert main._estimate_corpus_index(database, settings, None).embedding_tokens > 100
+    main._update_corpus_index(
+        database, settings, batch_embedder=BatchEmbedder(HashingEmbeddings())
+    )
+    assert main._estimate_corpus_index(database, settings, None).embedding_tokens == 1
+    assert (
+        main._estimate_corpus_index(
+            database,
+            replace(settings, search=SearchSettings(retrieval=Retrieval.LEXICAL)),
+            None,
+        ).embedding_tokens
+        == 0
+    )
+
+
+def test_estimate_corpus_index_without_api_key(database_path, monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    database = FindPapersDatabase(database_path)
+    settings = ParseSettings(
+        targets=["rate"], search=SearchSettings(embedding=EmbeddingBackend.OPENAI)
+    )
+
+    assert main._estimate_corpus_index(database, settings, None).embedding_tokens > 100
+
+
+def test_reader_charges_prompts_and_answers():
+    budget = TokenBudget()
+    reader = OpenAIReader("rate", llm=FAKE_LLM, budget=budget)
+
+    assert reader.read("The rate was 20 s^-1.") == "20 s^-1"
+    assert budget.totals["llm_tokens"] > 100
+
+    with pytest.raises(BudgetExceeded):
+        OpenAIReader("rate", llm=FAKE_LLM, budget=TokenBudget(hard=10)).read("Text")
+
+
+@pytest.mark.parametrize("concurrency", [None, 2])
+def test_scanner_stops_on_the_budget(concurrency):
+    budget = TokenBudget(hard=1000)
+    scanner = FileScanner.from_pages(
+        [Document(page_content=f"Page {i} at 20 K.") for i in range(10)]
+    )
+
+    with pytest.raises(BudgetExceeded):
+        scanner.scan_targets(
+            ["temperature"], concurrency=concurrency, llm=FAKE_LLM, budget=budget
+        )
+    assert budget.used <= 1000
+
+
+def test_cost_estimate():
+    estimate = CostEstimate(
+        papers=1, prompts=2, prompt_tokens=1000, completion_tokens=500
+    )
+    estimate.merge(CostEstimate(papers=1, embedding_tokens=10000))
+
+    assert estimate.papers == 2
+    assert estimate.tokens == 11500
+    assert estimate.llm_cost(LLMSettings()) == pytest.approx(0.0025)
+    assert estimate.llm_cost(LLMSettings(model_name="gpt-4-0613")) == pytest.approx(0.06)
+    assert estimate.llm_cost(FAKE_LLM) == 0.0
+    assert estimate.llm_cost(LLMSettings(model_name="my-model")) is None
+    assert estimate.embedding_cost(EmbeddingBackend.OPENAI) == pytest.approx(0.001)
+    assert estimate.embedding_cost(EmbeddingBackend.HASHING) == 0.0
@@ -0,0 +1,55 @@
+"""Tests for the on-disk cache utilities."""
+
+import os
+import time
+
+from paperplumber.cache import DiskCache, file_sha256, make_key
+
+
+def write_blob(size):
+    def writer(directory):
+        with open(os.path.join(directory, "blob"), "wb") as file:
+            file.write(b"x" * size)
+
+    return writer
+
+
+def test_file_sha256(tmp_path):
+    path = tmp_path / "file.txt"
+    path.write_bytes(b"paperplumber")
+    digest = file_sha256(str(path))
+    assert len(digest) == 64
+    path.write_bytes(b"paperplumber!")
+    assert file_sha256(str(path)) != digest
+
+
+def test_make_key_depends_on_parts():
+    assert make_key("a", {"x": 1, "y": 2}) == make_key("a", {"y": 2, "x": 1})
+    assert make_key("a", 1) != make_key("a", 2)
+
+
+def test_put_and_get(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache"))
+    assert cache.get("key") is None
+    path = cache.put("key", write_blob(10))
+    assert cache.get("key") == path
+    assert os.path.getsize(os.path.join(path, "blob")) == 10
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_lru_eviction(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache"), max_size=250)
+    cache.put("first", write_blob(100))
+    time.sleep(0.01)
+    cache.put("second", write_blob(100))
+    time.sleep(0.01)
+
+    # Using the first entry makes the second one the least recently used
+    assert cache.get("first") is not None
+    time.sleep(0.01)
+    cache.put("third", write_blob(100))
+
+    assert cache.get("first") is not None
+    assert cache.get("second") is None
+    assert cache.get("third") is not None
+    assert cache.size() <= 250
@@ -0,0 +1,58 @@
+"""Tests for the token-aware chunking of the pages."""
+
+import os
+from unittest.mock import patch
+
+import pytest
+from langchain.docstore.document import Document
+
+from paperplumber.cache import DiskCache
+from paperplumber.parsing.chunking import TokenChunker
+from paperplumber.parsing.pdf_parser import PDFParser
+
+PDF_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plaxco1997.pdf")
+
+
+@pytest.fixture(autouse=True)
+def count_words():
+    # Count words instead of tokens, the tokenizer is downloaded on its first use
+    with patch(
+        "paperplumber.parsing.chunking.count_tokens",
+        lambda text, model_name=None: len(text.split()),
+    ):
+        yield
+
+
+def make_pages(*texts):
+    return [Document(page_content=text, metadata={"page": i}) for i, text in enumerate(texts)]
+
+
+def test_chunks_respect_pages():
+    pages = make_pages(" ".join(f"a{i}" for i in range(25)), "b0 b1 b2")
+    chunks = TokenChunker(chunk_tokens=10, chunk_overlap=2).split(pages)
+
+    assert all(len(chunk.page_content.split()) <= 10 for chunk in chunks)
+    assert [chunk.metadata["page"] for chunk in chunks] == [0, 0, 0, 1]
+    # Consecutive chunks of a page overlap
+    assert chunks[0].page_content.split()[-2:] == chunks[1].page_content.split()[:2]
+    assert chunks[-1].page_content == "b0 b1 b2"
+
+
+def test_chunks_span_pages():
+    pages = make_pages("a0 a1 a2 a3", "b0 b1 b2 b3", "c0 c1")
+    chunks = TokenChunker(chunk_tokens=6, chunk_overlap=0, respect_pages=False).split(pages)
+
+    assert [chunk.page_content for chunk in chunks] == ["a0 a1 a2 a3", "b0 b1 b2 b3\n\nc0 c1"]
+    assert [chunk.metadata["page"] for chunk in chunks] == [0, 1]
+
+
+def test_chunker_is_part_of_the_cache_key(tmp_path):
+    page_cache = DiskCache(str(tmp_path / "pages"))
+    default_pages = PDFParser(PDF_PATH, page_cache=page_cache).pages
+    chunker = TokenChunker(chunk_tokens=100, chunk_overlap=10)
+    pages = PDFParser(PDF_PATH, page_cache=page_cache, chunker=chunker).pages
+
+    assert len(pages) > len(default_pages)
+    assert all(len(page.page_content.split()) <= 100 for page in pages)
+    assert PDFParser(PDF_PATH, page_cache=page_cache, chunker=chunker).pages == pages
+    assert page_cache.hits == 1
@@ -0,0 +1,187 @@
+"""Tests for the CorpusIndex class."""
+
+import os
+import shutil
+from unittest.mock import patch
+
+import pytest
+from langchain.embeddings.fake import FakeEmbeddings
+
+from paperplumber.parsing.batch_embedding import BatchEmbedder
+from paperplumber.parsing.corpus_index import (
+    CorpusIndex,
+    HybridCorpusIndex,
+    LexicalCorpusIndex,
+)
+from paperplumber.parsing.local_embedding import HashingEmbeddings
+
+TESTS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def pdf_paths(tmp_path):
+    paths = []
+    for name in ("maxwell2005.pdf", "plaxco1997.pdf"):
+        paths.append(str(tmp_path / name))
+        shutil.copy(os.path.join(TESTS_DIRECTORY, name), paths[-1])
+    return paths
+
+
+def test_update_is_incremental(tmp_path, pdf_paths):
+    directory = str(tmp_path / "corpus")
+    corpus_index = CorpusIndex(directory, embedder=FakeEmbeddings(size=16))
+    assert corpus_index.update(pdf_paths[:1]) == ["maxwell2005.pdf"]
+    assert corpus_index.pending(pdf_paths) == ["plaxco1997.pdf"]
+    assert corpus_index.update(pdf_paths) == ["plaxco1997.pdf"]
+    assert corpus_index.pending(pdf_paths) == []
+    size = len(corpus_index)
+
+    # The saved index is loaded back and nothing is embedded again
+    with patch.object(FakeEmbeddings, "embed_documents", side_effect=AssertionError):
+        reloaded_index = CorpusIndex(directory, embedder=FakeEmbeddings(size=16))
+        assert reloaded_index.update(pdf_paths) == []
+    assert len(reloaded_index) == size
+    assert reloaded_index.papers == ["maxwell2005.pdf", "plaxco1997.pdf"]
+
+    # Papers whose pdf is gone are dropped
+    reloaded_index.update(pdf_paths[1:])
+    assert reloaded_index.papers == ["plaxco1997.pdf"]
+    assert 0 < len(reloaded_index) < size
+
+
+def test_search(tmp_path, pdf_paths):
+    corpus_index = CorpusIndex(str(tmp_path / "corpus"), embedder=FakeEmbeddings(size=16))
+    corpus_index.update(pdf_paths)
+
+    assert len(corpus_index.similarity_search("folding rate", k=3)) == 3
+
+    pages = corpus_index.similarity_search("folding rate", k=2, paper="plaxco1997.pdf")
+    assert len(pages) == 2
+    assert all(page.metadata["paper"] == "plaxco1997.pdf" for page in pages)
+
+    pages_by_paper = corpus_index.search_per_paper("folding rate", k=2)
+    assert sorted(pages_by_paper) == ["maxwell2005.pdf", "plaxco1997.pdf"]
+    for name, pages in pages_by_paper.items():
+        assert len(pages) == 2
+        assert all(page.metadata["paper"] == name for page in pages)
+
+
+def test_lexical_corpus_index(tmp_path, pdf_paths):
+    directory = str(tmp_path / "corpus_lexical")
+    corpus_index = LexicalCorpusIndex(directory)
+    assert corpus_index.update(pdf_paths) == ["maxwell2005.pdf", "plaxco1997.pdf"]
+    size = len(corpus_index)
+
+    reloaded_index = LexicalCorpusIndex(directory)
+    assert reloaded_index.update(pdf_paths) == []
+    assert len(reloaded_index) == size
+    pages = reloaded_index.similarity_search("proline isomerization", k=2)
+    assert [page.metadata["paper"] for page in pages] == ["plaxco1997.pdf"] * 2
+
+    reloaded_index.update(pdf_paths[1:])
+    assert reloaded_index.papers == ["plaxco1997.pdf"]
+    assert 0 < len(reloaded_index) < size
+
+
+def test_hybrid_corpus_index(tmp_path, pdf_paths):
+    corpus_index = HybridCorpusIndex(
+        CorpusIndex(str(tmp_path / "corpus"), embedder=FakeEmbeddings(size=16)),
+        LexicalCorpusIndex(str(tmp_path / "corpus_lexical")),
+    )
+    assert corpus_index.update(pdf_paths) == ["maxwell2005.pdf", "plaxco1997.pdf"]
+
+    pages_by_paper = corpus_index.search_per_paper("proline isomerization", k=2)
+    assert sorted(pages_by_paper) == ["maxwell2005.pdf", "plaxco1997.pdf"]
+    for name, pages in pages_by_paper.items():
+        assert len(pages) == 2
+        assert all(page.metadata["paper"] == name for page in pages)
+    assert len(corpus_index.similarity_search("proline isomerization", k=3)) == 3
+
+
+@pytest.mark.parametrize("kind", ["dense", "lexical", "hybrid"])
+def test_corrupt_pdf_is_skipped(tmp_path, pdf_paths, kind):
+    corrupt_path = str(tmp_path / "corrupt.pdf")
+    with open(corrupt_path, "wb") as file:
+        file.write(b"%PDF-1.4 not really a pdf")
+
+    dense = CorpusIndex(str(tmp_path / "corpus"), embedder=FakeEmbeddings(size=16))
+    lexical = LexicalCorpusIndex(str(tmp_path / "corpus_lexical"))
+    corpus_index = {
+        "dense": dense,
+        "lexical": lexical,
+        "hybrid": HybridCorpusIndex(dense, lexical),
+    }[kind]
+
+    # The readable pdfs are indexed and searched as if the corrupt one was not there
+    assert corpus_index.update([corrupt_path] + pdf_paths) == [
+        "maxwell2005.pdf",
+        "plaxco1997.pdf",
+    ]
+    assert corpus_index.papers == ["maxwell2005.pdf", "plaxco1997.pdf"]
+    assert sorted(corpus_index.search_per_paper("folding rate", k=2)) == [
+        "maxwell2005.pdf",
+        "plaxco1997.pdf",
+    ]
+
+    # A pdf indexed before it got corrupted is dropped
+    shutil.copy(corrupt_path, pdf_paths[0])
+    assert corpus_index.update([corrupt_path] + pdf_paths) == []
+    assert corpus_index.papers == ["plaxco1997.pdf"]
+
+
+class FailingEmbeddings(FakeEmbeddings):
+    """Fake embeddings failing on the pages of maxwell2005.pdf."""
+
+    def embed_documents(self, texts):
+        if any("Maxwell" in text for text in texts):
+            raise ValueError("The embedding request failed")
+        return super().embed_documents(texts)
+
+
+@pytest.mark.parametrize("batched", [False, True])
+def test_embedding_error_is_skipped(tmp_path, pdf_paths, batched):
+    embedder = FailingEmbeddings(size=16)
+    corpus_index = CorpusIndex(str(tmp_path / "corpus"), embedder=embedder)
+    batch_embedder = BatchEmbedder(embedder) if batched else None
+
+    # The pdf that cannot be embedded is left out, even when it is batched with the others
+    assert corpus_index.update(pdf_paths, batch_embedder=batch_embedder) == [
+        "plaxco1997.pdf"
+    ]
+    assert corpus_index.papers == ["plaxco1997.pdf"]
+    assert list(corpus_index.errors) == ["maxwell2005.pdf"]
+    assert corpus_index.pending(pdf_paths) == ["maxwell2005.pdf"]
+
+    assert corpus_index.update(pdf_paths[1:]) == []
+    assert corpus_index.errors == {}
+
+
+@pytest.mark.parametrize("kind", ["dense", "lexical"])
+def test_search_per_paper_ranks_only_what_it_needs(tmp_path, pdf_paths, kind):
+    if kind == "dense":
+        # The fake embeddings are random, the hashing ones rank the pages the same every time
+        corpus_index = CorpusIndex(str(tmp_path / "corpus"), embedder=HashingEmbeddings())
+    else:
+        corpus_index = LexicalCorpusIndex(str(tmp_path / "corpus_lexical"))
+    corpus_index.update(pdf_paths)
+
+    fetched = []
+    search = corpus_index._search
+
+    def recording_search(question, k, paper=None):
+        fetched.append(k)
+        return search(question, k, paper)
+
+    with patch.object(corpus_index, "_search", recording_search):
+        pages_by_paper = corpus_index.search_per_paper(
+            "folding rate", k=2, papers=["plaxco1997.pdf", "missing.pdf"]
+        )
+
+    # Only the papers asked for are returned, with the same pages as a search within them
+    assert list(pages_by_paper) == ["plaxco1997.pdf"]
+    expected = search("folding rate", None, "plaxco1997.pdf")[:2]
+    assert [page.page_content for page in pages_by_paper["plaxco1997.pdf"]] == [
+        page.page_content for page in expected
+    ]
+    # The first search ranks k pages per paper, not the whole corpus
+    assert fetched[0] == 2 < len(corpus_index)
@@ -1,8 +1,13 @@
 import os
+from unittest.mock import patch
+from paperplumber.cache import DiskCache
+from paperplumber.parsing.batch_embedding import BatchEmbedder
 from paperplumber.parsing.embedding_search import EmbeddingSearcher
+from paperplumber.parsing.local_embedding import HashingEmbeddings
 from langchain.document_loaders import PyPDFium2Loader
 from langchain.vectorstores import FAISS
 from langchain.embeddings.openai import OpenAIEmbeddings
+from langchain.embeddings.fake import FakeEmbeddings
 
 
 class TestEmbeddingSearcher:
@@ -10,7 +15,9 @@ class TestEmbeddingSearcher:
         current_file_path = os.path.abspath(__file__)
         current_directory = os.path.dirname(current_file_path)
         self.pdf_path = os.path.join(current_directory, "maxwell2005.pdf")
-        self.doc_embeddings = EmbeddingSearcher(self.pdf_path)
+        self.doc_embeddings = EmbeddingSearcher(
+            self.pdf_path, embedder=HashingEmbeddings()
+        )
 
     def test_initialization(self):
         assert (
@@ -27,3 +34,37 @@ class TestEmbeddingSearcher:
         # assuming results are list of strings
         assert isinstance(results, list), "Results should be a list"
         assert len(results) == 2, "Results length should match the k value"
+
+
+def test_index_cache(tmp_path):
+    pdf_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "maxwell2005.pdf")
+    embedder = FakeEmbeddings(size=16)
+    index_cache = DiskCache(str(tmp_path / "embeddings"))
+    searcher = EmbeddingSearcher(pdf_path, index_cache=index_cache, embedder=embedder)
+    assert searcher.needs_embedding
+    searcher.similarity_search("Maxwell equations", k=2)
+
+    # A cached document must not be embedded again
+    with patch.object(FakeEmbeddings, "embed_documents", side_effect=AssertionError):
+        cached_searcher = EmbeddingSearcher(
+            pdf_path, index_cache=index_cache, embedder=embedder
+        )
+        results = cached_searcher.similarity_search("Maxwell equations", k=2)
+
+    assert index_cache.hits == 1
+    assert len(results) == 2
+    assert cached_searcher._faiss_index.index.ntotal == len(searcher.pages)
+
+
+def test_embed_all():
+    pdf_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "maxwell2005.pdf")
+    embedder = FakeEmbeddings(size=16)
+    searchers = [EmbeddingSearcher(pdf_path, embedder=embedder) for _ in range(3)]
+    batch_embedder = BatchEmbedder(embedder, token_counter=lambda text: 1)
+
+    EmbeddingSearcher.embed_all(searchers, batch_embedder)
+
+    # The pages of all the documents fit in a single request
+    assert batch_embedder.requests == 1
+    assert not any(searcher.needs_embedding for searcher in searchers)
+    assert len(searchers[0].similarity_search("Maxwell equations", k=2)) == 2
@@ -0,0 +1,286 @@
+"""Tests for the extraction of values from many papers."""
+
+import os
+import shutil
+from dataclasses import replace
+from unittest.mock import patch
+
+import pytest
+from langchain.embeddings.fake import FakeEmbeddings
+
+from paperplumber import instrumentation
+from paperplumber.parsing.budget import BudgetSettings
+from paperplumber.parsing.extraction import (
+    Retrieval,
+    estimate_papers,
+    extract_papers,
+    extract_papers_pipelined,
+)
+from paperplumber.parsing.llm_backend import LLMBackend, LLMSettings
+from paperplumber.parsing.options import EmbeddingBackend
+from paperplumber.parsing.page_selection import PageSelection
+from paperplumber.parsing.settings import (
+    CacheSettings,
+    ParseSettings,
+    ReadingSettings,
+    SearchSettings,
+)
+
+TESTS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+class FakeModel:
+    """A local model answering with the first word of the text."""
+
+    def __init__(self, **kwargs):
+        pass
+
+    def __call__(self, prompt):
+        return "NA" if "Maxwell" in prompt else prompt.split("Text: ")[-1].split()[0]
+
+
+@pytest.fixture
+def pdf_paths(tmp_path):
+    paths = {}
+    for name in ("maxwell2005.pdf", "plaxco1997.pdf", "robinson1996.pdf"):
+        paths[name] = str(tmp_path / name)
+        shutil.copy(os.path.join(TESTS_DIRECTORY, name), paths[name])
+    paths["broken.pdf"] = str(tmp_path / "broken.pdf")
+    with open(paths["broken.pdf"], "w", encoding="utf-8") as file:
+        file.write("This is not a pdf")
+    return paths
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_extract_papers(tmp_path, pdf_paths, workers):
+    settings = ParseSettings(
+        targets=["rate"],
+        search=SearchSettings(enabled=False),
+        cache=CacheSettings(path=str(tmp_path / ".cache")),
+    )
+    with patch("paperplumber.parsing.llmreader.OpenAI", FakeModel):
+        result = extract_papers(pdf_paths, settings, workers=workers)
+
+    # The broken pdf does not prevent the others from being parsed
+    assert list(result.errors) == ["broken.pdf"]
+    assert list(result.values) == ["maxwell2005.pdf", "plaxco1997.pdf", "robinson1996.pdf"]
+    assert all(list(values) == ["rate"] for values in result.values.values())
+    assert result.stats["llm_cache_misses"] > 0
+
+
+def test_results_are_deterministic(tmp_path, pdf_paths):
+    del pdf_paths["broken.pdf"]
+    settings = ParseSettings(targets=["rate"], search=SearchSettings(enabled=False))
+    with patch("paperplumber.parsing.llmreader.OpenAI", FakeModel):
+        sequential = extract_papers(pdf_paths, settings, workers=1)
+        parallel = extract_papers(pdf_paths, settings, workers=3)
+    assert list(parallel.values.items()) == list(sequential.values.items())
+
+
+@pytest.mark.parametrize("load_workers", [1, 2])
+def test_extract_papers_pipelined(tmp_path, pdf_paths, load_workers):
+    settings = ParseSettings(
+        targets=["rate"],
+        search=SearchSettings(enabled=False),
+        cache=CacheSettings(path=str(tmp_path / ".cache")),
+    )
+    with patch("paperplumber.parsing.llmreader.OpenAI", FakeModel):
+        sequential = extract_papers(dict(pdf_paths), settings)
+        pipelined = extract_papers_pipelined(
+            pdf_paths, settings, load_workers=load_workers, scan_workers=2, queue_size=1
+        )
+
+    assert list(pipelined.errors) == ["broken.pdf"]
+    assert list(pipelined.values.items()) == list(sequential.values.items())
+    assert list(pipelined.stage_stats) == ["load", "embed", "scan"]
+    assert pipelined.stage_stats["load"]["processed"] == 4
+    assert pipelined.stage_stats["load"]["failed"] == 1
+    assert pipelined.stage_stats["scan"]["processed"] == 3
+
+
+def test_pipelined_embed_stage(tmp_path, pdf_paths):
+    del pdf_paths["broken.pdf"]
+    settings = ParseSettings(
+        targets=["rate", "temperature"],
+        cache=CacheSettings(path=str(tmp_path / ".cache")),
+    )
+    with patch("paperplumber.parsing.llmreader.OpenAI", FakeModel), patch(
+        "paperplumber.parsing.extraction.default_embedder",
+        lambda backend: FakeEmbeddings(size=32),
+    ), patch(
+        "paperplumber.parsing.batch_embedding.count_tokens",
+        lambda text, model_name=None: len(text.split()),
+    ):
+        result = extract_papers_pipelined(pdf_paths, settings, scan_workers=2)
+
+    assert not result.errors
+    assert list(result.values) == sorted(pdf_paths)
+    assert all(list(values) == ["rate", "temperature"] for values in result.values.values())
+    assert result.stage_stats["embed"]["processed"] == 3
+
+
+def test_lexical_retrieval_needs_no_embedder(pdf_paths):
+    del pdf_paths["broken.pdf"]
+    settings = ParseSettings(
+        targets=["rate"], search=SearchSettings(retrieval=Retrieval.LEXICAL)
+    )
+    with patch("paperplumber.parsing.llmreader.OpenAI", FakeModel), patch(
+        "paperplumber.parsing.extraction.default_embedder", side_effect=AssertionError
+    ):
+        result = extract_papers(pdf_paths, settings)
+        pipelined = extract_papers_pipelined(pdf_paths, settings)
+
+    assert not result.errors
+    assert list(result.values) == sorted(pdf_paths)
+    assert pipelined.values == result.values
+    assert settings.result_settings()["retrieval"] == "lexical"
+
+
+def test_early_stopping_is_accounted(pdf_paths):
+    del pdf_paths["broken.pdf"]
+    settings = ParseSettings(
+        targets=["rate"],
+        search=SearchSettings(enabled=False),
+        reading=ReadingSettings(max_calls=2),
+    )
+    with patch("paperplumber.parsing.llmreader.OpenAI", FakeModel):
+        capped = extract_papers(pdf_paths, settings)
+        full = extract_papers(pdf_paths, replace(settings, reading=ReadingSettings()))
+
+    assert capped.stats["llm_calls"] == 2 * len(pdf_paths)
+    assert capped.stats["call_cap_skipped_calls"] == (
+        full.stats["llm_calls"] - capped.stats["llm_calls"]
+    )
+    assert full.stats["call_cap_skipped_calls"] == 0
+
+
+def test_adaptive_page_selection(pdf_paths):
+    del pdf_paths["broken.pdf"]
+    search = SearchSettings(
+        retrieval=Retrieval.LEXICAL, selection=PageSelection(min_k=4, max_k=4)
+    )
+    settings = ParseSettings(targets=["rate"], search=search)
+    adaptive_search = replace(
+        search, selection=PageSelection(min_k=1, max_k=4, relative_drop=0.0)
+    )
+    with patch("paperplumber.parsing.llmreader.OpenAI", FakeModel):
+        fixed = extract_papers(pdf_paths, settings)
+        adaptive = extract_papers(pdf_paths, replace(settings, search=adaptive_search))
+
+    # Only the best page of every paper, and the pages tied with it, are read
+    assert fixed.stats["llm_calls"] == 4 * len(pdf_paths)
+    assert len(pdf_paths) <= adaptive.stats["llm_calls"] < fixed.stats["llm_calls"]
+    assert settings.result_settings()["page_selection"]["max_k"] == 4
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_results_are_streamed(pdf_paths, workers):
+    settings = ParseSettings(targets=["rate"], search=SearchSettings(enabled=False))
+    streamed = {}
+    with patch("paperplumber.parsing.llmreader.OpenAI", FakeModel):
+        result = extract_papers(
+            pdf_paths, settings, workers=workers, on_result=streamed.__setitem__
+        )
+        pipelined = {}
+        extract_papers_pipelined(pdf_paths, settings, on_result=pipelined.__setitem__)
+
+    # The values are given to the callback instead of being kept in the result
+    assert not result.values
+    assert list(result.errors) == ["broken.pdf"]
+    assert sorted(streamed) == ["maxwell2005.pdf", "plaxco1997.pdf", "robinson1996.pdf"]
+    assert pipelined == streamed
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_instrumented_extraction(pdf_paths, workers):
+    settings = ParseSettings(
+        targets=["rate", "temperature"],
+        search=SearchSettings(embedding=EmbeddingBackend.HASHING),
+        reading=ReadingSettings(llm=LLMSettings(backend=LLMBackend.FAKE)),
+        instrument=True,
+    )
+    instruments = instrumentation.enable()
+    try:
+        result = extract_papers(pdf_paths, settings, workers=workers)
+    finally:
+        instrumentation.disable()
+
+    snapshot = instruments.snapshot()
+    assert set(snapshot["stages"]) == {"extract", "embed", "search", "llm"}
+    assert snapshot["counters"]["llm_requests"] == result.stats["llm_calls"]
+    assert snapshot["counters"]["prompt_tokens"] > 0
+    # The broken pdf is timed too, until it fails
+    assert set(snapshot["papers"]) == set(pdf_paths)
+    for name in result.values:
+        assert set(snapshot["papers"][name]["seconds"]) == {"extract", "search", "llm"}
+
+
+@pytest.mark.parametrize("engine", ["serial", "workers", "pipelined"])
+def test_token_budget_stops_the_run(pdf_paths, engine):
+    del pdf_paths["broken.pdf"]
+    settings = ParseSettings(
+        targets=["rate"],
+        search=SearchSettings(embedding=EmbeddingBackend.HASHING),
+        reading=ReadingSettings(llm=LLMSettings(backend=LLMBackend.FAKE)),
+        budget=BudgetSettings(hard=1),
+    )
+    if engine == "pipelined":
+        result = extract_papers_pipelined(pdf_paths, settings)
+    else:
+        result = extract_papers(
+            pdf_paths, settings, workers=2 if engine == "workers" else 1, group_size=1
+        )
+
+    # No paper could be read, so every one is left for the next run instead of failing
+    assert "token budget" in result.stopped
+    assert result.skipped == sorted(pdf_paths)
+    assert not result.values and not result.errors
+
+
+def test_token_budget_keeps_the_papers_parsed(pdf_paths):
+    settings = ParseSettings(
+        targets=["rate"],
+        search=SearchSettings(enabled=False),
+        reading=ReadingSettings(llm=LLMSettings(backend=LLMBackend.FAKE)),
+    )
+    first_paper = extract_papers(
+        {"maxwell2005.pdf": pdf_paths["maxwell2005.pdf"]},
+        replace(settings, budget=BudgetSettings(hard=10**9)),
+    )
+    paper_tokens = first_paper.stats["llm_tokens"]
+
+    result = extract_papers(
+        pdf_paths,
+        replace(settings, budget=BudgetSettings(hard=paper_tokens + 1)),
+        group_size=2,
+    )
+    assert list(result.values) == ["maxwell2005.pdf"]
+    assert list(result.errors) == ["broken.pdf"]
+    assert result.skipped == ["plaxco1997.pdf", "robinson1996.pdf"]
+    assert result.stats["llm_tokens"] == paper_tokens
+
+
+def test_estimate_papers(pdf_paths):
+    settings = ParseSettings(
+        targets=["rate", "temperature"],
+        search=SearchSettings(embedding=EmbeddingBackend.HASHING),
+        reading=ReadingSettings(llm=LLMSettings(backend=LLMBackend.FAKE)),
+    )
+    with patch("paperplumber.parsing.llm_backend.FakeLLM.respond") as respond:
+        estimate = estimate_papers(pdf_paths, settings)
+    respond.assert_not_called()
+
+    # The broken pdf is left out, and at most 2 pages are read for each target
+    assert estimate.papers == 3
+    assert 3 <= estimate.prompts <= 3 * 4
+    assert estimate.prompt_tokens > 0 and estimate.embedding_tokens > 0
+
+    capped = estimate_papers(
+        pdf_paths,
+        replace(
+            settings,
+            search=SearchSettings(enabled=False),
+            reading=replace(settings.reading, max_calls=1),
+        ),
+    )
+    assert capped.prompts == 3 and capped.embedding_tokens == 0
@@ -0,0 +1,245 @@
+"""Tests for the FileScanner class."""
+
+import asyncio
+import json
+import os
+from unittest.mock import MagicMock, patch
+
+from langchain.docstore.document import Document
+
+from paperplumber.parsing.file_scan import EarlyStop, FileScanner
+from paperplumber.parsing.prefilter import PreFilter
+
+
+class FakeModel:
+    """A local model answering from a table of values, recording its prompts."""
+
+    active = 0
+    max_active = 0
+
+    def __init__(self, **kwargs):
+        self.prompts = []
+
+    def __call__(self, prompt):
+        self.prompts.append(prompt)
+        text = prompt.split("Text: ")[-1]
+        if text.startswith("fail"):
+            raise RuntimeError("The model failed")
+        if "Targets:" in prompt.split("Text: ")[-2]:
+            return '{"rate": "%s", "time": "NA"}' % text.split()[0]
+        return text.split()[0]
+
+    async def agenerate(self, prompts):
+        FakeModel.active += 1
+        FakeModel.max_active = max(FakeModel.max_active, FakeModel.active)
+        try:
+            await asyncio.sleep(0.01)
+            text = self(prompts[0])
+        finally:
+            FakeModel.active -= 1
+        return MagicMock(generations=[[MagicMock(text=text)]])
+
+
+def make_pages(*texts):
+    return [Document(page_content=text, metadata={}) for text in texts]
+
+
+def test_scan_targets_shares_pages():
+    pages = make_pages("1 a", "2 b", "NA c")
+    scanner = FileScanner.from_pages(pages)
+    models = []
+
+    def make_model(**kwargs):
+        models.append(FakeModel())
+        return models[-1]
+
+    with patch("paperplumber.parsing.llmreader.OpenAI", make_model):
+        values = scanner.scan_targets(
+            ["rate", "time"], {"rate": pages[:2], "time": pages[1:]}
+        )
+
+    # The page relevant to both targets is read with a single prompt
+    assert sum(len(model.prompts) for model in models) == 3
+    assert sorted(values["rate"]) == ["1", "2"]
+    assert values["time"] == []
+
+
+def test_scan():
+    scanner = FileScanner.from_pages(make_pages("1 a", "NA b", "1 c"))
+    with patch("paperplumber.parsing.llmreader.OpenAI", FakeModel):
+        assert scanner.scan("rate") == ["1"]
+
+
+def test_concurrent_scan():
+    pages = make_pages(*(f"{i} page" for i in range(10)), "fail page")
+    scanner = FileScanner.from_pages(pages)
+    FakeModel.max_active = 0
+    with patch("paperplumber.parsing.llmreader.OpenAI", FakeModel):
+        values = scanner.scan("rate", concurrency=3)
+
+    assert sorted(values, key=int) == [str(i) for i in range(10)]
+    assert 1 < FakeModel.max_active <= 3
+
+    # The failing page is recorded instead of aborting the scan
+    assert len(scanner.failures) == 1
+    assert scanner.failures[0][0] == 10
+    assert isinstance(scanner.failures[0][1], RuntimeError)
+
+
+def test_concurrent_scan_reports_page_numbers():
+    pages = [
+        Document(page_content=text, metadata={"page": number})
+        for number, text in [(3, "1 page"), (7, "fail page"), (9, "2 page")]
+    ]
+    scanner = FileScanner.from_pages(pages)
+    with patch("paperplumber.parsing.llmreader.OpenAI", FakeModel):
+        values = scanner.scan_targets(["rate"], {"rate": pages[::-1]}, concurrency=2)
+
+    assert values == {"rate": ["2", "1"]}
+    assert [number for number, _ in scanner.failures] == [7]
+
+
+class UnparsableModel(FakeModel):
+    """A local model whose answers to multi-target prompts are not JSON."""
+
+    def __call__(self, prompt):
+        if "Targets:" in prompt.split("Text: ")[-2]:
+            self.prompts.append(prompt)
+            return "I do not know"
+        return super().__call__(prompt)
+
+
+def test_scan_counts_the_retries():
+    pages = make_pages("1 rate time")
+    models = []
+
+    def make_model(**kwargs):
+        models.append(UnparsableModel())
+        return models[-1]
+
+    for concurrency in [None, 2]:
+        models.clear()
+        scanner = FileScanner.from_pages(pages)
+        with patch("paperplumber.parsing.llmreader.OpenAI", make_model):
+            values = scanner.scan_targets(["rate", "time"], concurrency=concurrency)
+
+        # The targets are read one by one after the multi-target answer
+        assert values == {"rate": ["1"], "time": ["1"]}
+        assert sum(len(model.prompts) for model in models) == 3
+        assert scanner.calls == 3
+
+
+def test_scan_targets_with_prefilter():
+    pages = make_pages("1 rate of 3 s-1", "2 nothing", "3 time is 4 ms", "4 other")
+    scanner = FileScanner.from_pages(pages)
+    models = []
+
+    def make_model(**kwargs):
+        models.append(FakeModel())
+        return models[-1]
+
+    with patch("paperplumber.parsing.llmreader.OpenAI", make_model):
+        values = scanner.scan_targets(["rate", "time"], prefilter=PreFilter())
+
+    # Only the pages mentioning a target are read
+    assert sum(len(model.prompts) for model in models) == 2
+    assert scanner.saved_calls == 2
+    assert values == {"rate": ["1"], "time": ["3"]}
+
+
+class PackedModel(FakeModel):
+    """A local model answering packed prompts with the first word of every chunk."""
+
+    def __call__(self, prompt):
+        self.prompts.append(prompt)
+        chunks = prompt.split("Chunk 2: Chocolate is delicious")[-1].split("Chunk ")[1:]
+        answers = {}
+        for chunk in chunks:
+            number, text = chunk.split(": ", 1)
+            answers[number] = {"rate": text.split()[0], "time": "NA"}
+        return json.dumps(answers)
+
+
+def test_scan_targets_packs_pages():
+    pages = make_pages(*(f"{i} page" for i in range(6)))
+    scanner = FileScanner.from_pages(pages)
+    models = []
+
+    def make_model(**kwargs):
+        models.append(PackedModel())
+        return models[-1]
+
+    with patch("paperplumber.parsing.llmreader.OpenAI", make_model), patch(
+        "paperplumber.parsing.llmreader.count_tokens",
+        lambda text, model_name=None: len(text.split()),
+    ):
+        values = scanner.scan_targets(["rate", "time"], pack_tokens=1000)
+        concurrent_values = scanner.scan_targets(
+            ["rate", "time"], pack_tokens=1000, concurrency=2
+        )
+
+    # All the pages fit in a single prompt, in both scans
+    assert sum(len(model.prompts) for model in models) == 2
+    assert values == {"rate": [str(i) for i in range(6)], "time": []}
+    assert concurrent_values == values
+
+
+def test_scan_stops_once_values_are_consistent():
+    pages = make_pages("7 other", "1 rate rate", "1 rate rate here", "2 rate", "3 rate")
+    models = []
+
+    def make_model(**kwargs):
+        models.append(FakeModel())
+        return models[-1]
+
+    scanner = FileScanner.from_pages(pages)
+    with patch("paperplumber.parsing.llmreader.OpenAI", make_model):
+        values = scanner.scan("rate", early_stop=EarlyStop(consistent_values=2))
+
+    # The pages mentioning the target are read first, until 1 is found twice
+    assert values == ["1"]
+    assert scanner.calls == 2
+    assert scanner.skipped_calls == {"early_stop": 3, "call_cap": 0}
+
+    # The pages given for a target are read in their order, in waves
+    scanner = FileScanner.from_pages(pages)
+    with patch("paperplumber.parsing.llmreader.OpenAI", make_model):
+        values = scanner.scan_targets(
+            ["rate"],
+            {"rate": pages[::-1]},
+            concurrency=2,
+            early_stop=EarlyStop(consistent_values=1),
+        )
+    assert values == {"rate": ["3", "2"]}
+    assert scanner.skipped_calls["early_stop"] == 3
+
+
+def test_scan_caps_the_calls():
+    pages = make_pages("1 rate", "2 time", "3 rate time")
+    scanner = FileScanner.from_pages(pages)
+    models = []
+
+    def make_model(**kwargs):
+        models.append(FakeModel())
+        return models[-1]
+
+    with patch("paperplumber.parsing.llmreader.OpenAI", make_model):
+        values = scanner.scan_targets(["rate", "time"], early_stop=EarlyStop(max_calls=2))
+
+    assert sum(len(model.prompts) for model in models) == 2
+    assert scanner.calls == 2
+    assert scanner.skipped_calls == {"early_stop": 0, "call_cap": 1}
+    # The best page of every target is read first, and the fake model gives its value for rate
+    assert values == {"rate": ["1", "2"], "time": []}
+
+
+def test_lazy_scan_streams_pages():
+    pdf_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plaxco1997.pdf")
+    scanner = FileScanner(pdf_path, lazy=True)
+    with patch("paperplumber.parsing.llmreader.OpenAI", FakeModel):
+        values = scanner.scan_targets(["rate"], concurrency=2)
+
+    # Every page is read without the document ever being held in memory
+    assert scanner._page_list is None
+    assert scanner.calls == len(scanner.pages)
+    assert values["rate"]
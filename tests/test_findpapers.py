@@ -1,4 +1,5 @@
 import os
+import shutil
 import pytest
 import json
 from unittest.mock import patch, MagicMock
@@ -24,7 +25,8 @@ class TestFindPapersDatabase:
             os.remove(self.json_file)
 
         if os.path.exists(self.path):
-            os.rmdir(self.path)
+            # The index of the papers is kept in the cache directory of the database
+            shutil.rmtree(self.path)
 
     def test_create_directory(self):
         findpapers_db = FindPapersDatabase(self.path)
@@ -34,16 +36,6 @@ class TestFindPapersDatabase:
         findpapers_db = FindPapersDatabase(self.path)
         assert findpapers_db._get_json_path() == self.json_file
 
-    def test_load_json(self):
-        data = {"papers": [{"title": "paper1"}, {"title": "paper2"}]}
-        with open(self.json_file, "w") as f:
-            json.dump(data, f)
-
-        findpapers_db = FindPapersDatabase(self.path)
-        findpapers_db._load_json()
-
-        assert findpapers_db._loaded_info == data
-
     def test_list_available_papers(self):
         data = {"papers": [{"title": "paper1"}, {"title": "paper2"}]}
         with open(self.json_file, "w") as f:
@@ -0,0 +1,76 @@
+"""Tests for the startup time of the command line, which must not import the heavy dependencies."""
+
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+TESTS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# The packages taking seconds to import, which only the commands using them may import
+HEAVY_PACKAGES = {
+    "langchain",
+    "langchain_core",
+    "langchain_community",
+    "faiss",
+    "openai",
+    "findpapers",
+    "tiktoken",
+    "pypdfium2",
+}
+
+# The max seconds spent importing modules, far above the 0.2 seconds it takes on a laptop
+IMPORT_BUDGET_SECONDS = 1.0
+
+
+def _import_times(code: str) -> dict:
+    """Runs Python code with -X importtime, and returns the cumulative seconds of every module imported."""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=os.path.dirname(TESTS_DIRECTORY),
+    )
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # The modules imported at the top level are not indented
+        times[name[1:]] = int(cumulative) / 1e6
+    return times
+
+
+@pytest.mark.parametrize("args", [None, ["version"], ["list"]])
+def test_cli_startup_skips_heavy_imports(args, tmp_path):
+    if args == ["list"]:
+        # Listing writes the index of the papers to the database, so a copy of it is listed
+        shutil.copy(os.path.join(TESTS_DIRECTORY, "test_db", "papers.json"), tmp_path)
+        args = ["list", str(tmp_path)]
+    code = "import paperplumber.main"
+    if args is not None:
+        code += f"; paperplumber.main.app({args!r}, standalone_mode=False)"
+    times = _import_times(code)
+
+    heavy = {name for name in times if name.strip().split(".")[0] in HEAVY_PACKAGES}
+    assert not heavy
+    top_level = sum(seconds for name, seconds in times.items() if not name.startswith(" "))
+    assert top_level < IMPORT_BUDGET_SECONDS, sorted(
+        times.items(), key=lambda item: -item[1]
+    )[:10]
+
+
+def test_download_without_index_skips_the_embedding_imports(tmp_path):
+    # findpapers itself is heavy, so its download is replaced by a no-op
+    code = (
+        "import paperplumber.main"
+        "\nfrom paperplumber.database.findpapers_integration import FindPapersDatabase"
+        "\nFindPapersDatabase.download = property(lambda self: lambda **kwargs: [])"
+        f"\npaperplumber.main.app(['download', {str(tmp_path)!r}], standalone_mode=False)"
+    )
+    times = _import_times(code)
+
+    assert not {name for name in times if name.strip().split(".")[0] in HEAVY_PACKAGES}
@@ -0,0 +1,116 @@
+"""Tests for the timings and counters of a run."""
+
+import asyncio
+import logging
+import time
+
+import pytest
+
+from paperplumber import instrumentation
+
+
+@pytest.fixture
+def instruments():
+    yield instrumentation.enable()
+    instrumentation.disable()
+
+
+def test_disabled_instrumentation_collects_nothing():
+    instrumentation.disable()
+
+    with instrumentation.paper("a.pdf"), instrumentation.timed("llm"):
+        instrumentation.count("llm_requests")
+
+    assert instrumentation.active() is None
+    assert instrumentation.timed("llm") is instrumentation.timed("extract")
+
+
+def test_nested_stages_are_timed_apart(instruments):
+    with instrumentation.paper("a.pdf"):
+        with instrumentation.timed("search"):
+            with instrumentation.timed("embed"):
+                time.sleep(0.05)
+        instrumentation.count("llm_requests", 2)
+    instrumentation.count("llm_requests")
+
+    snapshot = instruments.snapshot()
+    assert snapshot["stages"]["embed"]["seconds"] >= 0.05
+    assert snapshot["stages"]["search"]["seconds"] < 0.05
+    assert snapshot["stages"]["search"]["calls"] == 1
+    assert snapshot["counters"] == {"llm_requests": 3}
+    assert set(snapshot["papers"]["a.pdf"]["seconds"]) == {"search", "embed"}
+    assert snapshot["papers"]["a.pdf"]["counters"] == {"llm_requests": 2}
+
+
+def test_concurrent_tasks_are_attributed_to_their_paper(instruments):
+    async def read(name):
+        with instrumentation.paper(name):
+            await asyncio.sleep(0.01)
+            with instrumentation.timed("llm"):
+                await asyncio.sleep(0.05)
+
+    async def read_all():
+        await asyncio.gather(read("a.pdf"), read("b.pdf"))
+
+    asyncio.run(read_all())
+
+    snapshot = instruments.snapshot()
+    assert snapshot["stages"]["llm"]["calls"] == 2
+    # The concurrent calls add up their times
+    assert snapshot["stages"]["llm"]["seconds"] >= 0.1
+    for name in ("a.pdf", "b.pdf"):
+        assert 0.05 <= snapshot["papers"][name]["seconds"]["llm"] < 0.1
+
+
+def test_merge_adds_up_snapshots(instruments):
+    worker = instrumentation.Instruments()
+    worker.add_time("extract", 1.0, "a.pdf")
+    worker.count("llm_requests", 3, "a.pdf")
+    instruments.add_time("extract", 0.5)
+
+    instruments.merge(worker.snapshot())
+    instruments.merge(worker.snapshot())
+
+    snapshot = instruments.snapshot()
+    assert snapshot["stages"]["extract"] == {"calls": 3, "seconds": 2.5}
+    assert snapshot["counters"] == {"llm_requests": 6}
+    assert snapshot["papers"]["a.pdf"] == {
+        "seconds": {"extract": 2.0},
+        "counters": {"llm_requests": 6},
+    }
+
+
+def test_retries_are_counted(instruments):
+    logger = logging.getLogger("langchain_community.embeddings.openai")
+    logger.warning("Retrying embed_with_retry in 4.0 seconds as it raised Timeout.")
+    logging.getLogger("langchain_core.language_models.llms").warning(
+        "Retrying completion_with_retry in 4.0 seconds as it raised RateLimitError."
+    )
+    logger.warning("Something else")
+
+    assert instruments.snapshot()["counters"] == {
+        "embedding_retries": 1,
+        "llm_retries": 1,
+    }
+
+
+def test_write_prometheus(tmp_path):
+    report = {
+        "wall_seconds": 2.5,
+        "papers_parsed": 3,
+        "papers_failed": 1,
+        "stages": {"llm": {"calls": 4, "seconds": 1.5}},
+        "counters": {"llm_cache_hits": 2},
+        "papers": {"a.pdf": {}},
+    }
+    path = str(tmp_path / "paperplumber.prom")
+
+    instrumentation.write_prometheus(path, report)
+
+    with open(path, encoding="utf-8") as file:
+        lines = file.read().splitlines()
+    assert 'paperplumber_stage_seconds_total{stage="llm"} 1.500000' in lines
+    assert 'paperplumber_stage_calls_total{stage="llm"} 4' in lines
+    assert "paperplumber_llm_cache_hits_total 2" in lines
+    assert "paperplumber_papers_failed 1" in lines
+    assert not any("a.pdf" in line for line in lines)
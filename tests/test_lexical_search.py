@@ -0,0 +1,38 @@
+"""Tests for the lexical and hybrid searches of a pdf file."""
+
+import os
+from unittest.mock import patch
+
+from langchain.embeddings.fake import FakeEmbeddings
+
+from paperplumber.parsing.embedding_search import EmbeddingSearcher
+from paperplumber.parsing.lexical_search import HybridSearcher, LexicalSearcher
+
+PDF_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plaxco1997.pdf")
+
+
+def test_lexical_search_needs_no_embedder():
+    with patch(
+        "paperplumber.parsing.embedding_search.default_embedder",
+        side_effect=AssertionError,
+    ):
+        searcher = LexicalSearcher(PDF_PATH)
+        pages = searcher.similarity_search("proline isomerization", k=2)
+
+    assert not searcher.needs_embedding
+    assert len(pages) == 2
+    assert all("proline" in page.page_content.lower() for page in pages)
+
+
+def test_hybrid_search():
+    searcher = HybridSearcher(PDF_PATH, embedder=FakeEmbeddings(size=16))
+    assert searcher.needs_embedding
+    pages = searcher.similarity_search("proline isomerization", k=3)
+    assert len({page.page_content for page in pages}) == 3
+
+    # A page ranked second by both searches beats the pages ranked first by only one
+    lexical = LexicalSearcher(PDF_PATH).similarity_search("proline isomerization", k=2)
+    dense = [page for page in searcher.pages if page not in lexical][:1] + lexical[1:]
+    with patch.object(EmbeddingSearcher, "similarity_search", return_value=dense):
+        pages = searcher.similarity_search("proline isomerization", k=3)
+    assert pages == [lexical[1], dense[0], lexical[0]]
@@ -0,0 +1,71 @@
+"""Tests for the list command."""
+
+import csv
+import io
+import json
+
+import pytest
+from typer.testing import CliRunner
+
+from paperplumber import main
+
+PAPERS = [
+    {
+        "title": f"Paper {i}",
+        "publication_date": f"{2010 + i}-01-01",
+        "authors": [f"Author {i % 2}"],
+        "databases": ["arXiv"],
+    }
+    for i in range(5)
+]
+
+
+@pytest.fixture
+def path(tmp_path):
+    with open(tmp_path / "papers.json", "w", encoding="utf-8") as file:
+        json.dump({"papers": PAPERS}, file)
+    return str(tmp_path)
+
+
+def _list(*args):
+    result = CliRunner().invoke(main.app, ["list", *args])
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def test_jsonl(path):
+    output = _list(path, "--format", "jsonl", "--author", "author 1")
+    assert [json.loads(line) for line in output.splitlines()] == [PAPERS[1], PAPERS[3]]
+
+
+def test_csv(path):
+    output = _list(
+        path,
+        "-f",
+        "csv",
+        "--since",
+        "2011",
+        "--sort",
+        "date",
+        "--descending",
+        "-l",
+        "2",
+        "--offset",
+        "1",
+    )
+    rows = list(csv.DictReader(io.StringIO(output)))
+    assert [row["title"] for row in rows] == ["Paper 3", "Paper 2"]
+    assert rows[0]["authors"] == "Author 1"
+
+
+def test_table_pages(path, monkeypatch):
+    monkeypatch.setattr(main, "LIST_TABLE_ROWS", 2)
+    output = _list(path, "--until", "2013")
+    assert output.count("Title") == 1
+    assert all(f"Paper {i}" in output for i in range(4))
+    assert "Paper 4" not in output
+
+
+def test_negative_limit(path):
+    result = CliRunner().invoke(main.app, ["list", path, "--limit", "-1"])
+    assert result.exit_code == 1
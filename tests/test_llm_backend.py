@@ -0,0 +1,76 @@
+"""Tests for the choice of the language model and its local stand-in."""
+
+import asyncio
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+from langchain.docstore.document import Document
+
+from paperplumber.parsing.file_scan import FileScanner
+from paperplumber.parsing.llm_backend import FakeLLM, LLMBackend, LLMSettings
+from paperplumber.parsing.llmreader import OpenAIReader
+from paperplumber.parsing.response_cache import ResponseCache
+
+FAKE = LLMSettings(backend=LLMBackend.FAKE)
+
+
+def test_fake_model_answers_every_prompt():
+    reader = OpenAIReader("folding rate", llm=FAKE)
+    assert isinstance(reader.model, FakeLLM)
+    assert reader.read("It folds at 4.2 s-1 and 25 °C") == "4.2 s-1"
+    assert reader.read("Chocolate is delicious") == "NA"
+    assert reader.read_targets("It folds at 20 µs", ["rate", "time"]) == {
+        "rate": "20 µs",
+        "time": "20 µs",
+    }
+    assert reader.read_packed(["1 folds in 3 ms", "nothing here"], ["rate"]) == [
+        {"rate": "3 ms"},
+        {"rate": "NA"},
+    ]
+
+    fixed = OpenAIReader("rate", llm=LLMSettings(backend="fake", fake_answer="42"))
+    assert fixed.read("Chocolate is delicious") == "42"
+
+
+def test_fake_model_latency():
+    pages = [
+        Document(page_content=f"page {i} folds in {i} ms", metadata={})
+        for i in range(6)
+    ]
+    scanner = FileScanner.from_pages(pages)
+    llm = LLMSettings(backend=LLMBackend.FAKE, fake_latency=0.05)
+
+    start = time.perf_counter()
+    values = scanner.scan("rate", concurrency=6, llm=llm)
+    elapsed = time.perf_counter() - start
+
+    # The prompts sleep concurrently
+    assert sorted(values) == [f"{i} ms" for i in range(6)]
+    assert 0.05 <= elapsed < 0.05 * 6
+    assert asyncio.run(FakeLLM(latency=0.0).agenerate(["    Target: x\n    Text: 1 s"]))
+
+
+def test_openai_compatible_server(tmp_path):
+    llm = LLMSettings(
+        backend=LLMBackend.OPENAI_COMPATIBLE,
+        model_name="llama-3-8b",
+        base_url="http://localhost:8000/v1",
+        temperature=0.0,
+    )
+    model = MagicMock()
+    model.return_value.return_value = "1 s"
+    with patch("paperplumber.parsing.llmreader.OpenAI", model):
+        reader = OpenAIReader("rate", ResponseCache(str(tmp_path / "r.sqlite")), llm)
+        assert reader.read("text") == "1 s"
+
+    kwargs = model.call_args.kwargs
+    assert kwargs["openai_api_base"] == "http://localhost:8000/v1"
+    assert kwargs["model_name"] == "llama-3-8b"
+    assert kwargs["temperature"] == 0.0
+
+    # The responses of other models and parameters are cached apart
+    assert LLMSettings().cache_name() == OpenAIReader.MODEL_NAME
+    assert llm.cache_name() != LLMSettings(model_name="llama-3-8b").cache_name()
+    with pytest.raises(ValueError):
+        LLMSettings(backend=LLMBackend.OPENAI_COMPATIBLE)
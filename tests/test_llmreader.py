@@ -1,7 +1,11 @@
 """Tests for LLMReader class and utilities."""
 
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
 import pytest
 from paperplumber.parsing import OpenAIReader
+from paperplumber.parsing.response_cache import ResponseCache
 
 
 @pytest.mark.parametrize(
@@ -27,3 +31,106 @@ from paperplumber.parsing import OpenAIReader
 )
 def test_openaireader(target, text, expected):
     assert OpenAIReader(target=target).read(text) == expected
+
+
+@pytest.mark.parametrize(
+    "response, expected",
+    [
+        (
+            '{"coherence time": "10 ms", "speed of light": "NA"}',
+            {"coherence time": "10 ms", "speed of light": "NA"},
+        ),
+        (
+            ' Answer: {"coherence time": "10 ms"}\n',
+            {"coherence time": "10 ms", "speed of light": "NA"},
+        ),
+        ("10 ms", None),
+    ],
+)
+def test_parse_targets_response(response, expected):
+    with patch("paperplumber.parsing.llmreader.OpenAI"):
+        reader = OpenAIReader(target="coherence time")
+    targets = ["coherence time", "speed of light"]
+    assert reader.parse_targets_response(response, targets) == expected
+
+
+def test_read_targets_falls_back_to_single_prompts():
+    with patch("paperplumber.parsing.llmreader.OpenAI"):
+        reader = OpenAIReader(target="coherence time")
+    reader.model = MagicMock(side_effect=["not json", "10 ms", "NA"])
+    answers = reader.read_targets("text", ["coherence time", "speed of light"])
+    assert answers == {"coherence time": "10 ms", "speed of light": "NA"}
+    assert reader.model.call_count == 3
+
+
+def test_read_uses_cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    with patch("paperplumber.parsing.llmreader.OpenAI"):
+        reader = OpenAIReader(target="coherence time", cache=cache)
+    reader.model = MagicMock(return_value=" 10 ms\n")
+
+    assert reader.read("A coherence time of 10 ms") == "10 ms"
+    assert reader.read("A coherence  time of 10 ms") == "10 ms"
+    assert reader.model.call_count == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_aread():
+    with patch("paperplumber.parsing.llmreader.OpenAI"):
+        reader = OpenAIReader(target="coherence time")
+    result = MagicMock(generations=[[MagicMock(text=" 10 ms\n")]])
+    reader.model.agenerate = AsyncMock(return_value=result)
+    assert asyncio.run(reader.aread("A coherence time of 10 ms")) == "10 ms"
+
+
+def test_pack():
+    with patch("paperplumber.parsing.llmreader.OpenAI"):
+        reader = OpenAIReader(target="rate")
+    with patch(
+        "paperplumber.parsing.llmreader.count_tokens",
+        lambda text, model_name=None: len(text.split()),
+    ):
+        overhead = len(reader.packed_prompt.format(targets='["rate"]', chunks="").split())
+        # Every chunk costs its 2 words, its 2 word label and 32 tokens for its answer
+        groups = reader.pack(["a b"] * 5 + ["long " * 200], ["rate"], overhead + 3 * 36)
+
+    assert groups == [["a b"] * 3, ["a b"] * 2, ["long " * 200]]
+
+
+def test_pack_numbers_the_texts_of_every_prompt_from_1():
+    with patch("paperplumber.parsing.llmreader.OpenAI"):
+        reader = OpenAIReader(target="rate")
+
+    # Every word and every digit is a token, so that "Chunk 10:" costs more than "Chunk 1:"
+    def count_tokens(text, model_name=None):
+        return len(text.split()) + sum(map(str.isdigit, text))
+
+    with patch("paperplumber.parsing.llmreader.count_tokens", count_tokens):
+        overhead = count_tokens(reader.packed_prompt.format(targets='["rate"]', chunks=""))
+        groups = reader.pack(["a b"] * 30, ["rate"], overhead + 3 * 37)
+        assert reader.pack([], ["rate"]) == []
+
+    assert groups == [["a b"] * 3] * 10
+
+
+def test_read_packed():
+    with patch("paperplumber.parsing.llmreader.OpenAI"):
+        reader = OpenAIReader(target="rate")
+    reader.model = MagicMock(return_value='{"1": {"rate": "1 s^-1"}, "2": {"rate": "NA"}}')
+    answers = reader.read_packed(["The rate is 1 s-1", "Nothing"], ["rate"])
+
+    assert answers == [{"rate": "1 s^-1"}, {"rate": "NA"}]
+    assert reader.model.call_count == 1
+    prompt = reader.model.call_args[0][0]
+    assert "Chunk 1: The rate is 1 s-1\nChunk 2: Nothing" in prompt
+
+
+def test_read_packed_falls_back_to_single_prompts():
+    with patch("paperplumber.parsing.llmreader.OpenAI"):
+        reader = OpenAIReader(target="rate")
+    reader.model = MagicMock(side_effect=['{"1": {"rate": "1"}}', "1", "NA"])
+    answers = reader.read_packed(["The rate is 1", "Nothing"], ["rate"])
+
+    # The answer misses the second chunk, so both are read again one by one
+    assert answers == [{"rate": "1"}, {"rate": "NA"}]
+    assert reader.model.call_count == 3
@@ -0,0 +1,139 @@
+"""Tests for the PapersIndex class."""
+
+import json
+import os
+
+import pytest
+
+from paperplumber.database.local import (
+    PaperOrder,
+    PaperPage,
+    PaperQuery,
+    PapersIndex,
+    pdf_filename,
+)
+
+PAPERS = [
+    {
+        "title": "Folding rates: a study",
+        "doi": "10.1000/1",
+        "publication_date": "2018-11-27",
+        "authors": ["Ada Lovelace", "Alan Turing"],
+        "databases": ["arXiv"],
+    },
+    {
+        "title": "Coherence times",
+        "doi": "10.1000/2",
+        "publication_date": "2020-01-05",
+        "authors": ["Grace Hopper"],
+        "databases": ["IEEE", "Scopus"],
+    },
+    {"title": "Undated"},
+]
+
+
+def _write(path, papers):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump({"query": "[folding]", "papers": papers}, file)
+
+
+@pytest.fixture
+def index(tmp_path):
+    _write(tmp_path / "papers.json", PAPERS)
+    os.makedirs(tmp_path / "pdfs")
+    return PapersIndex(
+        str(tmp_path / "papers.json"),
+        str(tmp_path / ".cache" / "papers.sqlite"),
+        pdf_directory=str(tmp_path / "pdfs"),
+    )
+
+
+def test_pdf_filename():
+    assert pdf_filename(PAPERS[0]) == "2018-Folding_rates__a_study.pdf"
+    assert pdf_filename(PAPERS[2]) is None
+
+
+def test_iter_papers(index):
+    assert list(index.iter_papers()) == PAPERS
+
+
+def test_refreshed_only_on_change(index, tmp_path, monkeypatch):
+    index.refresh()
+    loads = []
+    original = PapersIndex._load
+    monkeypatch.setattr(
+        PapersIndex,
+        "_load",
+        lambda self, stamp: loads.append(stamp) or original(self, stamp),
+    )
+
+    assert list(index.iter_papers()) == PAPERS
+    assert not loads
+
+    _write(tmp_path / "papers.json", PAPERS[:1])
+    assert list(index.iter_papers()) == PAPERS[:1]
+    assert len(loads) == 1
+
+    # Another instance reuses the index
+    other = PapersIndex(index.json_path, index.path, pdf_directory=index.pdf_directory)
+    assert list(other.iter_papers()) == PAPERS[:1]
+    assert len(loads) == 1
+
+
+def test_downloaded(index, tmp_path):
+    assert not list(index.iter_papers(PaperQuery(downloaded=True)))
+    assert index.downloaded_pdfs() == []
+
+    (tmp_path / "pdfs" / pdf_filename(PAPERS[1])).write_bytes(b"%PDF")
+    (tmp_path / "pdfs" / pdf_filename(PAPERS[0])).write_bytes(b"%PDF")
+    (tmp_path / "pdfs" / "added_by_hand.pdf").write_bytes(b"%PDF")
+    (tmp_path / "pdfs" / "notes.txt").write_bytes(b"")
+    assert list(index.iter_papers(PaperQuery(downloaded=True))) == PAPERS[:2]
+    assert list(index.iter_papers(PaperQuery(downloaded=False))) == [PAPERS[2]]
+    # The pdfs of the papers come in the order of the search results, then the others
+    assert index.downloaded_pdfs() == [
+        pdf_filename(PAPERS[0]),
+        pdf_filename(PAPERS[1]),
+        "added_by_hand.pdf",
+    ]
+
+
+def test_downloaded_without_json(tmp_path):
+    os.makedirs(tmp_path / "pdfs")
+    (tmp_path / "pdfs" / "added_by_hand.pdf").write_bytes(b"%PDF")
+    index = PapersIndex(
+        str(tmp_path / "papers.json"),
+        str(tmp_path / "papers.sqlite"),
+        pdf_directory=str(tmp_path / "pdfs"),
+    )
+    assert index.downloaded_pdfs() == ["added_by_hand.pdf"]
+
+
+def test_missing_json(tmp_path):
+    index = PapersIndex(str(tmp_path / "papers.json"), str(tmp_path / "papers.sqlite"))
+    with pytest.raises(FileNotFoundError):
+        index.refresh()
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        (PaperQuery(title="RATES"), [0]),
+        (PaperQuery(title="%"), []),
+        (PaperQuery(author="hopper"), [1]),
+        (PaperQuery(author="lovelace", title="coherence"), []),
+        (PaperQuery(database="scopus"), [1]),
+        (PaperQuery(database="Scop"), []),
+        (PaperQuery(since="2019"), [1]),
+        (PaperQuery(until="2018"), [0]),
+        (PaperQuery(since="2018-11-27", until="2020-01-05"), [0, 1]),
+        (PaperQuery(page=PaperPage(order=PaperOrder.TITLE)), [1, 0, 2]),
+        (PaperQuery(page=PaperPage(order=PaperOrder.DATE, descending=True)), [1, 0, 2]),
+        (PaperQuery(page=PaperPage(descending=True)), [2, 1, 0]),
+        (PaperQuery(page=PaperPage(limit=2)), [0, 1]),
+        (PaperQuery(page=PaperPage(offset=1)), [1, 2]),
+        (PaperQuery(page=PaperPage(order=PaperOrder.TITLE, limit=1, offset=1)), [0]),
+    ],
+)
+def test_query(index, query, expected):
+    assert list(index.iter_papers(query)) == [PAPERS[i] for i in expected]
@@ -0,0 +1,47 @@
+"""Tests for the local embedding model."""
+
+import os
+from unittest.mock import patch
+
+import numpy as np
+
+from paperplumber.parsing.batch_embedding import BatchEmbedder
+from paperplumber.parsing.embedding_search import EmbeddingSearcher, default_embedder
+from paperplumber.parsing.local_embedding import HashingEmbeddings
+from paperplumber.parsing.options import EmbeddingBackend
+
+PDF_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plaxco1997.pdf")
+
+
+def test_hashing_embeddings():
+    embedder = HashingEmbeddings(size=64)
+    texts = [
+        "the folding rate of proteins",
+        "folding rates of a protein",
+        "",
+        "magnetic flux",
+    ]
+    vectors = np.array(embedder.embed_documents(texts))
+    assert vectors.shape == (4, 64)
+    assert np.allclose(np.linalg.norm(vectors[[0, 1, 3]], axis=1), 1.0)
+    assert not vectors[2].any()
+
+    # Texts sharing words are closer, and the vectors are deterministic
+    assert vectors[0] @ vectors[1] > vectors[0] @ vectors[3]
+    assert embedder.embed_query(texts[0]) == vectors[0].tolist()
+    assert embedder.model == "hashing-64"
+
+
+def test_hashing_search_is_local():
+    with patch(
+        "paperplumber.parsing.embedding_search.OpenAIEmbeddings",
+        side_effect=AssertionError,
+    ):
+        embedder = default_embedder(EmbeddingBackend.HASHING)
+    searcher = EmbeddingSearcher(PDF_PATH, embedder=embedder)
+    EmbeddingSearcher.embed_all([searcher], BatchEmbedder(embedder))
+
+    # The batches are sized by counting words, without downloading any tokenizer
+    pages = searcher.similarity_search("proline isomerization", k=2)
+    assert any("proline" in page.page_content.lower() for page in pages)
+    assert searcher.embedding_model_name == "hashing-1024"
@@ -0,0 +1,74 @@
+"""Tests for the manifest of the parsed pdf files."""
+
+import os
+
+from paperplumber.parsing.manifest import ParseManifest
+
+SETTINGS = {"model": "a", "templates": ["1"]}
+
+
+def write(path, content):
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(content)
+    return str(path)
+
+
+def test_pending_targets(tmp_path):
+    pdf_paths = {
+        "a.pdf": write(tmp_path / "a.pdf", "a"),
+        "b.pdf": write(tmp_path / "b.pdf", "b"),
+    }
+    manifest = ParseManifest(str(tmp_path / "manifest.json"))
+    assert manifest.pending(pdf_paths, ["rate"], SETTINGS) == {
+        "a.pdf": ["rate"],
+        "b.pdf": ["rate"],
+    }
+
+    manifest.record("a.pdf", pdf_paths["a.pdf"], ["rate"], SETTINGS)
+    manifest.save()
+
+    manifest = ParseManifest(str(tmp_path / "manifest.json"))
+    assert manifest.targets("a.pdf") == ["rate"]
+    assert manifest.pending(pdf_paths, ["rate"], SETTINGS) == {"b.pdf": ["rate"]}
+    # New targets, and targets parsed with other settings, are pending
+    assert manifest.pending(pdf_paths, ["rate", "temperature"], SETTINGS) == {
+        "a.pdf": ["temperature"],
+        "b.pdf": ["rate", "temperature"],
+    }
+    assert manifest.pending(pdf_paths, ["rate"], {**SETTINGS, "model": "b"}) == {
+        "a.pdf": ["rate"],
+        "b.pdf": ["rate"],
+    }
+
+
+def test_changed_pdfs(tmp_path):
+    pdf_path = write(tmp_path / "a.pdf", "a")
+    manifest = ParseManifest(str(tmp_path / "manifest.json"))
+    manifest.record("a.pdf", pdf_path, ["rate"], SETTINGS)
+    manifest.save()
+
+    # Touching the file does not change it
+    os.utime(pdf_path, ns=(0, 12345))
+    assert ParseManifest(str(tmp_path / "manifest.json")).is_unchanged("a.pdf", pdf_path)
+
+    # Changing its contents does, even with the same size
+    write(pdf_path, "b")
+    manifest = ParseManifest(str(tmp_path / "manifest.json"))
+    assert manifest.pending({"a.pdf": pdf_path}, ["rate"], SETTINGS) == {
+        "a.pdf": ["rate"]
+    }
+
+    # The targets parsed in the previous contents are forgotten
+    manifest.record("a.pdf", pdf_path, ["temperature"], SETTINGS)
+    assert manifest.targets("a.pdf") == ["temperature"]
+
+
+def test_prune_and_clear(tmp_path):
+    manifest = ParseManifest(str(tmp_path / "manifest.json"))
+    for name in ("a.pdf", "b.pdf"):
+        manifest.record(name, write(tmp_path / name, name), ["rate"], SETTINGS)
+
+    manifest.prune(["b.pdf"])
+    assert manifest.papers == ["b.pdf"]
+    manifest.clear()
+    assert manifest.papers == []
@@ -0,0 +1,88 @@
+"""Tests for the adaptive selection of the pages found by a search."""
+
+import os
+
+from langchain.docstore.document import Document
+from langchain.embeddings.fake import FakeEmbeddings
+from typer.testing import CliRunner
+
+from paperplumber import main
+from paperplumber.parsing.embedding_search import EmbeddingSearcher
+from paperplumber.parsing.lexical_search import LexicalSearcher
+from paperplumber.parsing.page_selection import PageSelection
+
+PDF_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plaxco1997.pdf")
+
+
+def _scored(*scores):
+    return [
+        (Document(page_content=f"page {i} text", metadata={"page": i}), score)
+        for i, score in enumerate(scores)
+    ]
+
+
+def test_default_selection_keeps_two_pages():
+    scored = _scored(0.9, 0.1, 0.05)
+    assert [doc.metadata["page"] for doc in PageSelection().select(scored)] == [0, 1]
+    assert PageSelection().select([]) == []
+
+
+def test_threshold_and_relative_drop():
+    scored = _scored(0.9, 0.85, 0.6, 0.3)
+
+    selection = PageSelection(min_k=1, max_k=4, score_threshold=0.5)
+    assert [doc.metadata["page"] for doc in selection.select(scored)] == [0, 1, 2]
+
+    selection = PageSelection(min_k=1, max_k=4, relative_drop=0.1)
+    assert [doc.metadata["page"] for doc in selection.select(scored)] == [0, 1]
+
+    # The first min_k pages are always kept, and never more than max_k
+    selection = PageSelection(min_k=2, max_k=3, score_threshold=0.95)
+    assert [doc.metadata["page"] for doc in selection.select(scored)] == [0, 1]
+    selection = PageSelection(min_k=1, max_k=3, score_threshold=0.0)
+    assert len(selection.select(scored)) == 3
+
+
+def test_mmr_skips_near_duplicates():
+    scored = [
+        (Document(page_content="the folding rate of protein L is fast"), 0.9),
+        (Document(page_content="the folding rate of protein L is fast too"), 0.85),
+        (Document(page_content="unfolding kinetics measured by stopped flow"), 0.8),
+    ]
+    selection = PageSelection(min_k=2, max_k=2, mmr_lambda=0.5)
+    assert selection.fetch_k == 4
+    assert selection.select(scored) == [scored[0][0], scored[2][0]]
+
+    # Without MMR, the pages are kept in the order of their scores
+    assert PageSelection().select(scored) == [scored[0][0], scored[1][0]]
+
+
+def test_search_with_scores():
+    searcher = LexicalSearcher(PDF_PATH)
+    scored = searcher.similarity_search_with_score("proline isomerization", k=4)
+    scores = [score for _, score in scored]
+    assert scores == sorted(scores, reverse=True)
+    assert [doc for doc, _ in scored] == searcher.similarity_search(
+        "proline isomerization", k=4
+    )
+
+    selection = PageSelection(min_k=1, max_k=4, score_threshold=scores[1])
+    assert selection.search(searcher, "proline isomerization") == [
+        doc for doc, _ in scored[:2]
+    ]
+
+    searcher = EmbeddingSearcher(PDF_PATH, embedder=FakeEmbeddings(size=16))
+    scored = searcher.similarity_search_with_score("proline isomerization", k=3)
+    assert len(scored) == 3
+    assert [score for _, score in scored] == sorted(
+        (score for _, score in scored), reverse=True
+    )
+
+
+def test_parse_rejects_min_pages_above_max_pages(tmp_path):
+    result = CliRunner().invoke(
+        main.app,
+        ["parse", str(tmp_path), "rate", "--min-pages", "8", "--max-pages", "3"],
+    )
+    assert result.exit_code == 1
+    assert "--min-pages must not be larger than --max-pages" in result.output
@@ -0,0 +1,78 @@
+"""Tests for the PDFParser class."""
+
+import os
+from unittest.mock import patch
+
+import pytest
+
+from paperplumber.cache import DiskCache
+from paperplumber.parsing.pdf_parser import PageRange, PDFParser
+
+PDF_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "maxwell2005.pdf")
+
+
+def test_pages():
+    parser = PDFParser(PDF_PATH)
+    assert len(parser.pages) > 0
+    assert all(page.page_content for page in parser.pages)
+
+
+def test_page_cache(tmp_path):
+    cache = DiskCache(str(tmp_path / "pages"))
+    parser = PDFParser(PDF_PATH, page_cache=cache)
+    assert cache.misses == 1
+
+    # A cached document must not go through the backend again
+    with patch.object(PDFParser, "_get_loader", side_effect=AssertionError):
+        cached_parser = PDFParser(PDF_PATH, page_cache=cache)
+
+    assert cache.hits == 1
+    assert cached_parser._loader is None
+    assert [page.page_content for page in cached_parser.pages] == [
+        page.page_content for page in parser.pages
+    ]
+    assert [page.metadata for page in cached_parser.pages] == [
+        page.metadata for page in parser.pages
+    ]
+
+
+def test_missing_file():
+    with pytest.raises(FileNotFoundError):
+        PDFParser("missing.pdf")
+
+
+def test_page_range(tmp_path):
+    parser = PDFParser(PDF_PATH, page_range=PageRange(2, 3))
+    assert {page.metadata["page"] for page in parser.pages} == {1, 2}
+    numbers = {page.metadata["page"] for page in PDFParser(PDF_PATH).pages}
+    assert parser.page_count == len(numbers)
+
+    # The pages of other ranges are cached apart
+    cache = DiskCache(str(tmp_path / "pages"))
+    PDFParser(PDF_PATH, page_cache=cache)
+    PDFParser(PDF_PATH, page_cache=cache, page_range=PageRange(2, 3))
+    assert cache.misses == 2
+
+    assert PageRange.parse("3-50") == PageRange(3, 50)
+    assert PageRange.parse("3-") == PageRange(3, None)
+    assert PageRange.parse("7") == PageRange(7, 7)
+    assert list(PageRange(3).indexes(5)) == [2, 3, 4]
+    with pytest.raises(ValueError):
+        PageRange.parse("5-2")
+    with pytest.raises(ValueError):
+        PageRange.parse("first")
+
+
+def test_lazy_pages():
+    pages = PDFParser(PDF_PATH).pages
+    with patch.object(PDFParser, "_get_loader", side_effect=AssertionError):
+        parser = PDFParser(PDF_PATH, lazy=True)
+        streamed = list(parser.iter_pages())
+
+    # The pages are streamed from pdfium without being kept, and equal the extracted ones
+    assert parser._page_list is None
+    assert [page.page_content for page in streamed] == [
+        page.page_content for page in pages
+    ]
+    assert [page.metadata for page in streamed] == [page.metadata for page in pages]
+    assert len(parser.pages) == len(pages)
@@ -0,0 +1,85 @@
+"""Tests for the pipeline of concurrent stages."""
+
+import threading
+import time
+
+from paperplumber.parsing.pipeline import Failure, Pipeline, Stage
+
+
+def test_pipeline_runs_every_item_through_the_stages():
+    pipeline = Pipeline(
+        [
+            Stage("double", lambda x: 2 * x, workers=3),
+            Stage("increment", lambda x: x + 1, workers=2),
+        ],
+        queue_size=2,
+    )
+    assert sorted(pipeline.run(range(20))) == [2 * x + 1 for x in range(20)]
+
+    stats = pipeline.stats()
+    assert list(stats) == ["double", "increment"]
+    assert stats["double"]["processed"] == stats["increment"]["processed"] == 20
+    assert stats["double"]["workers"] == 3
+    assert stats["increment"]["queue_depth"] == 0
+
+
+def test_failures_skip_the_remaining_stages():
+    def check(x):
+        if x == 3:
+            raise ValueError("three")
+        return x
+
+    seen = []
+    pipeline = Pipeline([Stage("check", check), Stage("record", seen.append)])
+    results = list(pipeline.run(range(5)))
+
+    failures = [result for result in results if isinstance(result, Failure)]
+    assert len(failures) == 1
+    assert failures[0].item == 3
+    assert failures[0].stage == "check"
+    assert sorted(seen) == [0, 1, 2, 4]
+    assert pipeline.stats()["check"]["failed"] == 1
+
+
+def test_batch_stage_gets_the_waiting_items():
+    batches = []
+    gate = threading.Event()
+
+    def wait(x):
+        gate.wait()
+        return x
+
+    def collect(items):
+        batches.append(len(items))
+        return items
+
+    pipeline = Pipeline(
+        [Stage("wait", wait), Stage("collect", collect, batch_size=4)], queue_size=8
+    )
+    results = pipeline.run(range(10))
+    gate.set()
+    assert sorted(results) == list(range(10))
+    assert sum(batches) == 10
+    assert max(batches) <= 4
+
+
+def test_bounded_queues_apply_backpressure():
+    in_flight = []
+    fed = []
+
+    def items():
+        for i in range(30):
+            fed.append(i)
+            yield i
+
+    def slow(x):
+        in_flight.append(len(fed) - x)
+        time.sleep(0.002)
+        return x
+
+    pipeline = Pipeline([Stage("fast", lambda x: x), Stage("slow", slow)], queue_size=2)
+    assert sorted(pipeline.run(items())) == list(range(30))
+
+    # The feeder never gets far ahead of the slow stage
+    assert max(in_flight) <= 2 + 2 + 3
+    assert pipeline.stats()["slow"]["max_queue_depth"] <= 2
@@ -0,0 +1,38 @@
+"""Tests for the pre-filter of the pages read by the language model."""
+
+from langchain.docstore.document import Document
+
+from paperplumber.parsing.prefilter import NUMBER_WITH_UNIT_PATTERN, PreFilter
+
+
+def test_numbers_with_units():
+    for text in ("20 µs", "4.2 K", "3 GHz", "99.5 %", "12 kcal/mol", "5 s−1", "at 25 °C"):
+        assert NUMBER_WITH_UNIT_PATTERN.search(text), text
+    for text in ("1,000", "in 2019 we", "page 3 of"):
+        assert not NUMBER_WITH_UNIT_PATTERN.search(text), text
+
+
+def test_score():
+    prefilter = PreFilter()
+    target = "folding rate"
+    assert prefilter.score("The folding rates are 5 s-1 at 25 °C.", target) == 2.25
+    assert prefilter.score("The rate was 4 s-1.", target) == 0.75
+    assert prefilter.score("Proteins fold, and folding has a rate.", target) == 1.0
+    assert prefilter.score("Nothing to see here.", target) == 0.0
+
+    references = "References\n" + "\n".join(
+        f"[{i}] Smith et al. (2001) on folding rates" for i in range(6)
+    )
+    assert prefilter.score(references, target) < 1
+
+
+def test_filter_keeps_the_order():
+    pages = [
+        Document(page_content=text)
+        for text in ("folding rate of 3 s-1", "no value", "rate of folding")
+    ]
+    assert [page.page_content for page in PreFilter().filter(pages, "folding rate")] == [
+        "folding rate of 3 s-1",
+        "rate of folding",
+    ]
+    assert PreFilter(threshold=2).filter(pages, "folding rate") == pages[:1]
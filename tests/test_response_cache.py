@@ -0,0 +1,80 @@
+"""Tests for the ResponseCache class."""
+
+import multiprocessing
+import time
+
+from paperplumber.parsing.response_cache import ResponseCache
+
+
+def test_key_normalizes_text():
+    key = ResponseCache.key("model", "v1", "rate", "The rate is\n 240 s^-1 ")
+    assert key == ResponseCache.key("model", "v1", "rate", "The rate is 240 s^-1")
+    assert key != ResponseCache.key("model", "v2", "rate", "The rate is 240 s^-1")
+    assert key != ResponseCache.key("other", "v1", "rate", "The rate is 240 s^-1")
+
+
+def test_get_and_put(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    assert cache.get("key") is None
+    cache.put("key", "240 s^-1", "v1")
+    assert cache.get("key") == "240 s^-1"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # The responses are persisted
+    cache.close()
+    assert ResponseCache(str(tmp_path / "responses.sqlite")).get("key") == "240 s^-1"
+
+
+def test_ttl(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"), ttl=0.05)
+    cache.put("key", "NA", "v1")
+    assert cache.get("key") == "NA"
+    time.sleep(0.1)
+    assert cache.get("key") is None
+
+
+def test_max_entries(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    cache = ResponseCache(path)
+    for i in range(5):
+        cache.put(str(i), "NA", "v1")
+        time.sleep(0.001)
+    cache.get("0")
+
+    # The least recently used entries are evicted when the cache is opened
+    cache = ResponseCache(path, max_entries=2)
+    assert len(cache) == 2
+    assert cache.get("0") == "NA"
+    assert cache.get("4") == "NA"
+
+
+def test_invalidate(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    cache.put("old", "NA", "v1")
+    cache.put("new", "NA", "v2")
+    assert cache.invalidate(["v2"]) == 1
+    assert cache.get("old") is None
+    assert cache.get("new") == "NA"
+    assert cache.invalidate() == 1
+    assert len(cache) == 0
+
+
+def _fill(path, first):
+    cache = ResponseCache(path)
+    for i in range(first, first + 50):
+        cache.put(str(i), str(i), "v1")
+
+
+def test_concurrent_processes(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    ResponseCache(path).close()
+    processes = [
+        multiprocessing.Process(target=_fill, args=(path, first))
+        for first in (0, 50, 100)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    assert len(ResponseCache(path)) == 150
@@ -0,0 +1,134 @@
+"""Tests for the append-only file of parse results."""
+
+import json
+import os
+import shutil
+
+from paperplumber import main
+from paperplumber.parsing.results_file import ResultsFile
+
+TESTS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_append_and_resume(tmp_path):
+    path = str(tmp_path / "output.jsonl")
+    with ResultsFile(path) as results_file:
+        results_file.append("a.pdf", {"rate": ["1"], "temperature": []})
+        results_file.append("b.pdf", {"rate": ["2"]})
+
+    # The lines are on the disk as soon as they are written
+    with open(path, "r", encoding="utf-8") as file:
+        assert len(file.readlines()) == 2
+
+    results_file = ResultsFile(path)
+    assert results_file.completed(["rate"]) == {"a.pdf", "b.pdf"}
+    assert results_file.completed(["rate", "temperature"]) == {"a.pdf"}
+
+
+def test_later_lines_override_earlier_ones(tmp_path):
+    results_file = ResultsFile(str(tmp_path / "output.jsonl"))
+    results_file.append("b.pdf", {"rate": ["1"], "temperature": ["3"]})
+    results_file.append("a.pdf", {"rate": []})
+    results_file.append("b.pdf", {"rate": ["2"]})
+    results_file.close()
+
+    assert results_file.values() == {
+        "a.pdf": {"rate": []},
+        "b.pdf": {"rate": ["2"], "temperature": ["3"]},
+    }
+    assert results_file.values(papers=["b.pdf"], targets=["rate"]) == {
+        "b.pdf": {"rate": ["2"]}
+    }
+
+
+def test_incomplete_last_line_is_dropped(tmp_path):
+    path = str(tmp_path / "output.jsonl")
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(json.dumps({"paper": "a.pdf", "values": {"rate": ["1"]}}) + "\n")
+        file.write('{"paper": "b.pdf", "val')
+
+    results_file = ResultsFile(path, fsync=True)
+    assert results_file.completed(["rate"]) == {"a.pdf"}
+
+    results_file.append("b.pdf", {"rate": ["2"]})
+    results_file.close()
+    assert list(results_file.values()) == ["a.pdf", "b.pdf"]
+
+
+def test_consolidate_and_clear(tmp_path):
+    results_file = ResultsFile(str(tmp_path / "output.jsonl"))
+    results_file.append("b.pdf", {"rate": ["2"], "old": ["x"]})
+    results_file.append("a.pdf", {"rate": ["1"], "old": ["y"]})
+
+    output_path = str(tmp_path / "output.json")
+    results_file.consolidate(output_path, targets=["rate"])
+    with open(output_path, "r", encoding="utf-8") as file:
+        assert json.load(file) == {"a.pdf": {"rate": ["1"]}, "b.pdf": {"rate": ["2"]}}
+
+    results_file.clear()
+    assert results_file.completed(["rate"]) == set()
+
+
+def test_targets_by_paper(tmp_path):
+    results_file = ResultsFile(str(tmp_path / "output.jsonl"))
+    results_file.append("a.pdf", {"rate": ["1"], "old": ["x"]})
+    results_file.append("b.pdf", {"rate": ["2"], "old": ["y"]})
+    results_file.close()
+
+    assert results_file.values(targets={"a.pdf": ["rate", "old"], "b.pdf": ["rate"]}) == {
+        "a.pdf": {"rate": ["1"], "old": ["x"]},
+        "b.pdf": {"rate": ["2"]},
+    }
+
+
+def test_resume_only_from_the_same_settings_and_pdfs(tmp_path):
+    results_file = ResultsFile(str(tmp_path / "output.jsonl"))
+    results_file.append("a.pdf", {"rate": ["1"]}, "key", "hash-a")
+    results_file.append("b.pdf", {"rate": ["2"]}, "key", "hash-b")
+    results_file.append("c.pdf", {"rate": ["3"]})
+    results_file.close()
+
+    # The records without settings, and of a changed pdf, are parsed again
+    hashes = {"a.pdf": "hash-a", "b.pdf": "changed"}
+    assert results_file.completed(["rate"], "key", hashes.get) == {"a.pdf"}
+    assert results_file.completed(["rate"]) == {"a.pdf", "b.pdf", "c.pdf"}
+    assert results_file.completed(["rate"], "other", hashes.get) == set()
+
+    # Only the values of the current settings are kept
+    results_file.append("b.pdf", {"rate": ["4"]}, "other", "changed")
+    results_file.close()
+    assert results_file.values(settings_key="other") == {"b.pdf": {"rate": ["4"]}}
+
+
+def test_parse_with_other_settings_parses_again(tmp_path):
+    shutil.copytree(os.path.join(TESTS_DIRECTORY, "test_db"), tmp_path / "db")
+    path = str(tmp_path / "db")
+    args = ["parse", path, "rate", "--llm-backend", "fake", "--embedding", "hashing"]
+    args += ["--no-cache"]
+
+    def parse(*options):
+        return main.app(
+            args + list(options), prog_name="paperplumber", standalone_mode=False
+        )
+
+    parse()
+    results_file = ResultsFile(os.path.join(path, "output.jsonl"))
+    [record] = results_file.records()
+
+    # The same settings resume, skipping the parsed paper
+    parse()
+    assert list(results_file.records()) == [record]
+
+    # Other settings parse the paper again, without mixing up the results of both
+    parse("--max-pages", "3")
+    [_, reparsed] = results_file.records()
+    assert reparsed["hash"] == record["hash"]
+    assert reparsed["settings"] != record["settings"]
+    with open(os.path.join(path, "output.json"), encoding="utf-8") as file:
+        assert json.load(file) == {reparsed["paper"]: reparsed["values"]}
+
+    # Back to the first settings, their results are resumed again
+    parse()
+    assert len(list(results_file.records())) == 2
+    with open(os.path.join(path, "output.json"), encoding="utf-8") as file:
+        assert json.load(file) == {record["paper"]: record["values"]}